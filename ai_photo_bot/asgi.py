@@ -3,6 +3,9 @@ ASGI config for ai_photo_bot project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+HTTP goes to Django; the ``lifespan`` scope (which Django does not handle)
+starts the Telegram bot once per process, see bot_api.lifecycle.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -13,4 +16,29 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_photo_bot.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from bot_api import lifecycle  # noqa: E402  (после загрузки приложений Django)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await lifecycle.startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await lifecycle.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,69 @@
+# ai_photo_bot/log.py
+"""
+Логирование без блокировки event loop.
+
+NonBlockingHandler кладёт записи в очередь, а форматирование и запись в
+stderr делает отдельный поток QueueListener. Записи не форматируются в
+вызывающем потоке (prepare не трогает record), поэтому на горячем пути
+logger.info("...", arg) стоит одной проверки уровня и одного put в очередь,
+а отключённые уровни (DEBUG при INFO) — только проверки уровня.
+
+Поток listener'а запускается при первой записи в каждом процессе: после fork
+(prefork-воркер Celery, IMAGE_EXECUTOR=process) потока в дочернем процессе
+нет, и без перезапуска записи копились бы в очереди и терялись.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+
+class NonBlockingHandler(logging.handlers.QueueHandler):
+    def __init__(self, fmt=None, datefmt=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler()
+        self.target.setFormatter(logging.Formatter(fmt, datefmt))
+        self.listener = None
+        self._pid = None  # процесс, в котором работает listener
+        atexit.register(self.stop)
+
+    def enqueue(self, record):
+        # Вызывается под self.lock (Handler.handle), logging пересоздаёт его после fork
+        if self._pid != os.getpid():
+            self._start()
+        super().enqueue(record)
+
+    def _start(self):
+        # Очередь после fork — копия родительской: её записи выведет родитель
+        self.queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток (только в процессе, который его запустил)."""
+        if self._pid == os.getpid():
+            self.listener.stop()
+            self._pid = None
+
+    def prepare(self, record):
+        # Всё в одном процессе, pickle не нужен — форматирует поток listener'а
+        return record
+
+
+class LazyJson:
+    """Сериализует объект в JSON только если запись действительно будет выведена."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, ensure_ascii=False)
+
+
+def sampled(rate):
+    """True для доли rate вызовов (0 — никогда, 1 — всегда)."""
+    return rate > 0 and (rate >= 1 or random.random() < rate)
@@ -0,0 +1,31 @@
+# ai_photo_bot/metrics.py
+"""
+Метрики Prometheus, отдаются на /metrics/.
+
+DatabasePoolCollector читает статистику пула psycopg (get_stats) в момент
+сбора: размер пула, свободные соединения, число ожидающих и суммарное время
+ожидания соединения (requests_wait_ms / requests_queued — среднее ожидание).
+"""
+from django.db import connections
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+
+class DatabasePoolCollector:
+    def collect(self):
+        for alias in connections:
+            pool = getattr(connections[alias], "pool", None)
+            if pool is None:
+                continue
+            for key, value in pool.get_stats().items():
+                metric = GaugeMetricFamily(f"db_pool_{key}", f"psycopg pool stat {key}", labels=["alias"])
+                metric.add_metric([alias], value)
+                yield metric
+
+
+REGISTRY.register(DatabasePoolCollector())
+
+
+def metrics_view(request):
+    return HttpResponse(generate_latest(REGISTRY), content_type=CONTENT_TYPE_LATEST)
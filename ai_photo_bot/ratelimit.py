@@ -0,0 +1,171 @@
+# ai_photo_bot/ratelimit.py
+"""
+Token bucket для лимитов Telegram Bot API.
+
+reserve_*() сразу забирает токен (баланс может уйти в минус) и возвращает,
+сколько секунд нужно подождать перед отправкой, — поэтому одни и те же
+лимиты работают и в asyncio (await asyncio.sleep), и в Celery (time.sleep).
+pause() останавливает все отправки, например на retry_after из ответа 429.
+
+Бакеты:
+    global    — OUTBOX_GLOBAL_RATE в секунду на бота;
+    broadcast — рассылки дополнительно не быстрее OUTBOX_BROADCAST_RATE,
+                остаток глобального лимита всегда достаётся ответам пользователям;
+    чат       — OUTBOX_CHAT_RATE в личном чате, OUTBOX_GROUP_RATE в группе.
+
+Лимит общий для бота и всех процессов Celery, поэтому бакеты хранятся в Redis
+(settings.OUTBOX_RATE_LIMIT = "redis"; токены считает Lua-скрипт атомарно,
+время берётся из Redis). "memory" — бакеты в памяти процесса, годится только
+когда сообщения отправляет один процесс.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from ai_photo_bot.cache import TTLCache
+
+
+def is_group(chat_id):
+    # У групп и каналов chat_id отрицательный или @username
+    return str(chat_id).startswith(("-", "@"))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate  # токенов в секунду
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class ChatBuckets:
+    """Бакеты на каждый чат: личные чаты — private_rate/сек, группы — group_rate/сек."""
+
+    def __init__(self, private_rate, group_rate, burst, maxsize=100000):
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self._buckets = TTLCache(maxsize=maxsize, ttl=600)
+        self._lock = threading.Lock()
+
+    def get(self, chat_id):
+        with self._lock:
+            bucket = self._buckets.get(chat_id)
+            if bucket is None:
+                rate = self.group_rate if is_group(chat_id) else self.private_rate
+                bucket = TokenBucket(rate, self.burst)
+                self._buckets.set(chat_id, bucket)
+            return bucket
+
+
+class MemoryLimits:
+    def __init__(self):
+        self._global = TokenBucket(settings.OUTBOX_GLOBAL_RATE, settings.OUTBOX_GLOBAL_RATE)
+        self._broadcast = TokenBucket(settings.OUTBOX_BROADCAST_RATE, settings.OUTBOX_BROADCAST_RATE)
+        self._chats = ChatBuckets(settings.OUTBOX_CHAT_RATE, settings.OUTBOX_GROUP_RATE, settings.OUTBOX_CHAT_BURST)
+
+    def reserve_chat(self, chat_id):
+        return self._chats.get(chat_id).reserve()
+
+    def reserve_global(self, broadcast=False):
+        wait = self._global.reserve()
+        if broadcast:
+            wait = max(wait, self._broadcast.reserve())
+        return wait
+
+    def pause(self, seconds):
+        self._global.pause(seconds)
+
+
+class RedisLimits:
+    PAUSE_KEY = "outbox:pause"
+
+    # KEYS[1] — ключ паузы, KEYS[2..] — бакеты (хэш tokens/ts),
+    # ARGV — rate (в секунду) и capacity для каждого бакета по порядку.
+    # Возвращает ожидание в миллисекундах строкой (числа из Lua Redis обрезает до целых).
+    _RESERVE_SCRIPT = """
+    local time = redis.call('time')
+    local now = tonumber(time[1]) * 1000 + tonumber(time[2]) / 1000
+    local wait = math.max(redis.call('pttl', KEYS[1]), 0)
+    for i = 2, #KEYS do
+        local rate = tonumber(ARGV[2 * i - 3]) / 1000
+        local capacity = tonumber(ARGV[2 * i - 2])
+        local state = redis.call('hmget', KEYS[i], 'tokens', 'ts')
+        local tokens = tonumber(state[1]) or capacity
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate) - 1
+        redis.call('hset', KEYS[i], 'tokens', tostring(tokens), 'ts', tostring(now))
+        redis.call('pexpire', KEYS[i], math.ceil((capacity - tokens) / rate) + 1000)
+        if tokens < 0 then
+            wait = math.max(wait, -tokens / rate)
+        end
+    end
+    return tostring(wait)
+    """
+
+    # Пауза только продлевается: более короткий retry_after не сокращает текущую
+    _PAUSE_SCRIPT = """
+    if redis.call('pttl', KEYS[1]) < tonumber(ARGV[1]) then
+        redis.call('set', KEYS[1], 1, 'PX', ARGV[1])
+    end
+    return 1
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._redis = redis.from_url(url)
+        self._reserve = self._redis.register_script(self._RESERVE_SCRIPT)
+        self._pause = self._redis.register_script(self._PAUSE_SCRIPT)
+
+    def _take(self, *buckets):
+        keys = [self.PAUSE_KEY, *(key for key, rate, capacity in buckets)]
+        args = [value for key, rate, capacity in buckets for value in (rate, capacity)]
+        return float(self._reserve(keys=keys, args=args)) / 1000
+
+    def reserve_chat(self, chat_id):
+        rate = settings.OUTBOX_GROUP_RATE if is_group(chat_id) else settings.OUTBOX_CHAT_RATE
+        return self._take((f"outbox:chat:{chat_id}", rate, settings.OUTBOX_CHAT_BURST))
+
+    def reserve_global(self, broadcast=False):
+        buckets = [("outbox:global", settings.OUTBOX_GLOBAL_RATE, settings.OUTBOX_GLOBAL_RATE)]
+        if broadcast:
+            buckets.append(("outbox:broadcast", settings.OUTBOX_BROADCAST_RATE, settings.OUTBOX_BROADCAST_RATE))
+        return self._take(*buckets)
+
+    def pause(self, seconds):
+        self._pause(keys=[self.PAUSE_KEY], args=[max(1, int(seconds * 1000))])
+
+
+_limits = None
+_limits_lock = threading.Lock()
+
+
+def get_limits():
+    """Лимиты отправки для текущего процесса (бэкенд из settings.OUTBOX_RATE_LIMIT)."""
+    global _limits
+    with _limits_lock:
+        if _limits is None:
+            if settings.OUTBOX_RATE_LIMIT == "redis":
+                _limits = RedisLimits(settings.OUTBOX_REDIS_URL)
+            elif settings.OUTBOX_RATE_LIMIT == "memory":
+                _limits = MemoryLimits()
+            else:
+                raise ValueError(f"Unknown OUTBOX_RATE_LIMIT: {settings.OUTBOX_RATE_LIMIT!r}")
+        return _limits
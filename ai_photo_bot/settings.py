@@ -12,7 +12,10 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import socket
+
 from dotenv import load_dotenv
+from kombu import Queue
 
 
 # Загружаем .env
@@ -126,6 +129,25 @@ DATABASES = {
     }
 }
 
+# Пул соединений psycopg 3 (Django 5.1+). Без пула — постоянные соединения
+# на поток с проверкой перед использованием.
+DB_POOL = os.getenv("DB_POOL", "1") == "1"
+if DB_POOL:
+    from psycopg_pool import ConnectionPool
+
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),  # ожидание свободного соединения, секунд
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 600)),
+            'check': ConnectionPool.check_connection,  # проверка соединения при выдаче из пула
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -178,6 +200,121 @@ CELERY_RESULT_EXTENDED = True
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 
+# Очереди: у каждой свой воркер в docker-compose.yml со своим пулом,
+# поэтому сборка датасетов не задерживает уведомления об оплате.
+#   notifications — I/O: сообщения в Telegram, обработка платежей (threads)
+#   images        — CPU: подготовка фото и датасетов (prefork)
+#   broadcast     — рассылки пачками: не занимают воркеры уведомлений
+# Само обучение на GPU идёт не в Celery, а в отдельном процессе
+# (manage.py run_training_scheduler, сервис training_scheduler).
+CELERY_TASK_QUEUES = (
+    Queue("notifications"),
+    Queue("images"),
+    Queue("broadcast"),
+)
+CELERY_TASK_DEFAULT_QUEUE = "notifications"
+CELERY_TASK_ROUTES = {
+    "photo_processing.tasks.send_telegram_messages": {"queue": "broadcast"},
+    "photo_processing.tasks.send_telegram_*": {"queue": "notifications"},
+    "photo_processing.tasks.build_training_dataset": {"queue": "images"},
+    "payments.tasks.*": {"queue": "notifications"},
+}
+# Воркер берёт следующую задачу только после текущей — долгие задачи
+# не копятся в буфере занятого процесса
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+
+# Обработка изображений (bot_api.image_executor)
+IMAGE_EXECUTOR = os.getenv("IMAGE_EXECUTOR", "thread")  # thread | process
+IMAGE_EXECUTOR_WORKERS = int(os.getenv("IMAGE_EXECUTOR_WORKERS", os.cpu_count() or 2))
+IMAGE_EXECUTOR_MAX_PENDING = int(os.getenv("IMAGE_EXECUTOR_MAX_PENDING", 16))  # в работе + в очереди
+IMAGE_EXECUTOR_QUEUE_TIMEOUT = float(os.getenv("IMAGE_EXECUTOR_QUEUE_TIMEOUT", 30))  # секунд
+PHOTO_SPOOL_MAX_SIZE = int(os.getenv("PHOTO_SPOOL_MAX_SIZE", 4 * 1024 * 1024))  # больше — на диск
+
+# Кэш состояния пользователя (bot_api.state_cache). Кэш свой в каждом процессе и
+# сбрасывается только в нём, поэтому TTL короткий: это предел, сколько другой
+# процесс может видеть устаревшее состояние
+USER_STATE_CACHE_SIZE = int(os.getenv("USER_STATE_CACHE_SIZE", 10000))
+USER_STATE_CACHE_TTL = int(os.getenv("USER_STATE_CACHE_TTL", 30))  # секунд
+
+# Кэш экранов приглашения (users.views)
+INVITE_SCREEN_CACHE_SIZE = int(os.getenv("INVITE_SCREEN_CACHE_SIZE", 10000))
+INVITE_SCREEN_CACHE_TTL = int(os.getenv("INVITE_SCREEN_CACHE_TTL", 3600))  # секунд
+
+# Минимальный интервал между нажатиями кнопок одного пользователя (bot_api.router)
+CALLBACK_RATE_LIMIT = float(os.getenv("CALLBACK_RATE_LIMIT", 0.5))  # секунд
+
+# edit — экраны рисуются в том же сообщении, reply — новым сообщением (bot_api.navigation)
+BOT_NAVIGATION_MODE = os.getenv("BOT_NAVIGATION_MODE", "edit")
+
+# Лимиты исходящих сообщений Telegram (bot_api.outbox, photo_processing.tasks)
+# Бакеты общие для бота и воркеров: redis, memory — только при одном отправляющем процессе
+OUTBOX_RATE_LIMIT = os.getenv("OUTBOX_RATE_LIMIT", "redis")  # redis | memory
+OUTBOX_REDIS_URL = os.getenv("OUTBOX_REDIS_URL", "redis://localhost:6379/2")
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", 30))  # сообщений в секунду на бота
+OUTBOX_BROADCAST_RATE = float(os.getenv("OUTBOX_BROADCAST_RATE", 20))  # из них на рассылки, остальное — ответам
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", 1))  # в секунду на личный чат
+OUTBOX_GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", 20 / 60))  # в секунду на группу
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", 3))  # сколько можно отправить в чат подряд
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", 3))  # повторов после 429
+
+# HTTP-клиент Celery-задач отправки сообщений (photo_processing.tasks)
+TELEGRAM_HTTP_POOL_SIZE = int(os.getenv("TELEGRAM_HTTP_POOL_SIZE", 10))  # соединений на процесс воркера
+TELEGRAM_HTTP_TIMEOUT = (
+    float(os.getenv("TELEGRAM_HTTP_CONNECT_TIMEOUT", 5)),
+    float(os.getenv("TELEGRAM_HTTP_READ_TIMEOUT", 15)),
+)
+TELEGRAM_BATCH_SIZE = int(os.getenv("TELEGRAM_BATCH_SIZE", 100))  # сообщений в одной задаче рассылки
+
+# Сколько ждать следующих фото альбома перед обработкой (bot_api.albums, bot_api.update_queue)
+ALBUM_COLLECT_DELAY = float(os.getenv("ALBUM_COLLECT_DELAY", 1.5))  # секунд
+
+# Очередь входящих апдейтов (bot_api.update_queue)
+BOT_UPDATE_QUEUE = os.getenv("BOT_UPDATE_QUEUE", "memory")  # memory | redis
+BOT_UPDATE_QUEUE_REDIS_URL = os.getenv("BOT_UPDATE_QUEUE_REDIS_URL", "redis://localhost:6379/1")
+BOT_UPDATE_WORKERS = int(os.getenv("BOT_UPDATE_WORKERS", 8))  # потребителей (шардов по chat_id)
+# Апдейтов шарда в работе одновременно (разные чаты параллельно, включая ждущие своей очереди в чате)
+BOT_UPDATE_SHARD_CONCURRENCY = int(os.getenv("BOT_UPDATE_SHARD_CONCURRENCY", 16))
+BOT_UPDATE_QUEUE_MAXSIZE = int(os.getenv("BOT_UPDATE_QUEUE_MAXSIZE", 1000))  # на шард, только memory
+BOT_UPDATE_DEDUP_TTL = int(os.getenv("BOT_UPDATE_DEDUP_TTL", 3600))  # секунд помнить update_id
+BOT_UPDATE_DRAIN_TIMEOUT = float(os.getenv("BOT_UPDATE_DRAIN_TIMEOUT", 20))  # секунд дообработки при остановке, только memory
+
+
+# Логирование: запись в stderr из отдельного потока (ai_photo_bot.log)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+BOT_UPDATE_LOG_SAMPLE_RATE = float(os.getenv("BOT_UPDATE_LOG_SAMPLE_RATE", 0.01))  # доля апдейтов с дампом (DEBUG)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {
+            "()": "ai_photo_bot.log.NonBlockingHandler",
+            "fmt": "%(asctime)s %(levelname)s %(name)s: %(message)s",
+        },
+    },
+    "root": {"handlers": ["console"], "level": "WARNING"},
+    "loggers": {
+        app: {"handlers": ["console"], "level": LOG_LEVEL, "propagate": False}
+        for app in ("bot_api", "payments", "photo_processing", "users", "runpod_training")
+    },
+}
+
+# Датасет для обучения LoRA (photo_processing.pipeline)
+LORA_TRIGGER_WORD = os.getenv("LORA_TRIGGER_WORD", "ohwx person")
+DATASET_BUILD_WORKERS = int(os.getenv("DATASET_BUILD_WORKERS", os.cpu_count() or 2))
+
+# Планировщик обучения (photo_processing.training, manage.py run_training_scheduler)
+# Имя планировщика: после перезапуска он возвращает в очередь только свои прерванные задачи,
+# поэтому оно должно быть постоянным (в docker-compose задано явно)
+TRAINING_SCHEDULER_ID = os.getenv("TRAINING_SCHEDULER_ID", socket.gethostname())
+TRAINING_SCRIPT_PATH = os.getenv("TRAINING_SCRIPT_PATH", os.path.join(BASE_DIR, "train_lora.py"))
+TRAINING_POOL_MIN_SIZE = int(os.getenv("TRAINING_POOL_MIN_SIZE", 0))  # тёплых инстансов даже без очереди
+TRAINING_POOL_MAX_SIZE = int(os.getenv("TRAINING_POOL_MAX_SIZE", 4))  # одновременно запущенных инстансов
+TRAINING_POOL_IDLE_TIMEOUT = float(os.getenv("TRAINING_POOL_IDLE_TIMEOUT", 300))  # секунд простоя до выключения
+TRAINING_POLL_INTERVAL = float(os.getenv("TRAINING_POLL_INTERVAL", 5))  # секунд между проверками очереди
+TRAINING_PROGRESS_INTERVAL = float(os.getenv("TRAINING_PROGRESS_INTERVAL", 120))  # секунд между сообщениями о прогрессе
+
 
 
 
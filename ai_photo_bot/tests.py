@@ -0,0 +1,55 @@
+import logging
+import os
+import tempfile
+import unittest
+
+from django.test import SimpleTestCase
+
+from ai_photo_bot.log import NonBlockingHandler
+
+
+class NonBlockingHandlerTests(SimpleTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".log")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+        self.handler = NonBlockingHandler(fmt="%(message)s")
+        self.handler.target = logging.FileHandler(self.path)
+        self.addCleanup(self.handler.target.close)
+        self.addCleanup(self.handler.stop)
+
+        self.logger = logging.getLogger("ai_photo_bot.tests.log")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def lines(self):
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_writes_records(self):
+        self.logger.info("first %s", 1)
+        self.logger.debug("skipped")
+        self.handler.stop()
+        self.assertEqual(self.lines(), ["first 1"])
+
+    @unittest.skipUnless(hasattr(os, "fork"), "нужен os.fork")
+    def test_logs_from_forked_child(self):
+        self.logger.info("parent before fork")
+        pid = os.fork()
+        if pid == 0:
+            # Как prefork-воркер: родительского потока listener'а здесь нет
+            try:
+                self.logger.info("child %s", os.getpid())
+                self.handler.stop()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.logger.info("parent after fork")
+        self.handler.stop()
+
+        self.assertEqual(
+            sorted(self.lines()), sorted(["parent before fork", f"child {pid}", "parent after fork"])
+        )
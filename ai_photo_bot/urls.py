@@ -18,9 +18,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from ai_photo_bot.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path("metrics/", metrics_view, name="metrics"),
     path("bot/", include("bot_api.urls")),
     path("payments/", include("payments.urls")),
 ]
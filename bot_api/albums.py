@@ -0,0 +1,110 @@
+# bot_api/albums.py
+"""
+Сборка альбомов (media group) из отдельных апдейтов.
+
+Telegram присылает альбом из 10 фото как 10 отдельных апдейтов с одним
+media_group_id. Собирает их потребитель очереди апдейтов своего шарда
+(bot_api.update_queue): апдейты альбома копятся, пока не пройдёт
+ALBUM_COLLECT_DELAY секунд без новых фото, не наберётся ALBUM_MAX_SIZE или не
+придёт другой апдейт из того же чата. Потом альбом обрабатывается как один
+апдейт — по порядку с остальными апдейтами чата и в своём ThreadSensitiveContext.
+
+Application получает первый апдейт альбома с фото (lead), а все сообщения
+альбома обработчик берёт через messages_of(). В альбоме бывают и видео: у них
+message.photo пустой, поэтому фото из альбома выбирает photo_messages().
+"""
+import contextlib
+import contextvars
+import time
+
+from django.conf import settings
+
+# Больше 10 элементов в альбоме Telegram не бывает
+ALBUM_MAX_SIZE = 10
+
+_current = contextvars.ContextVar("album_messages", default=None)
+
+
+def media_group_of(data):
+    """media_group_id сообщения из сырого апдейта или None."""
+    message = data.get("message")
+    return message.get("media_group_id") if message else None
+
+
+@contextlib.contextmanager
+def bind(messages):
+    """На время обработки альбома делает его сообщения доступными через messages_of()."""
+    token = _current.set(messages)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def messages_of(message):
+    """Все сообщения альбома, в который входит message, в порядке поступления."""
+    messages = _current.get()
+    if messages and message in messages:
+        return messages
+    return [message]
+
+
+def lead(updates):
+    """Апдейт, с которым альбом идёт в Application: первый с фото, чтобы сработал фильтр PHOTO."""
+    for update in updates:
+        if update.message and update.message.photo:
+            return update
+    return updates[0]
+
+
+def photo_messages(messages):
+    """Сообщения альбома с фото (видео и документы пропускаем)."""
+    return [message for message in messages if message.photo]
+
+
+class Album:
+    def __init__(self, chat_id, media_group_id):
+        self.chat_id = chat_id
+        self.media_group_id = media_group_id
+        self.items = []
+        self.deadline = None
+
+
+class AlbumBuffer:
+    """Собираемые альбомы одного шарда: не больше одного на чат."""
+
+    def __init__(self):
+        self._albums = {}  # chat_id -> Album
+
+    def get(self, chat_id):
+        return self._albums.get(chat_id)
+
+    def pop(self, chat_id):
+        return self._albums.pop(chat_id, None)
+
+    def add(self, chat_id, media_group_id, item):
+        """Добавляет апдейт в альбом чата. Возвращает альбом, если он набрал ALBUM_MAX_SIZE."""
+        album = self._albums.get(chat_id)
+        if album is None:
+            album = self._albums[chat_id] = Album(chat_id, media_group_id)
+        album.items.append(item)
+        album.deadline = time.monotonic() + settings.ALBUM_COLLECT_DELAY
+        if len(album.items) >= ALBUM_MAX_SIZE:
+            return self._albums.pop(chat_id)
+        return None
+
+    def expired(self):
+        """Забирает альбомы, в которые ALBUM_COLLECT_DELAY секунд не приходило фото."""
+        now = time.monotonic()
+        ready = [chat_id for chat_id, album in self._albums.items() if album.deadline <= now]
+        return [self._albums.pop(chat_id) for chat_id in ready]
+
+    def timeout(self, limit):
+        """Сколько можно ждать следующий апдейт, не задерживая сборку альбомов."""
+        if not self._albums:
+            return limit
+        deadline = min(album.deadline for album in self._albums.values())
+        return max(0.0, min(limit, deadline - time.monotonic()))
+
+    def clear(self):
+        self._albums.clear()
@@ -1,17 +1,28 @@
 # bot_api/bot.py
+import asyncio
+import logging
 import os
-import io
-from bot_api import resize_provider
+from bot_api import albums, downloads, image_executor, state_cache
+from bot_api.navigation import show_screen
+from bot_api.outbox import TelegramRateLimiter
+from bot_api.router import CallbackRouter, rate_limit
+from bot_api.queries import (
+    MAX_PHOTOS,
+    CLAIM_CREATED,
+    CLAIM_DUPLICATE,
+    CLAIM_LIMIT,
+    CLAIM_UNPAID,
+    claim_photo_slots,
+)
 from asgiref.sync import sync_to_async
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 )
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from PIL import Image
-from django.core.files.base import ContentFile
+from django.core.files import File
 
 
-from users.models import Referral
+from users.queries import register_referral
 from users.views import (
     get_first_screen,
     get_second_screen,
@@ -20,88 +31,45 @@ from users.views import (
     get_support_screen,
     get_payment_screen,
     get_upload_instructions_screen,
+    button,
+    language_of,
 )
 
-from bot_api.models import UserPhoto
-from payments.models import Payment
+from payments import ledger
+from photo_processing.tasks import build_training_dataset
+
 
+logger = logging.getLogger(__name__)
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-application = Application.builder().token(TOKEN).build()
+# Все запросы к Bot API проходят через общий планировщик с лимитами Telegram
+application = Application.builder().token(TOKEN).rate_limiter(TelegramRateLimiter()).build()
 DOMAIN_NAME = os.getenv("DOMAIN_NAME", "localhost")
 BASE_URL = f"https://{DOMAIN_NAME}"
 
-@sync_to_async
-def get_payment(chat_id):
-    try:
-        return Payment.objects.get(telegram_user_id=chat_id)
-    except Payment.DoesNotExist:
-        return None
-    
-def process_payment(telegram_user_id):
+def process_payment(telegram_user_id, event_id):
     """
-    Проверяем, есть ли оплаченный реферал, и начисляем бонус.
+    Проводит оплату через журнал payments.ledger (начисление, статус paid,
+    бонус пригласившему). event_id — уникальный id оплаты (например, id
+    события Stripe): повторный вызов с тем же id ничего не начисляет.
     """
-    print(f"🔄 Обрабатываем оплату для {telegram_user_id}...")
-    
-    payment = Payment.objects.filter(telegram_user_id=telegram_user_id, status="pending").first()
-    if not payment:
-        print(f"❌ Платёж для {telegram_user_id} не найден или уже обработан.")
-        return
-
-    payment.status = "paid"
-    payment.save()
-    print(f"✅ Платёж для {telegram_user_id} обновлён на 'paid'.")
-
-    # Проверяем, был ли он рефералом
-    referral = Referral.objects.filter(referred_user_id=telegram_user_id, is_paid=False).first()
-    if referral:
-        referral.is_paid = True
-        referral.save()
-        print(f"✅ Реферал {telegram_user_id} оплачен! Начисляем бонус {referral.user_id}.")
-
-        # Начисляем бонус пригласившему
-        referrer_id = referral.user_id
-        referrer_payment = Payment.objects.filter(telegram_user_id=referrer_id).first()
-        if referrer_payment:
-            referrer_payment.status = "bonus"
-            referrer_payment.save()
-            print(f"🎉 Бонус начислен пригласившему {referrer_id}!")
+    if ledger.apply_payment(event_id, telegram_user_id):
+        logger.info("✅ Платёж %s для %s проведён.", event_id, telegram_user_id)
     else:
-        print(f"❌ Пользователь {telegram_user_id} не найден в рефералах.")
-
-
-@sync_to_async
-def count_photos(user_id):
-    return UserPhoto.objects.filter(user_id=user_id).count()
-
-@sync_to_async
-def exists_photo(user_id, file_unique_id):
-    return UserPhoto.objects.filter(user_id=user_id, file_unique_id=file_unique_id).exists()
-
-@sync_to_async
-def create_photo(user_id, file_id, file_unique_id, processed_file):
-    return UserPhoto.objects.create(
-        user_id=user_id,
-        file_id=file_id,
-        file_unique_id=file_unique_id,
-        image=processed_file
-    )
-
-@sync_to_async
-def register_referral(telegram_user_id, referral_code):
-
-    referral = Referral.objects.filter(referral_code=referral_code, referred_user_id__isnull=True).first()
-    if referral and referral.user_id != telegram_user_id:  # Исключаем самоприглашение
-        referral.referred_user_id = telegram_user_id
-        referral.save()
-        print(f"✅ Record referal: {telegram_user_id} from {referral.user_id}")
-        return True
-    print(f"❌ Can't write referal {telegram_user_id} using code: {referral_code}")
-    return False
+        logger.info("❌ Платёж %s для %s уже проведён.", event_id, telegram_user_id)
+
+
+async def store_photos(user_id, photos):
+    """claim_photo_slots + обновление кэша состояния для принятых фото."""
+    results, count = await claim_photo_slots(user_id, photos)
+    for (file_id, file_unique_id, processed_file), result in zip(photos, results):
+        if result == CLAIM_CREATED:
+            state_cache.photo_added(user_id, file_unique_id)
+    return results, count
 
 async def start_command(update: Update, context):
     chat_id = update.message.chat_id
+    lang = language_of(update)
     args = context.args  
 
     referred = False
@@ -109,7 +77,7 @@ async def start_command(update: Update, context):
         referral_code = args[0][4:]
         referred = await register_referral(chat_id, referral_code)
 
-    text, reply_markup = get_first_screen()
+    text, reply_markup = get_first_screen(lang)
     if referred:
         await update.message.reply_text("You joined via a referral link! 🎉")
 
@@ -117,133 +85,215 @@ async def start_command(update: Update, context):
 
 async def fallback_new_user_handler(update: Update, context):
     chat_id = update.message.chat_id
-    payment = await get_payment(chat_id)
-    if payment is None:
-        text, reply_markup = get_first_screen()
+    lang = language_of(update)
+    state = await state_cache.get_state(chat_id)
+    if state.payment_status is None:
+        text, reply_markup = get_first_screen(lang)
         await update.message.reply_text(text=text, reply_markup=reply_markup)
     else:
         await update.message.reply_text("Hello! How can I help you?")
 
-async def button_handler(update: Update, context):
-    query = update.callback_query
-    data = query.data
-    await query.answer()
-
-    if data == "go_to_second_screen":
-        text, reply_markup = get_second_screen()
-        await query.message.reply_text(text=text, reply_markup=reply_markup)
-
-    elif data == "pay":
-        text, reply_markup = get_payment_screen()
-        await query.message.reply_text(text=text, reply_markup=reply_markup)
-
-    elif data == "bank_cards":
-        chat_id = query.message.chat_id
-        payment_url = f"{BASE_URL}/payments/create-checkout-session/?telegram_user_id={chat_id}"
-        keyboard = [[InlineKeyboardButton("Pay now (Stripe)", url=payment_url)]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text(
-            "Click the button below to pay with Stripe.",
-            reply_markup=reply_markup
-        )
-
-    elif data == "how_it_works":
-        text, reply_markup = get_how_it_works_screen()
-        await query.message.reply_text(text=text, reply_markup=reply_markup)
-
-    elif data == "how_it_works_next":
-        text, reply_markup = get_payment_screen()
-        await query.message.reply_text(text=text, reply_markup=reply_markup)
-
-
-    elif data == "go_back":
-        text, reply_markup = get_second_screen()
-        await query.message.reply_text(text=text, reply_markup=reply_markup)
-
-    elif data == "upload_photos":
-        chat_id = query.message.chat_id
-        payment = await get_payment(chat_id)
-        if not payment or payment.status != 'paid':
-            # Если НЕ оплачено, показываем окно с оплатой
-            payment_url = f"{BASE_URL}/payments/create-checkout-session/?telegram_user_id={chat_id}"
-            keyboard = [[InlineKeyboardButton("Pay now", url=payment_url)]]
-            await query.message.reply_text(
-                "Please pay before uploading photos:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        else:
-            # Если ОПЛАЧЕНО, показываем инструкцию
-            text, reply_markup = get_upload_instructions_screen()
-            await query.message.reply_text(text=text, reply_markup=reply_markup)
-
-    elif data == "invite_friends":
-        chat_id = query.message.chat_id
-        text, reply_markup = await get_invite_friends_screen(chat_id)
-        await query.message.reply_text(text=text, reply_markup=reply_markup)
-
-    elif data == "support":
-        text = get_support_screen()
-        await query.message.reply_text(text)
-
-    else:
-        await query.message.reply_text("Unknown action.")
+def payment_url(chat_id):
+    return f"{BASE_URL}/payments/create-checkout-session/?telegram_user_id={chat_id}"
+
+async def require_payment(call_next, update: Update, context, **params):
+    """Middleware: пропускает к обработчику только оплативших."""
+    chat_id = update.callback_query.message.chat_id
+    state = await state_cache.get_state(chat_id)
+    if state.is_paid:
+        return await call_next(update, context, **params)
+
+    # Если НЕ оплачено, показываем окно с оплатой
+    await update.callback_query.answer()
+    keyboard = [
+        [InlineKeyboardButton("Pay now", url=payment_url(chat_id))],
+        [button("back", language_of(update), callback_data="go_back")],
+    ]
+    await show_screen(update, ("Please pay before uploading photos:", InlineKeyboardMarkup(keyboard)))
+
+router = CallbackRouter(rate_limit())
+
+@router.route("go_to_second_screen")
+@router.route("go_back")
+async def show_second_screen(update: Update, context):
+    await show_screen(update, get_second_screen(language_of(update)))
+
+@router.route("pay")
+@router.route("how_it_works_next")
+async def show_payment_screen(update: Update, context):
+    await show_screen(update, get_payment_screen(language_of(update)))
+
+@router.route("bank_cards")
+async def show_stripe_link(update: Update, context):
+    chat_id = update.callback_query.message.chat_id
+    keyboard = [
+        [InlineKeyboardButton("Pay now (Stripe)", url=payment_url(chat_id))],
+        [button("back", language_of(update), callback_data="pay")],
+    ]
+    await show_screen(update, ("Click the button below to pay with Stripe.", InlineKeyboardMarkup(keyboard)))
+
+@router.route("how_it_works")
+async def show_how_it_works_screen(update: Update, context):
+    await show_screen(update, get_how_it_works_screen(language_of(update)))
+
+@router.route("upload_photos", require_payment)
+async def show_upload_instructions(update: Update, context):
+    # Если ОПЛАЧЕНО, показываем инструкцию
+    await show_screen(update, get_upload_instructions_screen(language_of(update)))
+
+@router.route("invite_friends")
+async def show_invite_friends_screen(update: Update, context):
+    chat_id = update.callback_query.message.chat_id
+    await show_screen(update, await get_invite_friends_screen(chat_id, language_of(update)))
+
+@router.route("support")
+async def show_support_screen(update: Update, context):
+    await show_screen(update, get_support_screen(language_of(update)))
+
+@router.fallback()
+async def unknown_action(update: Update, context):
+    # Не заменяем меню сообщением об ошибке — отправляем отдельно
+    await update.effective_chat.send_message("Unknown action.")
+
+async def notify_photo_limit(message, context):
+    # Проверяем, уведомляли ли уже пользователя о превышении лимита
+    if not context.user_data.get("max_photos_notified", False):
+        context.user_data["max_photos_notified"] = True
+        await message.reply_text(f"You have already uploaded the maximum of {MAX_PHOTOS} photos.")
+
+def largest_photo(message):
+    # Извлекаем самое большое фото из списка
+    return max(message.photo, key=lambda p: p.file_size)
+
+async def download_and_process(context, photo):
+    """Скачивает фото и обрабатывает его в пуле. Возвращает File для ImageField."""
+    # Скачиваем файл с серверов Telegram потоково, без буфера на весь файл
+    telegram_file = await context.bot.get_file(photo.file_id)
+    with await downloads.download_to_spool(telegram_file) as source:
+        # Обработка изображения через Pillow в отдельном пуле, чтобы не блокировать event loop
+        output = await image_executor.process_photo(source)
+    return File(output, name=f"{photo.file_unique_id}.jpg")
+
+async def on_upload_complete(user_id, previous_count, current_count):
+    if previous_count < MAX_PHOTOS <= current_count:
+        # Все фото на месте — собираем датасет для обучения
+        await sync_to_async(build_training_dataset.delay)(user_id)
 
 async def handle_photo(update: Update, context):
+    if update.message.media_group_id:
+        # Альбом собирает очередь апдейтов (bot_api.albums) — обрабатываем его разом
+        await handle_album(albums.messages_of(update.message), context)
+        return
+
     user_id = update.message.chat_id
-    payment = await get_payment(user_id)
-    if not payment or payment.status != 'paid':
+    # Быстрые проверки по кэшу; окончательно лимит и дубликаты проверяет claim_photo_slots
+    state = await state_cache.get_state(user_id)
+    if not state.is_paid:
         await update.message.reply_text("Please pay before uploading photos.")
         return
 
-    current_count = await count_photos(user_id)
-    if current_count >= 10:
-        # Проверяем, уведомляли ли уже пользователя о превышении лимита
-        if not context.user_data.get("max_photos_notified", False):
-            context.user_data["max_photos_notified"] = True
-            await update.message.reply_text("You have already uploaded the maximum of 10 photos.")
+    if state.photo_count >= MAX_PHOTOS:
+        await notify_photo_limit(update.message, context)
         return
 
-    # Извлекаем самое большое фото из списка
-    photo_sizes = update.message.photo
-    largest_photo = max(photo_sizes, key=lambda p: p.file_size)
-    file_id = largest_photo.file_id
-    file_unique_id = largest_photo.file_unique_id
-
-    if await exists_photo(user_id, file_unique_id):
+    photo = largest_photo(update.message)
+    if photo.file_unique_id in state.file_unique_ids:
         await update.message.reply_text("⛔ This photo is already uploaded, try another!")
         return
 
     try:
-        # Скачиваем файл с серверов Telegram
-        telegram_file = await context.bot.get_file(file_id)
-        file_bytes = io.BytesIO()
-        await telegram_file.download_to_memory(out=file_bytes)
-        file_bytes.seek(0)
-
-        # Обработка изображения через Pillow
-        image = Image.open(file_bytes)
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-
-        target_size, target_aspect = resize_provider.determine_target_size(image)
-        image = resize_provider.crop_center(image, target_aspect)  # Обрезаем по нужному соотношению
-        image = resize_provider.resize_image(image, target_size)  # Изменяем размер
-
-        output_buffer = io.BytesIO()
-        image.save(output_buffer, format="JPEG", quality=95)
-        output_buffer.seek(0)
-        processed_file = ContentFile(output_buffer.read(), name=f"{file_unique_id}.jpg")
-
-        await create_photo(user_id, file_id, file_unique_id, processed_file)
-        current_count += 1
-        await update.message.reply_text(f"✅ Photo accepted! Uploaded: {current_count}/10")
-    except Exception as e:
-        print(f"❌ Error processing photo: {e}")
+        processed_file = await download_and_process(context, photo)
+
+        results, current_count = await store_photos(user_id, [(photo.file_id, photo.file_unique_id, processed_file)])
+        result = results[0]
+        if result == CLAIM_UNPAID:
+            await update.message.reply_text("Please pay before uploading photos.")
+            return
+        if result == CLAIM_DUPLICATE:
+            await update.message.reply_text("⛔ This photo is already uploaded, try another!")
+            return
+        if result == CLAIM_LIMIT:
+            await notify_photo_limit(update.message, context)
+            return
+
+        await update.message.reply_text(f"✅ Photo accepted! Uploaded: {current_count}/{MAX_PHOTOS}")
+        await on_upload_complete(user_id, current_count - 1, current_count)
+    except image_executor.ExecutorBusy:
+        await update.message.reply_text("⏳ Too many photos are being processed right now, please send this one again in a minute.")
+        return
+    except Exception:
+        logger.exception("❌ Error processing photo for %s", user_id)
         await update.message.reply_text("❌ Error processing photo!")
         return
 
+async def handle_album(messages, context):
+    """
+    Обрабатывает альбом целиком: одна проверка оплаты, параллельная
+    обработка фото, одна вставка через claim_photo_slots и один итоговый ответ.
+    """
+    messages = albums.photo_messages(messages)
+    first = messages[0]
+    user_id = first.chat_id
+    try:
+        state = await state_cache.get_state(user_id)
+        if not state.is_paid:
+            await first.reply_text("Please pay before uploading photos.")
+            return
+
+        if state.photo_count >= MAX_PHOTOS:
+            await notify_photo_limit(first, context)
+            return
+
+        # Отсекаем дубликаты (внутри альбома и уже загруженные) и всё сверх лимита
+        photos, seen, duplicates = [], set(state.file_unique_ids), 0
+        for message in messages:
+            photo = largest_photo(message)
+            if photo.file_unique_id in seen:
+                duplicates += 1
+                continue
+            seen.add(photo.file_unique_id)
+            photos.append(photo)
+        over_limit = max(0, len(photos) - (MAX_PHOTOS - state.photo_count))
+        photos = photos[:len(photos) - over_limit]
+
+        processed = await asyncio.gather(
+            *(download_and_process(context, photo) for photo in photos),
+            return_exceptions=True,
+        )
+        batch, failed = [], 0
+        for photo, result in zip(photos, processed):
+            if isinstance(result, BaseException):
+                logger.error("❌ Error processing photo for %s", user_id, exc_info=result)
+                failed += 1
+            else:
+                batch.append((photo.file_id, photo.file_unique_id, result))
+
+        previous_count = state.photo_count
+        results, current_count = await store_photos(user_id, batch) if batch else ([], previous_count)
+        if CLAIM_UNPAID in results:
+            await first.reply_text("Please pay before uploading photos.")
+            return
+
+        accepted = results.count(CLAIM_CREATED)
+        duplicates += results.count(CLAIM_DUPLICATE)
+        over_limit += results.count(CLAIM_LIMIT)
+
+        lines = [f"✅ Photos accepted: {accepted}. Uploaded: {current_count}/{MAX_PHOTOS}"]
+        if duplicates:
+            lines.append(f"⛔ Already uploaded: {duplicates}")
+        if over_limit:
+            lines.append(f"⚠️ Skipped, over the limit of {MAX_PHOTOS}: {over_limit}")
+        if failed:
+            lines.append(f"❌ Could not be processed: {failed}")
+        await first.reply_text("\n".join(lines))
+
+        await on_upload_complete(user_id, current_count - accepted, current_count)
+    except Exception:
+        logger.exception("❌ Error processing album for %s", user_id)
+        await first.reply_text("❌ Error processing photos!")
+
 
 application.add_handler(CommandHandler("start", start_command))
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, fallback_new_user_handler))
 application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-application.add_handler(CallbackQueryHandler(button_handler))
+application.add_handler(CallbackQueryHandler(router.dispatch))
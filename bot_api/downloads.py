@@ -0,0 +1,56 @@
+# bot_api/downloads.py
+"""
+Потоковое скачивание файлов с серверов Telegram.
+
+Вместо download_to_memory (весь файл в BytesIO, затем ещё одна копия через
+getvalue/read) ответ читается кусками прямо в SpooledTemporaryFile: файл
+остаётся в памяти до PHOTO_SPOOL_MAX_SIZE и уходит на диск, если больше.
+Декодер Pillow затем читает этот файл напрямую, без промежуточных копий.
+"""
+import tempfile
+from urllib.parse import urlparse
+
+import httpx
+from django.conf import settings
+
+CHUNK_SIZE = 64 * 1024
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0))
+    return _client
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def spooled_file():
+    return tempfile.SpooledTemporaryFile(max_size=settings.PHOTO_SPOOL_MAX_SIZE)
+
+
+async def download_to_spool(telegram_file):
+    """Скачивает telegram.File и возвращает файловый объект, перемотанный в начало."""
+    out = spooled_file()
+    try:
+        if urlparse(telegram_file.file_path).scheme in ("http", "https"):
+            async with get_client().stream("GET", telegram_file.file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    out.write(chunk)
+        else:
+            # Локальный Bot API сервер: file_path — путь на диске
+            await telegram_file.download_to_memory(out=out)
+    except BaseException:
+        out.close()
+        raise
+
+    out.seek(0)
+    return out
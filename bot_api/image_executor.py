@@ -0,0 +1,107 @@
+# bot_api/image_executor.py
+"""
+Пул для обработки изображений вне event loop'а.
+
+Pillow-операции (декодирование, ресайз, JPEG-кодирование) занимают сотни
+миллисекунд на фото, поэтому handle_photo отправляет их сюда, а не выполняет
+прямо в async-обработчике. Тип пула выбирается в settings.IMAGE_EXECUTOR
+("thread" или "process"), число задач в работе и в очереди ограничено
+IMAGE_EXECUTOR_MAX_PENDING.
+"""
+import asyncio
+import io
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+
+from bot_api import resize_provider
+
+
+class ExecutorBusy(Exception):
+    """Очередь на обработку переполнена дольше IMAGE_EXECUTOR_QUEUE_TIMEOUT."""
+
+
+_executor = None
+_slots = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if settings.IMAGE_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_EXECUTOR_WORKERS)
+        elif settings.IMAGE_EXECUTOR == "thread":
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_EXECUTOR_WORKERS,
+                thread_name_prefix="image",
+            )
+        else:
+            raise ValueError(f"Unknown IMAGE_EXECUTOR: {settings.IMAGE_EXECUTOR!r}")
+    return _executor
+
+
+def _get_slots():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(settings.IMAGE_EXECUTOR_MAX_PENDING)
+    return _slots
+
+
+async def run(func, *args):
+    """
+    Выполняет func(*args) в пуле и возвращает результат.
+
+    Если в работе уже IMAGE_EXECUTOR_MAX_PENDING задач, вызывающий ждёт
+    свободного слота (backpressure), но не дольше IMAGE_EXECUTOR_QUEUE_TIMEOUT.
+    """
+    slots = _get_slots()
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=settings.IMAGE_EXECUTOR_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ExecutorBusy("Image executor queue is full")
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), func, *args)
+    finally:
+        slots.release()
+
+
+async def process_photo(source):
+    """
+    Обрабатывает фото из файлового объекта source и возвращает файловый
+    объект с готовым JPEG, перемотанный в начало.
+
+    Пул потоков читает source напрямую; процессам файловые объекты не
+    передать, поэтому для "process" содержимое один раз читается в bytes.
+    """
+    if settings.IMAGE_EXECUTOR == "process":
+        source.seek(0)
+        return io.BytesIO(await run(resize_provider.process_photo, source.read()))
+
+    output = io.BytesIO()
+    await run(resize_provider.process_photo_file, source, output)
+    output.seek(0)
+    return output
+
+
+def _warm_worker():
+    # Загружаем плагины Pillow заранее, чтобы первое фото не платило за импорт
+    from PIL import Image
+    Image.init()
+
+
+async def warm_up():
+    """Поднимает все воркеры пула (для процессов — форк и импорт Pillow) до первого фото."""
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    await asyncio.gather(*(
+        loop.run_in_executor(executor, _warm_worker) for _ in range(settings.IMAGE_EXECUTOR_WORKERS)
+    ))
+
+
+def shutdown(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
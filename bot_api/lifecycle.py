@@ -0,0 +1,71 @@
+# bot_api/lifecycle.py
+"""
+Запуск и остановка бота.
+
+startup() вызывается из lifespan-хука ASGI (ai_photo_bot.asgi) один раз при
+старте процесса: инициализирует Application, запускает потребителей очереди
+апдейтов, открывает соединение с БД и поднимает пул обработки изображений.
+Поэтому первый апдейт после деплоя не платит за инициализацию. Вызов
+идемпотентен и защищён блокировкой — если lifespan отключён (runserver),
+webhook вызывает его сам.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+
+from bot_api import downloads, image_executor, update_queue
+from bot_api.bot import application
+
+logger = logging.getLogger(__name__)
+
+_ready = {"bot": False, "db": False, "executor": False}
+_lock = None
+
+
+def is_ready():
+    return all(_ready.values())
+
+
+def status():
+    return {"ready": is_ready(), **_ready}
+
+
+def _ping_db():
+    close_old_connections()
+    connection.ensure_connection()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+async def startup():
+    global _lock
+    if is_ready():
+        return
+    if _lock is None:
+        _lock = asyncio.Lock()
+
+    async with _lock:
+        if not _ready["bot"]:
+            await application.initialize()
+            update_queue.start(application)
+            _ready["bot"] = True
+        if not _ready["db"]:
+            await sync_to_async(_ping_db)()
+            _ready["db"] = True
+        if not _ready["executor"]:
+            await image_executor.warm_up()
+            _ready["executor"] = True
+    logger.info("✅ Bot is ready: %s", _ready)
+
+
+async def shutdown():
+    await update_queue.stop()
+    if _ready["bot"]:
+        await application.shutdown()
+    await downloads.aclose()
+    image_executor.shutdown(wait=False)
+    for key in _ready:
+        _ready[key] = False
+    logger.info("Bot stopped")
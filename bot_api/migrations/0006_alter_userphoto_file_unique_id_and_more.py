@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_api', '0005_alter_userphoto_file_unique_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userphoto',
+            name='file_unique_id',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='userphoto',
+            constraint=models.UniqueConstraint(fields=('user_id', 'file_unique_id'), name='userphoto_user_file_unique'),
+        ),
+    ]
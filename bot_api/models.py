@@ -3,9 +3,15 @@ from django.db import models
 class UserPhoto(models.Model):
     user_id = models.BigIntegerField()
     file_id = models.CharField(max_length=255)
-    file_unique_id = models.CharField(max_length=255, unique=True)
+    file_unique_id = models.CharField(max_length=255)
     image = models.ImageField(upload_to='user_photos/', null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            # Составной индекс для claim_photo_slot: подсчёт и поиск дубликата по user_id
+            models.UniqueConstraint(fields=["user_id", "file_unique_id"], name="userphoto_user_file_unique"),
+        ]
+
     def __str__(self):
         return f"User {self.user_id}: {self.file_unique_id}"
 
@@ -0,0 +1,44 @@
+# bot_api/navigation.py
+"""
+Показ экранов в ответ на нажатие кнопок.
+
+В режиме BOT_NAVIGATION_MODE = "edit" экран рисуется в том же сообщении, на
+котором нажата кнопка (edit_message_text / edit_message_reply_markup), а если
+текст и клавиатура не изменились — запрос в Bot API не отправляется вовсе.
+Если сообщение отредактировать нельзя (старое, без текста, недоступно),
+отправляется новое. В режиме "reply" каждый экран — новое сообщение.
+"""
+from django.conf import settings
+from telegram import Message
+from telegram.error import BadRequest
+
+
+def _editable(message):
+    # Сообщения старше 48 часов приходят как InaccessibleMessage; фото без текста не редактируем
+    return isinstance(message, Message) and message.text is not None
+
+
+async def show_screen(update, screen):
+    """screen — текст или (текст, клавиатура)."""
+    text, reply_markup = screen if isinstance(screen, tuple) else (screen, None)
+    message = update.callback_query.message
+
+    if settings.BOT_NAVIGATION_MODE != "edit" or not _editable(message):
+        await update.effective_chat.send_message(text=text, reply_markup=reply_markup)
+        return
+
+    # Telegram обрезает пробелы по краям текста, сравниваем так же
+    same_text = message.text == text.strip()
+    same_markup = message.reply_markup == reply_markup
+    if same_text and same_markup:
+        return
+
+    try:
+        if same_text:
+            await message.edit_reply_markup(reply_markup=reply_markup)
+        else:
+            await message.edit_text(text=text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return
+        await message.reply_text(text=text, reply_markup=reply_markup)
@@ -0,0 +1,121 @@
+# bot_api/outbox.py
+"""
+Единый планировщик исходящих запросов к Telegram.
+
+TelegramRateLimiter подключается к Application как rate_limiter, поэтому
+через него проходит каждый вызов application.bot — ответы в bot.py,
+редактирование экранов, уведомления из payments. Для методов, которые
+отправляют или меняют сообщения (send*, edit*, copy*, forward*):
+
+- per-chat бакет: не чаще OUTBOX_CHAT_RATE в секунду в личном чате и
+  OUTBOX_GROUP_RATE в группе;
+- глобальный бакет OUTBOX_GLOBAL_RATE в секунду, токены выдаются по
+  приоритету: TRANSACTIONAL (ответы пользователю, оплаты) раньше BROADCAST,
+  а BROADCAST дополнительно не быстрее OUTBOX_BROADCAST_RATE;
+- на 429 (RetryAfter) отправка ставится на паузу на retry_after
+  и запрос повторяется до OUTBOX_MAX_RETRIES раз.
+
+Бакеты общие с Celery-задачами photo_processing.tasks (ai_photo_bot.ratelimit,
+хранятся в Redis), так что лимиты и пауза действуют на все процессы сразу.
+Если Redis не отвечает, LIMITS_RETRY_INTERVAL секунд используются локальные
+бакеты процесса (MemoryLimits), потом снова общие — отправка не встаёт.
+
+Приоритет передаётся через rate_limit_args:
+    await bot.send_message(chat_id, text, rate_limit_args=outbox.BROADCAST)
+"""
+import asyncio
+import itertools
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from ai_photo_bot.ratelimit import MemoryLimits, get_limits
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONAL = 0
+BROADCAST = 1
+
+_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+
+# Сколько секунд после ошибки общих лимитов работать на локальных
+LIMITS_RETRY_INTERVAL = 5
+
+
+def _seconds(retry_after):
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    def __init__(self):
+        self._limits = get_limits()
+        self._fallback = None  # локальные лимиты на время недоступности общих
+        self._fallback_until = 0.0
+        self._waiters = None  # PriorityQueue (приоритет, порядок, future)
+        self._counter = itertools.count()
+        self._pump = None
+
+    async def initialize(self):
+        if self._waiters is None:
+            self._waiters = asyncio.PriorityQueue()
+        if self._pump is None or self._pump.done():
+            # Ожидающие остаются в очереди — перезапущенный насос продолжит с них
+            self._pump = asyncio.get_running_loop().create_task(self._grant_tokens())
+
+    async def shutdown(self):
+        if self._pump is not None:
+            self._pump.cancel()
+            await asyncio.gather(self._pump, return_exceptions=True)
+            self._pump = None
+
+    async def _limit(self, method, *args):
+        """Вызывает метод лимитов; пока общие недоступны — тот же метод локальных MemoryLimits."""
+        if time.monotonic() >= self._fallback_until:
+            try:
+                # Бакеты в Redis — синхронный клиент уносим из event loop
+                return await asyncio.to_thread(getattr(self._limits, method), *args)
+            except Exception as e:
+                logger.error("❌ Shared rate limits failed, using local ones for %ss: %s", LIMITS_RETRY_INTERVAL, e)
+                self._fallback_until = time.monotonic() + LIMITS_RETRY_INTERVAL
+        if self._fallback is None:
+            self._fallback = MemoryLimits()
+        return getattr(self._fallback, method)(*args)
+
+    async def _grant_tokens(self):
+        """Выдаёт глобальные токены ожидающим в порядке приоритета."""
+        while True:
+            priority, order, future = await self._waiters.get()
+            if future.done():
+                continue
+            await asyncio.sleep(await self._limit("reserve_global", priority == BROADCAST))
+            if not future.done():
+                future.set_result(None)
+
+    async def _acquire(self, chat_id, priority):
+        if chat_id is not None:
+            await asyncio.sleep(await self._limit("reserve_chat", chat_id))
+        await self.initialize()
+        future = asyncio.get_running_loop().create_future()
+        await self._waiters.put((priority, next(self._counter), future))
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(_LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get("chat_id")
+        priority = TRANSACTIONAL if rate_limit_args is None else rate_limit_args
+        for attempt in range(settings.OUTBOX_MAX_RETRIES + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == settings.OUTBOX_MAX_RETRIES:
+                    raise
+                delay = _seconds(e.retry_after)
+                logger.warning("⏳ Telegram 429 on %s (chat %s), pausing %.1fs", endpoint, chat_id, delay)
+                await self._limit("pause", delay)
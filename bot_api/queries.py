@@ -0,0 +1,109 @@
+# bot_api/queries.py
+"""
+Доступ к данным bot_api через async API QuerySet (afirst, aupdate, async for...).
+
+Транзакции в Django пока синхронные, поэтому claim_photo_slots остаётся
+sync-функцией в sync_to_async.
+
+В Django 5.1 async-методы QuerySet внутри тоже идут через thread-sensitive
+sync_to_async; параллельность между пользователями даёт отдельный
+ThreadSensitiveContext на каждый апдейт (см. bot_api.update_queue).
+"""
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from bot_api.models import UserPhoto
+from payments.models import Payment
+
+MAX_PHOTOS = 10
+
+# Результаты claim_photo_slots
+CLAIM_CREATED = "created"
+CLAIM_DUPLICATE = "duplicate"
+CLAIM_LIMIT = "limit"
+CLAIM_UNPAID = "unpaid"
+
+
+async def list_photo_ids(user_id):
+    """file_unique_id всех фото пользователя."""
+    return [
+        file_unique_id
+        async for file_unique_id in UserPhoto.objects.filter(user_id=user_id).values_list("file_unique_id", flat=True)
+    ]
+
+
+def _save_files(photos):
+    """Сохраняет обработанные фото в хранилище ImageField. Возвращает имена файлов."""
+    field = UserPhoto._meta.get_field("image")
+    names = []
+    try:
+        for file_id, file_unique_id, processed_file in photos:
+            names.append(field.storage.save(field.generate_filename(None, processed_file.name), processed_file))
+    except BaseException:
+        _delete_files(names)
+        raise
+    return names
+
+
+def _delete_files(names):
+    storage = UserPhoto._meta.get_field("image").storage
+    for name in names:
+        storage.delete(name)
+
+
+@transaction.atomic
+def _claim(user_id, photos, names):
+    status = (
+        Payment.objects.select_for_update()
+        .filter(telegram_user_id=user_id)
+        .values_list("status", flat=True)
+        .first()
+    )
+    if status != "paid":
+        return [CLAIM_UNPAID] * len(photos), 0
+
+    existing = set(UserPhoto.objects.filter(user_id=user_id).values_list("file_unique_id", flat=True))
+    total = len(existing)
+    results, new_photos = [], []
+    for (file_id, file_unique_id, processed_file), name in zip(photos, names):
+        if file_unique_id in existing:
+            results.append(CLAIM_DUPLICATE)
+        elif total >= MAX_PHOTOS:
+            results.append(CLAIM_LIMIT)
+        else:
+            new_photos.append(UserPhoto(
+                user_id=user_id,
+                file_id=file_id,
+                file_unique_id=file_unique_id,
+                image=name
+            ))
+            existing.add(file_unique_id)
+            total += 1
+            results.append(CLAIM_CREATED)
+
+    UserPhoto.objects.bulk_create(new_photos)
+    return results, total
+
+
+@sync_to_async
+def claim_photo_slots(user_id, photos):
+    """
+    Атомарно занимает слоты под фото: проверка оплаты, лимита и дубликатов
+    и вставка (одним bulk_create) — в одной транзакции. Строка Payment
+    блокируется (SELECT ... FOR UPDATE), поэтому параллельные загрузки одного
+    пользователя проходят проверку по очереди и не превышают лимит.
+
+    Файлы пишутся в хранилище до транзакции, чтобы запись на диск не шла под
+    блокировкой; файлы непринятых фото (и всех — при откате) удаляются.
+
+    photos — список (file_id, file_unique_id, processed_file).
+    Возвращает (результат для каждого фото, количество фото пользователя).
+    """
+    names = _save_files(photos)
+    try:
+        results, total = _claim(user_id, photos, names)
+    except BaseException:
+        _delete_files(names)
+        raise
+    _delete_files(name for name, result in zip(names, results) if result != CLAIM_CREATED)
+    return results, total
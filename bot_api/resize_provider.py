@@ -1,40 +1,93 @@
+import io
+import math
 import os
 import shutil
 from PIL import Image
 
-def crop_center(image: Image.Image, target_aspect: float) -> Image.Image:
-    """Обрезает изображение так, чтобы его соотношение сторон соответствовало целевому."""
-    width, height = image.size
+def crop_box(size, target_aspect: float):
+    """Вычисляет область обрезки по центру только по размерам изображения."""
+    width, height = size
     current_aspect = width / height
-    
+
     if current_aspect > target_aspect:
         # Обрезаем по ширине
         new_width = int(height * target_aspect)
         left = (width - new_width) // 2
-        right = left + new_width
-        return image.crop((left, 0, right, height))
+        return (left, 0, left + new_width, height)
     else:
         # Обрезаем по высоте
         new_height = int(width / target_aspect)
         top = (height - new_height) // 2
-        bottom = top + new_height
-        return image.crop((0, top, width, bottom))
+        return (0, top, width, top + new_height)
 
-def determine_target_size(image: Image.Image):
-    """Определяет целевое разрешение на основе соотношения сторон."""
-    width, height = image.size
+def crop_center(image: Image.Image, target_aspect: float) -> Image.Image:
+    """Обрезает изображение так, чтобы его соотношение сторон соответствовало целевому."""
+    return image.crop(crop_box(image.size, target_aspect))
+
+def target_for_size(width, height):
+    """Определяет целевое разрешение по размерам из заголовка файла."""
     aspect_ratio = width / height
-    
+
     if 0.85 <= aspect_ratio <= 1.15:
         return (1024, 1024), 1.0  # Почти квадратные изображения
     else :
         return (832, 1216), 832 / 1216  # Вертикальные изображения
- 
+
+def determine_target_size(image: Image.Image):
+    """Определяет целевое разрешение на основе соотношения сторон."""
+    return target_for_size(*image.size)
+
 
 def resize_image(image: Image.Image, size) -> Image.Image:
     """Изменяет размер изображения до указанного разрешения."""
     return image.resize(size, Image.LANCZOS)
 
+def _encode_jpeg(image: Image.Image) -> bytes:
+    output_buffer = io.BytesIO()
+    image.save(output_buffer, format="JPEG", quality=95)
+    return output_buffer.getvalue()
+
+def process_photo_file(source, output):
+    """
+    То же, что process_photo, но читает из файлового объекта source и пишет
+    JPEG прямо в output — без копий всего файла в bytes.
+    """
+    with Image.open(source) as image:
+        load_for_target(image).save(output, format="JPEG", quality=95)
+
+def load_for_target(image: Image.Image) -> Image.Image:
+    """
+    Декодирует изображение сразу в целевом размере.
+
+    Image.open читает только заголовок, поэтому область обрезки и целевой размер
+    считаются до декодирования. Для JPEG draft() просит декодер масштаб 1/2, 1/4
+    или 1/8 (не меньше нужного), так что 4000x3000 не раскодируется целиком;
+    для остальных форматов reducing_gap даёт быстрый reduce() перед LANCZOS.
+    """
+    width, height = image.size
+    target_size, target_aspect = target_for_size(width, height)
+    box = crop_box((width, height), target_aspect)
+
+    if image.format == "JPEG":
+        # Во сколько раз область обрезки больше целевого размера
+        scale = min((box[2] - box[0]) / target_size[0], (box[3] - box[1]) / target_size[1])
+        if scale > 1:
+            image.draft("RGB", (math.ceil(width / scale), math.ceil(height / scale)))
+            sx, sy = image.size[0] / width, image.size[1] / height
+            box = (box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy)
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    return image.resize(target_size, Image.LANCZOS, box=box, reducing_gap=3.0)
+
+def process_photo(data: bytes) -> bytes:
+    """
+    Полный цикл обработки фото: декодирование, обрезка, ресайз и JPEG-кодирование.
+    Функция модульного уровня, чтобы её можно было отправить в ProcessPoolExecutor.
+    """
+    return _encode_jpeg(load_for_target(Image.open(io.BytesIO(data))))
+
 def clear_output_folder(folder):
     """Очищает папку перед сохранением новых файлов."""
     if os.path.exists(folder):
@@ -0,0 +1,141 @@
+# bot_api/router.py
+"""
+Маршрутизация callback_query по query.data.
+
+    router = CallbackRouter()
+
+    @router.route("pay")                       # точное совпадение — поиск в dict
+    async def pay(update, context): ...
+
+    @router.prefix("style", rate_limit(1.0))   # "style:<arg>" — тоже поиск в dict
+    async def style(update, context, arg): ...
+
+    @router.pattern(r"page:(?P<n>\\d+)")       # регулярка — только если dict не нашёл
+    async def page(update, context, n): ...
+
+Middleware — async def mw(call_next, update, context, **params): решает,
+вызывать ли call_next(update, context, **params). Цепочка собирается один
+раз при регистрации. Непосредственно перед обработчиком вызывается
+query.answer(), так что middleware, отклоняющая нажатие, отвечает сама.
+Время обработки каждого маршрута пишется в гистограмму bot_callback_seconds.
+"""
+import re
+import time
+
+from django.conf import settings
+from prometheus_client import Histogram
+
+from ai_photo_bot.cache import TTLCache
+
+CALLBACK_LATENCY = Histogram(
+    "bot_callback_seconds",
+    "Callback query handling time by route",
+    ["route"],
+)
+
+
+def _answered(handler):
+    async def call(update, context, **params):
+        await update.callback_query.answer()
+        return await handler(update, context, **params)
+    return call
+
+
+def _wrap(mw, call_next):
+    async def call(update, context, **params):
+        return await mw(call_next, update, context, **params)
+    return call
+
+
+def _chain(handler, middleware):
+    call = _answered(handler)
+    for mw in reversed(middleware):
+        call = _wrap(mw, call)
+    return call
+
+
+class CallbackRouter:
+    def __init__(self, *middleware):
+        self.middleware = middleware  # применяется ко всем маршрутам
+        self._exact = {}     # data -> (имя маршрута, обработчик)
+        self._prefixes = {}  # префикс до ":" -> (имя маршрута, обработчик)
+        self._patterns = []  # [(regex, имя маршрута, обработчик)]
+        self._fallback = None
+
+    def _register(self, handler, middleware):
+        return _chain(handler, self.middleware + middleware)
+
+    def route(self, data, *middleware):
+        def decorator(handler):
+            self._exact[data] = (data, self._register(handler, middleware))
+            return handler
+        return decorator
+
+    def prefix(self, prefix, *middleware):
+        def decorator(handler):
+            self._prefixes[prefix] = (f"{prefix}:*", self._register(handler, middleware))
+            return handler
+        return decorator
+
+    def pattern(self, regex, *middleware):
+        def decorator(handler):
+            self._patterns.append((re.compile(regex), regex, self._register(handler, middleware)))
+            return handler
+        return decorator
+
+    def fallback(self, *middleware):
+        def decorator(handler):
+            self._fallback = ("fallback", self._register(handler, middleware))
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """Возвращает (имя маршрута, обработчик, параметры) или None."""
+        if data in self._exact:
+            name, call = self._exact[data]
+            return name, call, {}
+
+        head, sep, arg = data.partition(":")
+        if sep and head in self._prefixes:
+            name, call = self._prefixes[head]
+            return name, call, {"arg": arg}
+
+        for regex, name, call in self._patterns:
+            match = regex.fullmatch(data)
+            if match:
+                return name, call, match.groupdict()
+
+        if self._fallback:
+            name, call = self._fallback
+            return name, call, {}
+        return None
+
+    async def dispatch(self, update, context):
+        resolved = self.resolve(update.callback_query.data or "")
+        if resolved is None:
+            await update.callback_query.answer()
+            return
+        name, call, params = resolved
+        started = time.perf_counter()
+        try:
+            await call(update, context, **params)
+        finally:
+            CALLBACK_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+
+def rate_limit(interval=None):
+    """Не чаще одного нажатия в interval секунд на пользователя (по умолчанию CALLBACK_RATE_LIMIT)."""
+    interval = settings.CALLBACK_RATE_LIMIT if interval is None else interval
+    last_seen = TTLCache(maxsize=100000, ttl=max(interval, 1))
+
+    async def middleware(call_next, update, context, **params):
+        user_id = update.effective_user.id if update.effective_user else None
+        now = time.monotonic()
+        previous = last_seen.get(user_id)
+        if previous is not None and now - previous < interval:
+            await update.callback_query.answer("⏳ Too many clicks, please wait a moment.")
+            return
+        last_seen.set(user_id, now)
+        return await call_next(update, context, **params)
+
+    return middleware
@@ -0,0 +1,61 @@
+# bot_api/state_cache.py
+"""
+Кэш состояния пользователя: статус оплаты, число фото и их file_unique_id.
+
+Промах — два запроса (Payment и список file_unique_id), попадание — ноль.
+В кэш попадают только оплатившие пользователи: статус "pending" может
+смениться в другом процессе (Stripe webhook, другой воркер uvicorn), а
+"paid" для загрузки фото окончательный. Поэтому неоплативший пользователь
+увидит оплату на следующем же сообщении, а загрузка фото после оплаты не
+читает БД вовсе.
+
+Явной инвалидации нет: кэш живёт в памяти процесса, и сбросить его из
+другого процесса (Celery, вебхук Stripe, другой воркер uvicorn) нельзя.
+Корректность держится на двух вещах: кэшируются только оплатившие, а
+USER_STATE_CACHE_TTL короткий (30 с) — столько процесс может видеть
+устаревшее число фото. store_photos обновляет запись своего процесса на
+месте (photo_added). Окончательно оплату, лимит и дубликаты проверяет
+claim_photo_slots в БД.
+"""
+from django.conf import settings
+
+from ai_photo_bot.cache import TTLCache
+from bot_api.queries import list_photo_ids
+from payments.queries import get_payment_status
+
+
+class UserState:
+    def __init__(self, payment_status, file_unique_ids):
+        self.payment_status = payment_status  # None — платежа нет
+        self.file_unique_ids = set(file_unique_ids)
+
+    @property
+    def is_paid(self):
+        return self.payment_status == "paid"
+
+    @property
+    def photo_count(self):
+        return len(self.file_unique_ids)
+
+
+_cache = TTLCache(maxsize=settings.USER_STATE_CACHE_SIZE, ttl=settings.USER_STATE_CACHE_TTL)
+
+
+async def _load_state(user_id):
+    return UserState(await get_payment_status(user_id), await list_photo_ids(user_id))
+
+
+async def get_state(user_id):
+    state = _cache.get(user_id)
+    if state is None:
+        state = await _load_state(user_id)
+        if state.is_paid:
+            _cache.set(user_id, state)
+    return state
+
+
+def photo_added(user_id, file_unique_id):
+    """Вызывается после создания UserPhoto — обновляет запись без запроса в БД."""
+    state = _cache.get(user_id)
+    if state is not None:
+        state.file_unique_ids.add(file_unique_id)
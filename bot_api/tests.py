@@ -1,3 +1,470 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import mock
+from unittest.mock import AsyncMock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+from ai_photo_bot.ratelimit import MemoryLimits
+from bot_api import albums, lifecycle, outbox, resize_provider, update_queue
+from bot_api.models import UserPhoto
+from bot_api.queries import (
+    CLAIM_CREATED, CLAIM_DUPLICATE, CLAIM_LIMIT, CLAIM_UNPAID, MAX_PHOTOS, claim_photo_slots,
+)
+from bot_api.router import CallbackRouter, rate_limit
+from payments.models import Payment
+
+
+def make_photo(size, format="JPEG"):
+    """Фото-подобное изображение: градиенты по каналам и размытый шум вместо текстуры."""
+    red = Image.linear_gradient("L").resize(size)
+    green = Image.linear_gradient("L").rotate(90).resize(size)
+    blue = Image.effect_noise(size, 40).filter(ImageFilter.GaussianBlur(2))
+    image = Image.merge("RGB", (red, green, blue))
+    output = io.BytesIO()
+    image.save(output, format=format, quality=90)
+    return output.getvalue()
+
+
+def process_photo_full_decode(data):
+    """Эталонный путь: полное декодирование, затем обрезка и ресайз."""
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    target_size, target_aspect = resize_provider.determine_target_size(image)
+    image = resize_provider.crop_center(image, target_aspect)
+    image = resize_provider.resize_image(image, target_size)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=95)
+    return output.getvalue()
+
+
+def quality_delta(data):
+    """Среднее абсолютное отклонение (0..255 на канал) process_photo от эталона."""
+    fast = Image.open(io.BytesIO(resize_provider.process_photo(data)))
+    reference = Image.open(io.BytesIO(process_photo_full_decode(data)))
+    stat = ImageStat.Stat(ImageChops.difference(fast, reference))
+    return sum(stat.mean) / len(stat.mean)
+
+
+class ResizeProviderTests(SimpleTestCase):
+    SIZES = [(4000, 3000), (3000, 4000), (2048, 2048), (1300, 1900)]
+    # Допустимое среднее отклонение draft-декодирования от полного
+    DRAFT_QUALITY_TOLERANCE = 2.0
+
+    def test_draft_decode_within_tolerance(self):
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                self.assertLessEqual(quality_delta(make_photo(size)), self.DRAFT_QUALITY_TOLERANCE)
+
+    def test_non_jpeg_within_tolerance(self):
+        delta = quality_delta(make_photo((3000, 2000), format="PNG"))
+        self.assertLessEqual(delta, self.DRAFT_QUALITY_TOLERANCE)
+
+    def test_target_size(self):
+        for size, expected in [((4000, 3000), (832, 1216)), ((2048, 2048), (1024, 1024))]:
+            with self.subTest(size=size):
+                result = Image.open(io.BytesIO(resize_provider.process_photo(make_photo(size))))
+                self.assertEqual(result.size, expected)
+                self.assertEqual(result.format, "JPEG")
+
+    def test_process_photo_file_matches_process_photo(self):
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                data = make_photo(size)
+                output = io.BytesIO()
+                resize_provider.process_photo_file(io.BytesIO(data), output)
+                self.assertEqual(output.getvalue(), resize_provider.process_photo(data))
+
+
+def photo(file_unique_id):
+    return f"file-{file_unique_id}", file_unique_id, ContentFile(b"jpeg", name=f"{file_unique_id}.jpg")
+
+
+class ClaimPhotoSlotsTests(TransactionTestCase):
+    """claim_photo_slots под параллельной нагрузкой — нужны настоящие транзакции."""
+    USER_ID = 1001
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        Payment.objects.create(telegram_user_id=self.USER_ID, status="paid")
+
+    def claim(self, photos, user_id=USER_ID):
+        return async_to_sync(claim_photo_slots)(user_id, photos)
+
+    def claim_concurrently(self, batches):
+        results = [None] * len(batches)
+        barrier = threading.Barrier(len(batches))
+
+        def worker(i, photos):
+            try:
+                barrier.wait()
+                results[i] = self.claim(photos)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i, batch)) for i, batch in enumerate(batches)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def stored_files(self):
+        return sum(len(files) for _, _, files in os.walk(self.media_root))
+
+    def test_unpaid(self):
+        Payment.objects.create(telegram_user_id=2002, status="pending")
+        results, total = self.claim([photo("a"), photo("b")], user_id=2002)
+        self.assertEqual(results, [CLAIM_UNPAID, CLAIM_UNPAID])
+        self.assertEqual(total, 0)
+        self.assertFalse(UserPhoto.objects.filter(user_id=2002).exists())
+        self.assertEqual(self.stored_files(), 0)
+
+    def test_duplicate_of_existing_photo(self):
+        self.claim([photo("a")])
+        results, total = self.claim([photo("a"), photo("b")])
+        self.assertEqual(results, [CLAIM_DUPLICATE, CLAIM_CREATED])
+        self.assertEqual(total, 2)
+        self.assertEqual(self.stored_files(), 2)
+
+    def test_limit(self):
+        self.claim([photo(f"p{i}") for i in range(MAX_PHOTOS - 1)])
+        results, total = self.claim([photo("x"), photo("y")])
+        self.assertEqual(results, [CLAIM_CREATED, CLAIM_LIMIT])
+        self.assertEqual(total, MAX_PHOTOS)
+        self.assertEqual(UserPhoto.objects.filter(user_id=self.USER_ID).count(), MAX_PHOTOS)
+        self.assertEqual(self.stored_files(), MAX_PHOTOS)
+
+    def test_concurrent_claims_respect_limit(self):
+        batches = [[photo(f"t{thread}-{i}") for i in range(4)] for thread in range(4)]
+        outcomes = self.claim_concurrently(batches)
+
+        created = sum(results.count(CLAIM_CREATED) for results, total in outcomes)
+        limited = sum(results.count(CLAIM_LIMIT) for results, total in outcomes)
+        self.assertEqual(created, MAX_PHOTOS)
+        self.assertEqual(limited, 16 - MAX_PHOTOS)
+        self.assertTrue(all(total <= MAX_PHOTOS for results, total in outcomes))
+        self.assertEqual(UserPhoto.objects.filter(user_id=self.USER_ID).count(), MAX_PHOTOS)
+        self.assertEqual(self.stored_files(), MAX_PHOTOS)
+
+    def test_concurrent_claims_of_same_photo(self):
+        outcomes = self.claim_concurrently([[photo("same")] for _ in range(5)])
+
+        results = [results[0] for results, total in outcomes]
+        self.assertEqual(results.count(CLAIM_CREATED), 1)
+        self.assertEqual(results.count(CLAIM_DUPLICATE), 4)
+        self.assertEqual(UserPhoto.objects.filter(user_id=self.USER_ID).count(), 1)
+        self.assertEqual(self.stored_files(), 1)
+
+    def test_album_batch(self):
+        # Альбом: повтор внутри пачки и часть сверх лимита
+        self.claim([photo(f"p{i}") for i in range(MAX_PHOTOS - 3)])
+        results, total = self.claim([photo("a"), photo("a"), photo("p0"), photo("b"), photo("c"), photo("d")])
+        self.assertEqual(
+            results,
+            [CLAIM_CREATED, CLAIM_DUPLICATE, CLAIM_DUPLICATE, CLAIM_CREATED, CLAIM_CREATED, CLAIM_LIMIT],
+        )
+        self.assertEqual(total, MAX_PHOTOS)
+        self.assertEqual(self.stored_files(), MAX_PHOTOS)
+
+
+@override_settings(ALBUM_COLLECT_DELAY=60)
+class AlbumBufferTests(SimpleTestCase):
+    def test_collects_until_max_size(self):
+        buffer = albums.AlbumBuffer()
+        for i in range(albums.ALBUM_MAX_SIZE - 1):
+            self.assertIsNone(buffer.add(1, "group", i))
+        album = buffer.add(1, "group", "last")
+        self.assertEqual(album.items, [*range(albums.ALBUM_MAX_SIZE - 1), "last"])
+        self.assertIsNone(buffer.get(1))
+
+    def test_expired(self):
+        buffer = albums.AlbumBuffer()
+        buffer.add(1, "first", "a")
+        buffer.add(2, "second", "b")
+        self.assertEqual(buffer.expired(), [])
+        self.assertGreater(buffer.timeout(5), 0)
+
+        buffer.get(1).deadline = 0
+        self.assertEqual(buffer.timeout(5), 0)
+        self.assertEqual([album.media_group_id for album in buffer.expired()], ["first"])
+        self.assertIsNotNone(buffer.get(2))
+
+    def test_mixed_album(self):
+        # Альбом из видео и фото: маршрутизируется по первому фото, видео пропускаются
+        video = SimpleNamespace(photo=())
+        first_photo = SimpleNamespace(photo=("small", "large"))
+        second_photo = SimpleNamespace(photo=("large",))
+        updates = [SimpleNamespace(message=message) for message in (video, first_photo, second_photo)]
+
+        self.assertIs(albums.lead(updates), updates[1])
+        self.assertEqual(albums.photo_messages([video, first_photo, second_photo]), [first_photo, second_photo])
+        self.assertIs(albums.lead(updates[:1]), updates[0])
+
+    def test_messages_of(self):
+        first, second, other = object(), object(), object()
+        self.assertEqual(albums.messages_of(first), [first])
+        with albums.bind([first, second]):
+            self.assertEqual(albums.messages_of(second), [first, second])
+            self.assertEqual(albums.messages_of(other), [other])
+        self.assertEqual(albums.messages_of(first), [first])
+
+
+def callback_update(data, user_id=1, calls=None):
+    async def answer(*args):
+        if calls is not None:
+            calls.append("answer")
+
+    query = SimpleNamespace(data=data, answer=AsyncMock(side_effect=answer))
+    return SimpleNamespace(callback_query=query, effective_user=SimpleNamespace(id=user_id))
+
+
+class CallbackRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = CallbackRouter()
+        self.calls = []
+
+    def handler(self, name):
+        async def handle(update, context, **params):
+            self.calls.append((name, params))
+        return handle
+
+    async def test_exact_route(self):
+        self.router.route("pay")(self.handler("pay"))
+        update = callback_update("pay")
+        await self.router.dispatch(update, None)
+        self.assertEqual(self.calls, [("pay", {})])
+        update.callback_query.answer.assert_awaited_once_with()
+
+    async def test_prefix_route(self):
+        self.router.prefix("style")(self.handler("style"))
+        await self.router.dispatch(callback_update("style:anime:2"), None)
+        self.assertEqual(self.calls, [("style", {"arg": "anime:2"})])
+
+    async def test_pattern_route(self):
+        self.router.pattern(r"page:(?P<n>\d+)")(self.handler("page"))
+        await self.router.dispatch(callback_update("page:12"), None)
+        self.assertEqual(self.calls, [("page", {"n": "12"})])
+
+    async def test_exact_then_prefix_then_pattern(self):
+        self.router.pattern(r"page:(?P<n>\d+)")(self.handler("pattern"))
+        self.router.prefix("page")(self.handler("prefix"))
+        self.router.route("page:1")(self.handler("exact"))
+
+        await self.router.dispatch(callback_update("page:1"), None)
+        await self.router.dispatch(callback_update("page:2"), None)
+        self.assertEqual(self.calls, [("exact", {}), ("prefix", {"arg": "2"})])
+
+    async def test_fallback(self):
+        self.router.route("pay")(self.handler("pay"))
+        self.router.fallback()(self.handler("fallback"))
+        await self.router.dispatch(callback_update("unknown"), None)
+        self.assertEqual(self.calls, [("fallback", {})])
+
+    async def test_unknown_without_fallback_is_answered(self):
+        update = callback_update("unknown")
+        await self.router.dispatch(update, None)
+        self.assertEqual(self.calls, [])
+        update.callback_query.answer.assert_awaited_once_with()
+
+    async def test_middleware_chain(self):
+        def middleware(name):
+            async def mw(call_next, update, context, **params):
+                self.calls.append(name)
+                return await call_next(update, context, **params)
+            return mw
+
+        router = CallbackRouter(middleware("router"))
+        router.prefix("style", middleware("route"))(self.handler("style"))
+        await router.dispatch(callback_update("style:anime", calls=self.calls), None)
+        self.assertEqual(self.calls, ["router", "route", "answer", ("style", {"arg": "anime"})])
+
+    async def test_middleware_can_reject(self):
+        async def reject(call_next, update, context, **params):
+            self.calls.append("rejected")
+
+        self.router.route("pay", reject)(self.handler("pay"))
+        update = callback_update("pay")
+        await self.router.dispatch(update, None)
+        self.assertEqual(self.calls, ["rejected"])
+        update.callback_query.answer.assert_not_awaited()
+
+    async def test_rate_limit(self):
+        self.router.route("pay", rate_limit(60))(self.handler("pay"))
+        await self.router.dispatch(callback_update("pay"), None)
+        second = callback_update("pay")
+        await self.router.dispatch(second, None)
+        await self.router.dispatch(callback_update("pay", user_id=2), None)
+
+        self.assertEqual(self.calls, [("pay", {}), ("pay", {})])
+        second.callback_query.answer.assert_awaited_once()
+        self.assertIn("Too many clicks", second.callback_query.answer.await_args.args[0])
+
+
+class FlakyLimits(MemoryLimits):
+    """Лимиты, у которых первые failures вызовов reserve_global падают, как при ошибке Redis."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.calls = 0
+
+    def reserve_global(self, broadcast=False):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Redis is down")
+        return super().reserve_global(broadcast)
+
+
+class OutboxTests(SimpleTestCase):
+    def limiter(self, limits):
+        with mock.patch.object(outbox, "get_limits", return_value=limits):
+            return outbox.TelegramRateLimiter()
+
+    async def send(self, limiter, chat_id):
+        callback = AsyncMock(return_value="sent")
+        result = await asyncio.wait_for(
+            limiter.process_request(callback, (), {}, "sendMessage", {"chat_id": chat_id}, None), timeout=5
+        )
+        self.assertEqual(result, "sent")
+
+    async def test_limits_error_falls_back_to_local_limits(self):
+        limits = FlakyLimits(failures=1)
+        limiter = self.limiter(limits)
+        try:
+            await self.send(limiter, 1)  # общие лимиты упали — токен из локальных
+            await self.send(limiter, 2)  # ещё LIMITS_RETRY_INTERVAL на локальных
+            self.assertEqual(limits.calls, 1)
+
+            limiter._fallback_until = 0.0  # интервал прошёл
+            with mock.patch.object(outbox, "LIMITS_RETRY_INTERVAL", 0):
+                limits.failures = 1
+                await self.send(limiter, 3)
+                await self.send(limiter, 4)  # общие лимиты снова работают
+            self.assertEqual(limits.calls, 3)
+        finally:
+            await limiter.shutdown()
+
+    async def test_dead_pump_is_restarted(self):
+        limiter = self.limiter(MemoryLimits())
+        try:
+            await self.send(limiter, 1)
+            limiter._pump.cancel()
+            await asyncio.gather(limiter._pump, return_exceptions=True)
+            await self.send(limiter, 2)
+        finally:
+            await limiter.shutdown()
+
+
+class ChatLanesTests(SimpleTestCase):
+    def job(self, done, name, wait=None, error=None):
+        async def run():
+            if wait is not None:
+                await wait.wait()
+            if error is not None:
+                raise error
+            done.append(name)
+        return run
+
+    async def test_slow_chat_does_not_block_other_chats(self):
+        lanes = update_queue.ChatLanes(0, limit=16)
+        done, release = [], asyncio.Event()
+        await lanes.submit(1, self.job(done, "1a", wait=release))
+        await lanes.submit(1, self.job(done, "1b"))
+        await lanes.submit(2, self.job(done, "2a"))
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(done, ["2a"])
+        release.set()
+        await lanes.join()
+        self.assertEqual(done, ["2a", "1a", "1b"])
+
+    async def test_error_does_not_stop_chat(self):
+        lanes = update_queue.ChatLanes(0, limit=16)
+        done = []
+        with self.assertLogs("bot_api.update_queue", "ERROR"):
+            await lanes.submit(1, self.job(done, "1a", error=ValueError("boom")))
+            await lanes.submit(1, self.job(done, "1b"))
+            await lanes.join()
+        self.assertEqual(done, ["1b"])
+
+    async def test_submit_waits_for_free_slot(self):
+        lanes = update_queue.ChatLanes(0, limit=2)
+        done, release = [], asyncio.Event()
+        await lanes.submit(1, self.job(done, "1", wait=release))
+        await lanes.submit(2, self.job(done, "2", wait=release))
+        third = asyncio.create_task(lanes.submit(3, self.job(done, "3")))
+
+        await asyncio.sleep(0.05)
+        self.assertFalse(third.done())
+        release.set()
+        await asyncio.wait_for(third, timeout=1)
+        await lanes.join()
+        self.assertEqual(sorted(done), ["1", "2", "3"])
+
+
+def message_update(update_id, chat_id=1):
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "hi"},
+    }
+
+
+@override_settings(BOT_UPDATE_QUEUE="memory", BOT_UPDATE_WORKERS=2)
+class UpdateQueueTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(update_queue, "_backend", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(BOT_UPDATE_QUEUE_MAXSIZE=1)
+    async def test_full_shard_does_not_mark_update_seen(self):
+        self.assertTrue(await update_queue.enqueue(message_update(1)))
+        with self.assertRaises(update_queue.QueueFull):
+            await update_queue.enqueue(message_update(2))
+
+        backend = update_queue._get_backend()
+        await backend.get(1, timeout=1)
+        await backend.ack(1, None)
+        # Повтор от Telegram после 503 принимается, настоящий дубликат — нет
+        self.assertTrue(await update_queue.enqueue(message_update(2)))
+        self.assertFalse(await update_queue.enqueue(message_update(1)))
+
+    async def test_stop_processes_queued_updates(self):
+        processed = []
+
+        class Application:
+            bot = None
+
+            async def process_update(self, update):
+                await asyncio.sleep(0.01)
+                processed.append(update.update_id)
+
+        update_queue.start(Application())
+        for update_id in range(20):
+            await update_queue.enqueue(message_update(update_id, chat_id=update_id % 3))
+        await update_queue.stop()
+        self.assertEqual(sorted(processed), list(range(20)))
+
+    @mock.patch.object(lifecycle, "startup", AsyncMock())
+    @mock.patch.object(update_queue, "enqueue", AsyncMock(side_effect=update_queue.QueueFull))
+    async def test_webhook_returns_503_when_queue_is_full(self):
+        response = await self.async_client.post(
+            reverse("telegram_webhook"), json.dumps(message_update(1)), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 503)
@@ -0,0 +1,333 @@
+# bot_api/update_queue.py
+"""
+Очередь входящих апдейтов Telegram.
+
+telegram_webhook только кладёт апдейт в очередь и сразу отвечает 200, а
+обрабатывают апдейты BOT_UPDATE_WORKERS потребителей. Апдейты раскладываются
+по шардам по chat_id, у каждого шарда один потребитель — поэтому апдейты
+одного чата обрабатываются строго по порядку, а разные чаты — параллельно.
+Внутри шарда чаты тоже не ждут друг друга (ChatLanes): пока один чат
+выдерживает лимит outbox в 1 сообщение в секунду, потребитель раздаёт апдейты
+остальных чатов шарда, до BOT_UPDATE_SHARD_CONCURRENCY одновременно.
+Повторные доставки одного update_id отбрасываются; update_id запоминается
+только вместе с успешной постановкой в очередь, так что повтор Telegram после
+ошибки не теряется. Альбомы собирает сам потребитель шарда (bot_api.albums) и
+обрабатывает их в общем порядке.
+
+Бэкенд выбирается в settings.BOT_UPDATE_QUEUE:
+    "memory" — asyncio.Queue в текущем процессе; если очередь шарда полна,
+               enqueue() сразу бросает QueueFull (webhook отвечает 503 и
+               Telegram повторит позже), а stop() перед остановкой
+               дообрабатывает всё, что уже в очереди;
+    "redis"  — списки Redis; шард в каждый момент читает только один процесс
+               (аренда через ключ с TTL, пока потребитель жив, её продлевает
+               фоновая задача), так что порядок сохраняется и при нескольких
+               воркерах uvicorn. Взятый апдейт переносится (BLMOVE) в список
+               processing шарда и удаляется оттуда только после обработки;
+               если процесс упал, новый владелец шарда возвращает такие
+               апдейты в очередь.
+"""
+import asyncio
+import functools
+import json
+import logging
+import uuid
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from telegram import Update
+
+from ai_photo_bot.cache import TTLCache
+from bot_api import albums
+
+logger = logging.getLogger(__name__)
+
+# Ключи апдейта, в которых есть чат
+_CHAT_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post", "business_message")
+
+
+def chat_id_of(data):
+    """Достаёт chat_id из сырого апдейта, не собирая объект Update."""
+    for key in _CHAT_KEYS:
+        if key in data:
+            return data[key]["chat"]["id"]
+    callback_query = data.get("callback_query")
+    if callback_query:
+        message = callback_query.get("message") or {}
+        return message.get("chat", {}).get("id") or callback_query["from"]["id"]
+    for value in data.values():
+        if isinstance(value, dict) and "from" in value:
+            return value["from"]["id"]
+    return data.get("update_id", 0)
+
+
+QueueFull = asyncio.QueueFull
+
+
+class MemoryBackend:
+    RENEW_INTERVAL = 5  # аренды нет, потребитель только проверяет, что она «есть»
+    POLL_TIMEOUT = 5
+
+    def __init__(self, shards):
+        self._queues = [asyncio.Queue(maxsize=settings.BOT_UPDATE_QUEUE_MAXSIZE) for _ in range(shards)]
+        self._seen = TTLCache(maxsize=100000, ttl=settings.BOT_UPDATE_DEDUP_TTL)
+
+    async def add(self, shard, update_id, data):
+        # Между проверкой и записью нет await — другой запрос не вклинится
+        if self._seen.get(update_id):
+            return False
+        self._queues[shard].put_nowait(data)
+        self._seen.set(update_id, True)
+        return True
+
+    async def acquire(self, shard):
+        return True
+
+    async def get(self, shard, timeout):
+        try:
+            return None, await asyncio.wait_for(self._queues[shard].get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def ack(self, shard, raw):
+        self._queues[shard].task_done()
+
+    async def drain(self):
+        """Ждёт, пока все апдейты в очередях будут обработаны."""
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+
+class RedisBackend:
+    LEASE_MS = 10000
+    RENEW_INTERVAL = LEASE_MS / 3000  # секунд между продлениями аренды
+    POLL_TIMEOUT = LEASE_MS / 3000
+
+    # Продлевает аренду, если она наша, иначе пытается её взять. Взявший
+    # аренду заново возвращает в очередь неподтверждённые апдейты прежнего
+    # владельца: с новых к старым в голову очереди, так что порядок не меняется.
+    _ACQUIRE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+        while redis.call('lmove', KEYS[3], KEYS[2], 'LEFT', 'RIGHT') do end
+        return 1
+    end
+    return 0
+    """
+
+    # Отметка update_id и постановка в очередь — атомарно: либо обе, либо ни одной
+    _ADD_SCRIPT = """
+    if not redis.call('set', KEYS[1], 1, 'NX', 'EX', ARGV[1]) then
+        return 0
+    end
+    redis.call('lpush', KEYS[2], ARGV[2])
+    return 1
+    """
+
+    def __init__(self, shards):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(settings.BOT_UPDATE_QUEUE_REDIS_URL)
+        self._owner = uuid.uuid4().hex
+        self._acquire = self._redis.register_script(self._ACQUIRE_SCRIPT)
+        self._add = self._redis.register_script(self._ADD_SCRIPT)
+
+    async def add(self, shard, update_id, data):
+        keys = [f"bot:update:{update_id}", f"bot:updates:{shard}"]
+        return bool(await self._add(keys=keys, args=[settings.BOT_UPDATE_DEDUP_TTL, json.dumps(data)]))
+
+    async def acquire(self, shard):
+        keys = [f"bot:updates:{shard}:lease", f"bot:updates:{shard}", f"bot:updates:{shard}:processing"]
+        return bool(await self._acquire(keys=keys, args=[self._owner, self.LEASE_MS]))
+
+    async def get(self, shard, timeout):
+        # Таймаут 0 у BLMOVE — ждать бесконечно
+        raw = await self._redis.blmove(
+            f"bot:updates:{shard}", f"bot:updates:{shard}:processing", max(timeout, 0.01), "RIGHT", "LEFT"
+        )
+        return (raw, json.loads(raw)) if raw is not None else None
+
+    async def ack(self, shard, raw):
+        await self._redis.lrem(f"bot:updates:{shard}:processing", 1, raw)
+
+    async def drain(self):
+        # Апдейты остаются в Redis, их дообработает следующий владелец шарда
+        pass
+
+
+class ChatLanes:
+    """Задачи шарда: одного чата — строго по очереди, разных чатов — параллельно.
+
+    В работе и в ожидании своей очереди не больше limit задач; дальше submit()
+    ждёт, и потребитель не забирает новые апдейты.
+    """
+
+    def __init__(self, shard, limit):
+        self.shard = shard
+        self._slots = asyncio.Semaphore(limit)
+        self._last = {}  # chat_id -> последняя поставленная задача чата
+        self._tasks = set()
+
+    async def submit(self, chat_id, job):
+        """Запускает job() (корутинную функцию) после уже поставленных задач чата."""
+        await self._slots.acquire()
+        task = asyncio.create_task(self._run(self._last.get(chat_id), job))
+        self._last[chat_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._done, chat_id))
+
+    async def _run(self, previous, job):
+        if previous is not None:
+            await asyncio.wait([previous])
+        await job()
+
+    def _done(self, chat_id, task):
+        self._tasks.discard(task)
+        if self._last.get(chat_id) is task:
+            del self._last[chat_id]
+        self._slots.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("❌ Error processing update (shard %s)", self.shard, exc_info=task.exception())
+
+    async def join(self):
+        """Ждёт, пока выполнятся все поставленные задачи."""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    async def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+_backend = None
+_consumers = []
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        if settings.BOT_UPDATE_QUEUE == "redis":
+            _backend = RedisBackend(settings.BOT_UPDATE_WORKERS)
+        elif settings.BOT_UPDATE_QUEUE == "memory":
+            _backend = MemoryBackend(settings.BOT_UPDATE_WORKERS)
+        else:
+            raise ValueError(f"Unknown BOT_UPDATE_QUEUE: {settings.BOT_UPDATE_QUEUE!r}")
+    return _backend
+
+
+async def enqueue(data):
+    """Кладёт апдейт в очередь. Возвращает False, если такой update_id уже был.
+
+    Бросает QueueFull, если очередь шарда в памяти переполнена.
+    """
+    shard = chat_id_of(data) % settings.BOT_UPDATE_WORKERS
+    return await _get_backend().add(shard, data.get("update_id"), data)
+
+
+async def _process(application, backend, shard, items, album=False):
+    """Обрабатывает апдейт (или альбом из нескольких) и подтверждает его в очереди."""
+    try:
+        updates = [Update.de_json(data, application.bot) for raw, data in items]
+        # Свой ThreadSensitiveContext на апдейт: sync_to_async-вызовы разных
+        # потребителей идут в разные потоки, а не в один общий, как вне запроса
+        async with ThreadSensitiveContext():
+            try:
+                with albums.bind([update.message for update in updates] if album else None):
+                    await application.process_update(albums.lead(updates) if album else updates[0])
+            finally:
+                await sync_to_async(close_old_connections)()
+    finally:
+        for raw, data in items:
+            await backend.ack(shard, raw)
+
+
+async def _hold_lease(backend, shard, lease):
+    """Берёт и продлевает аренду шарда, пока потребитель работает (в том числе во время обработки)."""
+    while True:
+        try:
+            held = await backend.acquire(shard)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("❌ Can't renew lease (shard %s)", shard)
+            held = False
+        if held:
+            lease.set()
+        elif lease.is_set():
+            logger.warning("⚠️ Lease lost (shard %s)", shard)
+            lease.clear()
+        await asyncio.sleep(backend.RENEW_INTERVAL)
+
+
+async def _consume(application, shard):
+    backend = _get_backend()
+    buffer = albums.AlbumBuffer()
+    lanes = ChatLanes(shard, settings.BOT_UPDATE_SHARD_CONCURRENCY)
+    lease = asyncio.Event()
+    heartbeat = asyncio.create_task(_hold_lease(backend, shard, lease))
+
+    async def submit(chat_id, items, album=False):
+        await lanes.submit(chat_id, functools.partial(_process, application, backend, shard, items, album=album))
+
+    try:
+        while True:
+            try:
+                if not lease.is_set():
+                    # Собираемые альбомы вернёт в очередь новый владелец шарда
+                    buffer.clear()
+                    await lease.wait()
+
+                for album in buffer.expired():
+                    await submit(album.chat_id, album.items, album=True)
+
+                item = await backend.get(shard, buffer.timeout(backend.POLL_TIMEOUT))
+                if item is None:
+                    continue
+                raw, data = item
+                chat_id = chat_id_of(data)
+                media_group_id = albums.media_group_of(data)
+
+                # Другой апдейт того же чата закрывает собираемый альбом
+                pending = buffer.get(chat_id)
+                if pending is not None and pending.media_group_id != media_group_id:
+                    buffer.pop(chat_id)
+                    await submit(chat_id, pending.items, album=True)
+
+                if media_group_id:
+                    album = buffer.add(chat_id, media_group_id, item)
+                    if album is not None:
+                        await submit(chat_id, album.items, album=True)
+                    continue
+                await submit(chat_id, [item])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("❌ Error processing update (shard %s)", shard)
+    finally:
+        heartbeat.cancel()
+        await lanes.cancel()
+
+
+def start(application):
+    """Запускает потребителей в текущем event loop (повторный вызов ничего не делает)."""
+    if _consumers:
+        return
+    loop = asyncio.get_running_loop()
+    for shard in range(settings.BOT_UPDATE_WORKERS):
+        _consumers.append(loop.create_task(_consume(application, shard)))
+
+
+async def stop():
+    """Останавливает потребителей, сначала дав им обработать уже принятые апдейты."""
+    if _consumers:
+        try:
+            await asyncio.wait_for(_get_backend().drain(), settings.BOT_UPDATE_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Update queue not drained in %ss, stopping anyway", settings.BOT_UPDATE_DRAIN_TIMEOUT)
+    for task in _consumers:
+        task.cancel()
+    await asyncio.gather(*_consumers, return_exceptions=True)
+    _consumers.clear()
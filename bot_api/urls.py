@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import telegram_webhook
+from .views import readiness, telegram_webhook
 
 urlpatterns = [
     path("webhook/", telegram_webhook, name="telegram_webhook"),
+    path("ready/", readiness, name="readiness"),
 ]
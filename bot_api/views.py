@@ -1,10 +1,11 @@
 # bot_api/views.py
 import json
 import logging
+from django.conf import settings
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from telegram import Update
-from .bot import application  # Импортируем объект application из bot.py
+from ai_photo_bot.log import LazyJson, sampled
+from . import lifecycle, update_queue
 
 logger = logging.getLogger(__name__)
 
@@ -13,27 +14,32 @@ async def telegram_webhook(request):
     if request.method == "POST":
         try:
             data = json.loads(request.body)
-            print(f"📩 Получено обновление: {json.dumps(data, indent=2, ensure_ascii=False)}")
         except json.JSONDecodeError:
-            print("❌ Ошибка JSON")
+            logger.warning("❌ Ошибка JSON")
             return JsonResponse({"error": "Invalid JSON"}, status=400)
 
-        update = Update.de_json(data, application.bot)
-        print(f"📌 Обрабатываем обновление: {update}")
+        # Полный дамп — только на DEBUG и только для выборки апдейтов
+        if logger.isEnabledFor(logging.DEBUG) and sampled(settings.BOT_UPDATE_LOG_SAMPLE_RATE):
+            logger.debug("📩 Получено обновление: %s", LazyJson(data))
 
-        # Попытка получить chat_id через effective_chat
-        chat = update.effective_chat
-        if chat:
-            print(f"🆔 Chat ID: {chat.id}")
-        else:
-            print("❗ Не удалось определить Chat ID.")
+        # Обычно бот уже запущен lifespan-хуком; без него — запускаем здесь
+        await lifecycle.startup()
 
-        if not application.running:
-            await application.initialize()
-
-        await application.process_update(update)
+        # Обработка идёт в фоне, Telegram сразу получает 200 и не ретраит
+        try:
+            if not await update_queue.enqueue(data):
+                logger.info("↩️ Повтор обновления %s, пропускаем", data.get("update_id"))
+        except update_queue.QueueFull:
+            # Очередь переполнена — Telegram повторит доставку позже
+            logger.warning("⏳ Очередь обновлений переполнена, отвечаем 503")
+            return JsonResponse({"error": "Busy"}, status=503)
         return JsonResponse({"status": "ok"})
     else:
-        print("❌ Неверный тип запроса")
+        logger.warning("❌ Неверный тип запроса")
         return JsonResponse({"error": "Invalid request"}, status=400)
 
+
+async def readiness(request):
+    """Готов ли процесс принимать апдейты: бот, БД и пул изображений прогреты."""
+    status = lifecycle.status()
+    return JsonResponse(status, status=200 if status["ready"] else 503)
@@ -0,0 +1,69 @@
+# payments/ledger.py
+"""
+Журнал начислений и баланс пользователей.
+
+Каждое начисление — строка PaymentEvent с уникальным event_id (id события
+Stripe или производный от него), поэтому повторная доставка вебхука ничего
+не начисляет второй раз. Balance меняется в той же транзакции через F(),
+т.е. одним UPDATE ... SET x = x + n без чтения в Python — параллельные
+вебхуки не теряют обновлений.
+"""
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from users.models import Referral
+from .models import Balance, Payment, PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+# Что даёт оплата и что получает пригласивший за оплатившего друга
+PAYMENT_GRANT = {'credits': 1, 'generations': 100}
+REFERRAL_GRANT = {'generations': 5, 'bonuses': 1}
+
+
+def record_event(event_id, telegram_user_id, kind, credits=0, generations=0, bonuses=0):
+    """Добавляет событие в журнал и применяет его к балансу. False, если событие уже было."""
+    try:
+        with transaction.atomic():
+            PaymentEvent.objects.create(
+                event_id=event_id,
+                telegram_user_id=telegram_user_id,
+                kind=kind,
+                credits=credits,
+                generations=generations,
+                bonuses=bonuses,
+            )
+            Balance.objects.get_or_create(telegram_user_id=telegram_user_id)
+            Balance.objects.filter(telegram_user_id=telegram_user_id).update(
+                credits=F('credits') + credits,
+                generations=F('generations') + generations,
+                bonuses=F('bonuses') + bonuses,
+            )
+    except IntegrityError:
+        logger.info("🔁 Ledger event %s already recorded", event_id)
+        return False
+    return True
+
+
+@transaction.atomic
+def apply_payment(event_id, telegram_user_id):
+    """
+    Оплата: начисление покупателю, статус paid и бонус пригласившему.
+    Повторный вызов с тем же event_id ничего не меняет.
+    """
+    if not record_event(event_id, telegram_user_id, PaymentEvent.PAYMENT, **PAYMENT_GRANT):
+        return False
+
+    # Условный UPDATE вместо чтения и save(): статус только pending -> paid
+    if not Payment.objects.filter(telegram_user_id=telegram_user_id).exclude(status='paid').update(status='paid'):
+        logger.info("Payment for %s not found or already paid", telegram_user_id)
+
+    referral = Referral.objects.filter(referred_user_id=telegram_user_id, is_paid=False).first()
+    if referral and Referral.objects.filter(pk=referral.pk, is_paid=False).update(is_paid=True):
+        record_event(
+            f"{event_id}:referral", referral.user_id, PaymentEvent.REFERRAL_BONUS, **REFERRAL_GRANT
+        )
+        logger.info("🎉 Referral bonus for %s (invited %s)", referral.user_id, telegram_user_id)
+    return True
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_stripeevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Balance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_user_id', models.BigIntegerField(unique=True)),
+                ('credits', models.IntegerField(default=0)),
+                ('generations', models.IntegerField(default=0)),
+                ('bonuses', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('telegram_user_id', models.BigIntegerField(db_index=True)),
+                ('kind', models.CharField(choices=[('payment', 'Payment'), ('referral_bonus', 'Referral bonus')], max_length=20)),
+                ('credits', models.IntegerField(default=0)),
+                ('generations', models.IntegerField(default=0)),
+                ('bonuses', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
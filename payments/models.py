@@ -10,3 +10,48 @@ class Payment(models.Model):
     def __str__(self):
         return f"Payment for {self.telegram_user_id}: {self.status}"
 
+
+
+class StripeEvent(models.Model):
+    """Полученные вебхуки Stripe: event_id уникален, повторная доставка не обрабатывается дважды."""
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.event_id} ({self.type})"
+
+
+class PaymentEvent(models.Model):
+    """Журнал начислений (только добавление). event_id уникален — одно событие применяется один раз."""
+    PAYMENT = 'payment'
+    REFERRAL_BONUS = 'referral_bonus'
+    KIND_CHOICES = [
+        (PAYMENT, 'Payment'),
+        (REFERRAL_BONUS, 'Referral bonus'),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    telegram_user_id = models.BigIntegerField(db_index=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    credits = models.IntegerField(default=0)
+    generations = models.IntegerField(default=0)
+    bonuses = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.event_id}: {self.kind} for {self.telegram_user_id}"
+
+
+class Balance(models.Model):
+    """Текущий баланс пользователя — сумма его PaymentEvent, обновляется вместе с журналом."""
+    telegram_user_id = models.BigIntegerField(unique=True)
+    credits = models.IntegerField(default=0)
+    generations = models.IntegerField(default=0)
+    bonuses = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Balance for {self.telegram_user_id}: {self.credits}/{self.generations}/{self.bonuses}"
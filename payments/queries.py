@@ -0,0 +1,17 @@
+# payments/queries.py
+"""Доступ к данным payments через async API QuerySet."""
+from .models import Balance, Payment
+
+
+async def get_payment(telegram_user_id):
+    return await Payment.objects.filter(telegram_user_id=telegram_user_id).afirst()
+
+
+async def get_payment_status(telegram_user_id):
+    """Статус платежа или None, если платежа нет."""
+    return await Payment.objects.filter(telegram_user_id=telegram_user_id).values_list("status", flat=True).afirst()
+
+
+async def get_balance(telegram_user_id):
+    """Баланс пользователя (одно чтение по уникальному индексу) или None."""
+    return await Balance.objects.filter(telegram_user_id=telegram_user_id).afirst()
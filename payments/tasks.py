@@ -0,0 +1,61 @@
+# payments/tasks.py
+"""
+Обработка вебхуков Stripe в Celery.
+
+Вебхук только сохраняет StripeEvent и ставит process_stripe_event в очередь.
+Задача берёт событие под select_for_update и помечает processed_at в той же
+транзакции, что и изменение статуса, поэтому повторная доставка от Stripe или
+повтор задачи после падения воркера ничего не применяют второй раз.
+Уведомление в Telegram ставится в очередь только после коммита.
+"""
+import logging
+
+from celery import shared_task
+from django.db import transaction
+from django.utils import timezone
+
+from photo_processing.tasks import send_telegram_message
+from . import ledger
+from .models import StripeEvent
+
+logger = logging.getLogger(__name__)
+
+
+def handle_checkout_completed(event):
+    """Проводит оплату через ledger; возвращает (chat_id, текст) уведомления или None."""
+    session = event.payload['data']['object']
+    telegram_user_id = (session.get('metadata') or {}).get('telegram_user_id')
+    if not telegram_user_id:
+        return None
+
+    # bot_api.state_cache хранит только оплативших, так что сбрасывать
+    # кэш веб-процесса при переходе pending -> paid не нужно
+    if not ledger.apply_payment(event.event_id, int(telegram_user_id)):
+        return None
+    return telegram_user_id, "Оплата прошла успешно! Теперь вы можете загружать фото."
+
+
+HANDLERS = {
+    'checkout.session.completed': handle_checkout_completed,
+}
+
+
+@shared_task(acks_late=True)
+def process_stripe_event(event_id):
+    with transaction.atomic():
+        event = StripeEvent.objects.select_for_update().get(event_id=event_id)
+        if event.processed_at is not None:
+            logger.info("🔁 Stripe event %s already processed", event_id)
+            return
+
+        handler = HANDLERS.get(event.type)
+        notification = handler(event) if handler else None
+
+        event.processed_at = timezone.now()
+        event.save(update_fields=['processed_at'])
+
+        if notification:
+            chat_id, text = notification
+            transaction.on_commit(lambda: send_telegram_message.delay(chat_id, text))
+
+    logger.info("✅ Stripe event %s (%s) processed", event_id, event.type)
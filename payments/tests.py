@@ -1,3 +1,119 @@
+import json
+from unittest import mock
+
+from asgiref.sync import sync_to_async
 from django.test import TestCase
+from django.urls import reverse
+
+from users.models import Referral
+from . import ledger
+from .models import Balance, Payment, PaymentEvent, StripeEvent
+from .queries import get_balance
+from .tasks import process_stripe_event
+
+
+def checkout_event(event_id="evt_1", telegram_user_id=42):
+    return {
+        "id": event_id,
+        "type": "checkout.session.completed",
+        "data": {"object": {"metadata": {"telegram_user_id": str(telegram_user_id)}}},
+    }
+
+
+@mock.patch("payments.tasks.send_telegram_message")
+@mock.patch("payments.views.process_stripe_event")
+@mock.patch("stripe.Webhook.construct_event", side_effect=lambda payload, *args: json.loads(payload))
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        Payment.objects.create(telegram_user_id=42)
+
+    def deliver(self, event):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("stripe_webhook"), json.dumps(event),
+                content_type="application/json", HTTP_STRIPE_SIGNATURE="t=1,v1=test",
+            )
+
+    def test_bad_signature(self, construct_event, task, send_message):
+        construct_event.side_effect = ValueError("bad payload")
+        response = self.deliver(checkout_event())
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+        task.delay.assert_not_called()
+
+    def test_event_is_stored_and_queued(self, construct_event, task, send_message):
+        response = self.deliver(checkout_event())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StripeEvent.objects.get().type, "checkout.session.completed")
+        task.delay.assert_called_once_with("evt_1")
+
+    def test_redelivery_of_processed_event_is_ignored(self, construct_event, task, send_message):
+        self.deliver(checkout_event())
+        with self.captureOnCommitCallbacks(execute=True):
+            process_stripe_event("evt_1")
+
+        response = self.deliver(checkout_event())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        task.delay.assert_called_once_with("evt_1")
+
+    def test_event_is_applied_once(self, construct_event, task, send_message):
+        self.deliver(checkout_event())
+        self.deliver(checkout_event())  # ещё не обработано — задача ставится снова
+        self.assertEqual(task.delay.call_count, 2)
+
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                process_stripe_event("evt_1")
+
+        self.assertIsNotNone(StripeEvent.objects.get().processed_at)
+        self.assertEqual(Payment.objects.get(telegram_user_id=42).status, "paid")
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        self.assertEqual(Balance.objects.get(telegram_user_id=42).generations, 100)
+        send_message.delay.assert_called_once_with("42", mock.ANY)
+
+
+class LedgerTests(TestCase):
+    def balance(self, telegram_user_id):
+        balance = Balance.objects.get(telegram_user_id=telegram_user_id)
+        return balance.credits, balance.generations, balance.bonuses
+
+    def test_record_event_replay(self):
+        self.assertTrue(ledger.record_event("evt_1", 42, PaymentEvent.PAYMENT, credits=1, generations=100))
+        self.assertFalse(ledger.record_event("evt_1", 42, PaymentEvent.PAYMENT, credits=1, generations=100))
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        self.assertEqual(self.balance(42), (1, 100, 0))
+
+    def test_events_add_up(self):
+        ledger.record_event("evt_1", 42, PaymentEvent.PAYMENT, credits=1, generations=100)
+        ledger.record_event("evt_2", 42, PaymentEvent.REFERRAL_BONUS, generations=5, bonuses=1)
+        self.assertEqual(self.balance(42), (1, 105, 1))
+
+    def test_apply_payment_replay(self):
+        Payment.objects.create(telegram_user_id=42)
+        Referral.objects.create(user_id=7, referred_user_id=42)
+
+        self.assertTrue(ledger.apply_payment("evt_1", 42))
+        self.assertFalse(ledger.apply_payment("evt_1", 42))
+
+        self.assertEqual(Payment.objects.get(telegram_user_id=42).status, "paid")
+        self.assertTrue(Referral.objects.get(user_id=7).is_paid)
+        self.assertEqual(self.balance(42), (1, 100, 0))
+        self.assertEqual(self.balance(7), (0, 5, 1))
+        self.assertEqual(PaymentEvent.objects.count(), 2)
+
+    def test_referral_bonus_is_granted_once(self):
+        Payment.objects.create(telegram_user_id=42)
+        Referral.objects.create(user_id=7, referred_user_id=42)
+
+        ledger.apply_payment("evt_1", 42)
+        ledger.apply_payment("evt_2", 42)  # вторая оплата того же пользователя
+
+        self.assertEqual(self.balance(42), (2, 200, 0))
+        self.assertEqual(self.balance(7), (0, 5, 1))
 
-# Create your tests here.
+    async def test_get_balance(self):
+        self.assertIsNone(await get_balance(42))
+        await sync_to_async(ledger.record_event)("evt_1", 42, PaymentEvent.PAYMENT, credits=1, generations=100)
+        balance = await get_balance(42)
+        self.assertEqual((balance.credits, balance.generations), (1, 100))
@@ -1,14 +1,19 @@
 # payments/views.py
+import json
+import logging
 import stripe
 from django.conf import settings
 from django.shortcuts import redirect, render
 from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
 from django.http import HttpResponse
-from .models import Payment
-from asgiref.sync import async_to_sync
+from .models import Payment, StripeEvent
+from .tasks import process_stripe_event
 stripe.api_key = settings.STRIPE_SECRET_KEY
 import os
 
+logger = logging.getLogger(__name__)
+
 # Получаем доменное имя из переменных окружения
 DOMAIN_NAME = os.getenv("DOMAIN_NAME", "localhost")
 BASE_URL = f"https://{DOMAIN_NAME}"
@@ -58,29 +63,21 @@ def stripe_webhook(request):
         event = stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
-    except (ValueError, stripe.error.SignatureVerificationError):
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        logger.warning("❌ Stripe webhook rejected: %s", e)
         return HttpResponse(status=400)
 
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-
-        # Достаём telegram_user_id из metadata
-        telegram_user_id = session.get('metadata', {}).get('telegram_user_id')
-        if telegram_user_id:
-            # Обновляем статус платежа
-            try:
-                payment = Payment.objects.get(telegram_user_id=telegram_user_id)
-                payment.status = 'paid'
-                payment.save()
-            except Payment.DoesNotExist:
-                pass
+    logger.info("📩 Stripe event %s (%s)", event['id'], event['type'])
 
-            # Отправляем сообщение в Telegram
-            from bot_api.bot import application
-            async_to_sync(application.bot.send_message)(
-                chat_id=telegram_user_id,
-                text="Оплата прошла успешно! Теперь вы можете загружать фото."
-            )
+    # Сохраняем событие и сразу отвечаем 200; обработка — в payments.tasks
+    stripe_event, created = StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={'type': event['type'], 'payload': json.loads(payload)},
+    )
+    if created or stripe_event.processed_at is None:
+        # Повторная доставка ещё не обработанного события ставит задачу снова
+        # (на случай потерянной задачи); сама задача идемпотентна
+        transaction.on_commit(lambda: process_stripe_event.delay(stripe_event.event_id))
 
     return HttpResponse(status=200)
 
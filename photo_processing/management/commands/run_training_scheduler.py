@@ -0,0 +1,38 @@
+import asyncio
+import tempfile
+
+from django.core.management.base import BaseCommand
+
+from photo_processing.training import TrainingScheduler
+
+
+class Command(BaseCommand):
+    help = "Запускает планировщик обучения LoRA с пулом GPU-инстансов RunPod"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fake", action="store_true",
+            help="Локальная замена RunPod и SSH (runpod_fake.py) вместо настоящих инстансов",
+        )
+
+    def handle(self, *args, **options):
+        if not options["fake"]:
+            asyncio.run(TrainingScheduler().run())
+            return
+
+        import runpod_fake
+        with tempfile.TemporaryDirectory(prefix="runpod_fake_") as workdir:
+            train_script = f"{workdir}/train_lora.py"
+            with open(train_script, "w") as f:
+                f.write(runpod_fake.FAKE_TRAIN_SCRIPT)
+            transport = runpod_fake.LocalTransport()
+            try:
+                scheduler = TrainingScheduler(
+                    api_transport=runpod_fake.FakeRunPod().transport(),
+                    transport=transport,
+                    train_script=train_script,
+                    remote_root=f"{workdir}/remote",
+                )
+                asyncio.run(scheduler.run())
+            finally:
+                transport.close()
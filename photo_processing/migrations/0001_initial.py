@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField(db_index=True)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('dataset_path', models.CharField(max_length=255)),
+                ('model_path', models.CharField(blank=True, max_length=255)),
+                ('instance_id', models.CharField(blank=True, max_length=100)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('queue_seconds', models.FloatField(blank=True, null=True)),
+                ('boot_seconds', models.FloatField(blank=True, null=True)),
+                ('upload_seconds', models.FloatField(blank=True, null=True)),
+                ('train_seconds', models.FloatField(blank=True, null=True)),
+                ('download_seconds', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+    ]
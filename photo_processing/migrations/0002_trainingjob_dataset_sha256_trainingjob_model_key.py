@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo_processing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trainingjob',
+            name='dataset_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='trainingjob',
+            name='model_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo_processing', '0002_trainingjob_dataset_sha256_trainingjob_model_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trainingjob',
+            name='scheduler_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo_processing', '0003_trainingjob_scheduler_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingInstance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.CharField(max_length=100, unique=True)),
+                ('ip', models.CharField(max_length=100)),
+                ('scheduler_id', models.CharField(db_index=True, max_length=100)),
+                ('launched_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,3 +1,55 @@
 from django.db import models
 
-# Create your models here.
+
+class TrainingJob(models.Model):
+    """Обучение LoRA для пользователя; время этапов пишет photo_processing.training."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    user_id = models.BigIntegerField(db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    dataset_path = models.CharField(max_length=255)  # имя в default_storage
+    model_path = models.CharField(max_length=255, blank=True)  # имя в default_storage
+    instance_id = models.CharField(max_length=100, blank=True)
+    scheduler_id = models.CharField(max_length=100, blank=True)  # планировщик, который взял задачу (TRAINING_SCHEDULER_ID)
+    # SHA-256 датасета и ключ модели (датасет + скрипт обучения): одинаковые входы не обучаются повторно
+    dataset_sha256 = models.CharField(max_length=64, blank=True)
+    model_key = models.CharField(max_length=64, blank=True, db_index=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    # Длительность этапов в секундах
+    queue_seconds = models.FloatField(blank=True, null=True)  # от постановки до начала
+    boot_seconds = models.FloatField(blank=True, null=True)  # ожидание инстанса (0 — тёплый)
+    upload_seconds = models.FloatField(blank=True, null=True)
+    train_seconds = models.FloatField(blank=True, null=True)
+    download_seconds = models.FloatField(blank=True, null=True)
+
+    def __str__(self):
+        return f"TrainingJob {self.pk} for {self.user_id}: {self.status}"
+
+
+class TrainingInstance(models.Model):
+    """Запущенный планировщиком инстанс RunPod; запись удаляется после его выключения.
+
+    Если планировщик остановился, не выключив инстансы (SIGKILL, падение), при
+    следующем запуске он выключает свои оставшиеся инстансы по этим записям.
+    """
+    instance_id = models.CharField(max_length=100, unique=True)
+    ip = models.CharField(max_length=100)
+    scheduler_id = models.CharField(max_length=100, db_index=True)  # TRAINING_SCHEDULER_ID
+    launched_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"TrainingInstance {self.instance_id} ({self.scheduler_id})"
@@ -0,0 +1,125 @@
+# photo_processing/pipeline.py
+"""
+Сборка датасета для обучения LoRA из загруженных фото пользователя.
+
+Когда у пользователя набирается REQUIRED_PHOTOS записей UserPhoto, фото
+упаковываются в dataset.zip (изображения + подписи + metadata.json) — тот
+архив, который runpod_lora_training_automation.upload_files отправляет на GPU.
+
+Фото подготавливаются параллельно в пуле потоков (Pillow отпускает GIL при
+декодировании, ресайзе и кодировании, поэтому потоки занимают все ядра),
+каждое подготовленное фото пишется во временный файл и сразу потоково
+копируется в архив — в памяти одновременно не больше одного фото на поток.
+"""
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from bot_api import resize_provider
+from bot_api.models import UserPhoto
+
+REQUIRED_PHOTOS = 10
+TARGET_SIZES = {(1024, 1024), (832, 1216)}
+COPY_CHUNK_SIZE = 1024 * 1024
+# Фиксированная дата записей архива: из тех же фото получается побайтно тот же
+# dataset.zip, и планировщик обучения узнаёт его по SHA-256
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def dataset_path(user_id):
+    return f"datasets/{user_id}/dataset.zip"
+
+
+def _prepare_photo(index, photo, work_dir):
+    """
+    Готовит одно фото к обучению и возвращает описание записи архива.
+
+    Фото, которые уже обработаны handle_photo (JPEG целевого размера),
+    копируются как есть; остальные проходят resize_provider.load_for_target.
+    """
+    arcname = f"{index:02d}.jpg"
+    with photo.image.open("rb") as source:
+        image = Image.open(source)
+        if image.format == "JPEG" and image.size in TARGET_SIZES:
+            size, path = image.size, None
+        else:
+            image = resize_provider.load_for_target(image)
+            size = image.size
+            path = os.path.join(work_dir, arcname)
+            image.save(path, format="JPEG", quality=95)
+
+    return {
+        "file": arcname,
+        "caption": f"photo of {settings.LORA_TRIGGER_WORD}",
+        "file_unique_id": photo.file_unique_id,
+        "width": size[0],
+        "height": size[1],
+        # None — копировать исходный файл из хранилища
+        "path": path,
+        "storage_name": photo.image.name,
+    }
+
+
+def _write_entry(archive, entry):
+    """Потоково копирует фото в архив и добавляет файл подписи рядом с ним."""
+    with archive.open(zipfile.ZipInfo(entry["file"], ZIP_DATE_TIME), "w") as target:
+        if entry["path"]:
+            with open(entry["path"], "rb") as source:
+                shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+            os.remove(entry["path"])
+        else:
+            with default_storage.open(entry["storage_name"], "rb") as source:
+                shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+
+    caption_name = os.path.splitext(entry["file"])[0] + ".txt"
+    archive.writestr(zipfile.ZipInfo(caption_name, ZIP_DATE_TIME), entry["caption"], compress_type=zipfile.ZIP_DEFLATED)
+
+
+def build_dataset(user_id):
+    """
+    Собирает dataset.zip для пользователя и сохраняет его в default_storage.
+    Возвращает имя файла в хранилище.
+    """
+    photos = list(
+        UserPhoto.objects.filter(user_id=user_id).exclude(image="").exclude(image__isnull=True).order_by("id")
+    )
+    if len(photos) < REQUIRED_PHOTOS:
+        raise ValueError(f"User {user_id} has {len(photos)} processed photos, {REQUIRED_PHOTOS} required")
+    photos = photos[:REQUIRED_PHOTOS]
+
+    with tempfile.TemporaryDirectory(prefix="dataset_") as work_dir:
+        zip_path = os.path.join(work_dir, "dataset.zip")
+        images = []
+
+        with ThreadPoolExecutor(max_workers=settings.DATASET_BUILD_WORKERS) as executor, \
+                zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            # map отдаёт результаты по порядку, пока остальные фото ещё готовятся
+            prepared = executor.map(lambda item: _prepare_photo(item[0], item[1], work_dir), enumerate(photos, 1))
+            for entry in prepared:
+                _write_entry(archive, entry)
+                images.append({key: entry[key] for key in ("file", "caption", "file_unique_id", "width", "height")})
+
+            metadata = {
+                "user_id": user_id,
+                "trigger_word": settings.LORA_TRIGGER_WORD,
+                "images": images,
+            }
+            archive.writestr(
+                zipfile.ZipInfo("metadata.json", ZIP_DATE_TIME),
+                json.dumps(metadata, indent=2),
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+
+        name = dataset_path(user_id)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        with open(zip_path, "rb") as zip_file:
+            return default_storage.save(name, File(zip_file))
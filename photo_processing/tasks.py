@@ -1,17 +1,128 @@
 from celery import shared_task
+from celery.signals import worker_process_init
+import logging
 import requests
 import os
+import time
+from django.conf import settings
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from ai_photo_bot.ratelimit import get_limits
 
 load_dotenv()
 
-@shared_task
-def send_telegram_message(chat_id, text):
-    token = os.getenv('TELEGRAM_BOT_TOKEN')
-    url = f'https://api.telegram.org/bot{token}/sendMessage'
-    payload = {
-        'chat_id': chat_id,
-        'text': text
-    }
-    response = requests.post(url, data=payload)
-    return response.json()
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = f"https://api.telegram.org/bot{os.getenv('TELEGRAM_BOT_TOKEN')}"
+
+# Одна keep-alive сессия на процесс воркера: соединение с api.telegram.org
+# и TLS переиспользуются между задачами
+_session = None
+
+
+def telegram_session():
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.TELEGRAM_HTTP_POOL_SIZE,
+            max_retries=2,  # только ошибки соединения, 4xx/5xx не повторяются
+        )
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+
+@worker_process_init.connect
+def _reset_session(**kwargs):
+    # После fork prefork-воркера сокеты родителя не используем
+    global _session
+    _session = None
+
+
+class TelegramRetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _send(chat_id, text, broadcast=False):
+    # Лимиты общие с ботом и другими воркерами (ai_photo_bot.ratelimit)
+    limits = get_limits()
+    time.sleep(max(limits.reserve_chat(chat_id), limits.reserve_global(broadcast)))
+
+    response = telegram_session().post(
+        f"{TELEGRAM_API_URL}/sendMessage",
+        data={'chat_id': chat_id, 'text': text},
+        timeout=settings.TELEGRAM_HTTP_TIMEOUT,
+    )
+    result = response.json()
+    if response.status_code == 429:
+        # Telegram просит подождать: останавливаем отправку во всех процессах
+        retry_after = result.get('parameters', {}).get('retry_after', 1)
+        limits.pause(retry_after)
+        raise TelegramRetryAfter(retry_after)
+    return result
+
+
+@shared_task(bind=True, max_retries=settings.OUTBOX_MAX_RETRIES)
+def send_telegram_message(self, chat_id, text):
+    try:
+        return _send(chat_id, text)
+    except TelegramRetryAfter as e:
+        raise self.retry(countdown=e.retry_after)
+
+
+@shared_task(bind=True, max_retries=settings.OUTBOX_MAX_RETRIES)
+def send_telegram_messages(self, messages):
+    """
+    Отправляет пачку сообщений рассылки [(chat_id, text), ...] одной задачей.
+    Идёт в своей очереди broadcast и с лимитом OUTBOX_BROADCAST_RATE, чтобы
+    не отнимать воркеры и лимит у ответов пользователям. Ошибка одного сообщения (бот заблокирован и т.п.) не останавливает пачку;
+    на 429 задача перезапускается с ещё не отправленным остатком.
+    """
+    sent = failed = 0
+    for i, (chat_id, text) in enumerate(messages):
+        try:
+            result = _send(chat_id, text, broadcast=True)
+        except TelegramRetryAfter as e:
+            raise self.retry(args=[messages[i:]], countdown=e.retry_after)
+        except requests.RequestException as e:
+            logger.warning("❌ sendMessage to %s failed: %s", chat_id, e)
+            failed += 1
+            continue
+        if result.get('ok'):
+            sent += 1
+        else:
+            logger.warning("❌ sendMessage to %s failed: %s", chat_id, result.get('description'))
+            failed += 1
+    return {'sent': sent, 'failed': failed}
+
+
+def broadcast(messages, batch_size=None):
+    """Ставит рассылку в очередь пачками по TELEGRAM_BATCH_SIZE сообщений."""
+    batch_size = batch_size or settings.TELEGRAM_BATCH_SIZE
+    messages = list(messages)
+    return [
+        send_telegram_messages.delay(messages[i:i + batch_size])
+        for i in range(0, len(messages), batch_size)
+    ]
+
+
+# acks_late: при падении воркера сборка датасета (идемпотентная) повторится
+@shared_task(acks_late=True)
+def build_training_dataset(user_id):
+    """
+    Собирает dataset.zip из 10 фото пользователя (см. photo_processing.pipeline)
+    и ставит обучение в очередь планировщика photo_processing.training.
+    """
+    from photo_processing.models import TrainingJob
+    from photo_processing.pipeline import build_dataset
+
+    name = build_dataset(user_id)
+    active = TrainingJob.objects.filter(user_id=user_id, status__in=[TrainingJob.QUEUED, TrainingJob.RUNNING])
+    if not active.exists():
+        TrainingJob.objects.create(user_id=user_id, dataset_path=name)
+    return name
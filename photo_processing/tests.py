@@ -1,3 +1,191 @@
-from django.test import TestCase
+import asyncio
+import shlex
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+
+import runpod_fake
+import runpod_lora_training_automation as automation
+from runpod_fake import FakeRunPod
+from .models import TrainingInstance, TrainingJob
+from .training import TrainingScheduler
+
+
+class FakeProcess:
+    def __init__(self, returncode):
+        self.returncode = returncode
+
+    async def wait(self):
+        return self.returncode
+
+    async def communicate(self):
+        return b"", b""
+
+
+class SSHTransportCommandTests(SimpleTestCase):
+    """Проверяем командные строки ssh/rsync/scp, которые собирает SSHTransport."""
+
+    def setUp(self):
+        self.control_dir = tempfile.mkdtemp(prefix="runpod_ssh_test_")
+        self.addCleanup(shutil.rmtree, self.control_dir, ignore_errors=True)
+        self.transport = automation.SSHTransport(
+            username="ubuntu", key_path="/keys/id_rsa", port=2222, compress=True, control_dir=self.control_dir
+        )
+        self.commands = []
+        self.returncodes = []
+
+        async def create_subprocess_exec(*cmd, **kwargs):
+            self.commands.append(list(cmd))
+            return FakeProcess(self.returncodes.pop(0) if self.returncodes else 0)
+
+        patcher = mock.patch.object(asyncio, "create_subprocess_exec", create_subprocess_exec)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertOptions(self, argv, master="no"):
+        options = dict(
+            argv[i + 1].split("=", 1) for i, arg in enumerate(argv) if arg == "-o"
+        )
+        self.assertEqual(options["ControlMaster"], master)
+        self.assertEqual(options["ControlPath"], f"{self.control_dir}/%C")
+        self.assertEqual(options["Port"], "2222")
+        self.assertEqual(options["BatchMode"], "yes")
+        self.assertEqual(options["StrictHostKeyChecking"], "accept-new")
+        self.assertEqual(options["UserKnownHostsFile"], f"{self.control_dir}/known_hosts")
+        self.assertEqual(argv[argv.index("-i") + 1], "/keys/id_rsa")
+
+    async def test_connect_opens_master_when_check_fails(self):
+        self.returncodes = [255, 0]
+        await self.transport.connect("10.0.0.1")
+
+        check, master = self.commands
+        self.assertEqual(check[0], "ssh")
+        self.assertEqual(check[-3:], ["-O", "check", "ubuntu@10.0.0.1"])
+        self.assertOptions(check)
+        self.assertEqual(master[0], "ssh")
+        self.assertEqual(master[-3:], ["-f", "-N", "ubuntu@10.0.0.1"])
+        self.assertOptions(master, master="yes")
+
+    async def test_connect_reuses_open_master(self):
+        await self.transport.connect("10.0.0.1")
+        self.assertEqual(len(self.commands), 1)
+        self.assertEqual(self.commands[0][-2:], ["check", "ubuntu@10.0.0.1"])
+
+    async def test_disconnect_forgets_host_key(self):
+        await self.transport.disconnect("10.0.0.1")
+        exit, forget = self.commands
+        self.assertEqual(exit[-3:], ["-O", "exit", "ubuntu@10.0.0.1"])
+        self.assertEqual(forget, ["ssh-keygen", "-R", "[10.0.0.1]:2222", "-f", f"{self.control_dir}/known_hosts"])
+
+    async def test_run(self):
+        await self.transport.run("10.0.0.1", "ls -la")
+        (argv,) = self.commands
+        self.assertEqual(argv[0], "ssh")
+        self.assertEqual(argv[-2:], ["ubuntu@10.0.0.1", "ls -la"])
+        self.assertOptions(argv)
+
+    async def test_upload_with_rsync(self):
+        self.transport.use_rsync = True
+        await self.transport.upload("10.0.0.1", "/data/dataset.zip", "/remote/dataset.zip")
+        (argv,) = self.commands
+        self.assertEqual(argv[0], "rsync")
+        for flag in ("--compress", "--partial", "--copy-links"):
+            self.assertIn(flag, argv)
+        self.assertEqual(argv[-2:], ["/data/dataset.zip", "ubuntu@10.0.0.1:/remote/dataset.zip"])
+        shell = shlex.split(argv[argv.index("-e") + 1])
+        self.assertEqual(shell[0], "ssh")
+        self.assertOptions(shell)
+
+    async def test_upload_with_scp(self):
+        self.transport.use_rsync = False
+        await self.transport.upload("10.0.0.1", "/data/dataset.zip", "/remote/dataset.zip")
+        (argv,) = self.commands
+        self.assertEqual(argv[:2], ["scp", "-C"])
+        self.assertEqual(argv[-2:], ["/data/dataset.zip", "ubuntu@10.0.0.1:/remote/dataset.zip"])
+        self.assertOptions(argv)
+
+    async def test_download(self):
+        self.transport.use_rsync = True
+        await self.transport.download("10.0.0.1", "/remote/model.lora", "/models/model.lora")
+        (argv,) = self.commands
+        self.assertEqual(argv[0], "rsync")
+        self.assertEqual(argv[-2:], ["ubuntu@10.0.0.1:/remote/model.lora", "/models/model.lora"])
+        self.assertOptions(shlex.split(argv[argv.index("-e") + 1]))
+
+
+class FakeRunTests(SimpleTestCase):
+    """runpod_fake.run: весь цикл обучения на локальной замене RunPod и SSH."""
+
+    async def test_run(self):
+        runpods = []
+
+        def fake_runpod():
+            runpods.append(FakeRunPod())
+            return runpods[-1]
+
+        with mock.patch.object(runpod_fake, "FakeRunPod", side_effect=fake_runpod):
+            results = await runpod_fake.run(3)
+
+        # 3 задачи и 3 повторных из кэша; лишний False добавляется, если инстансы остались
+        self.assertEqual(results, [True] * 6)
+        (runpod,) = runpods
+        self.assertEqual(runpod.launched, 3)
+        self.assertEqual(runpod.running, set())
+
+
+@override_settings(TRAINING_SCHEDULER_ID="scheduler-a")
+class SchedulerRecoveryTests(TestCase):
+    """Перезапуск планировщика после SIGKILL: его инстансы выключаются, задачи возвращаются в очередь."""
+
+    async def launch(self, api, scheduler_id):
+        data = await automation.launch_instance(api)
+        await TrainingInstance.objects.acreate(
+            instance_id=data["instance_id"], ip=data["instance_ip"], scheduler_id=scheduler_id
+        )
+        return data["instance_id"]
+
+    async def test_recover_shuts_down_own_instances_and_requeues_jobs(self):
+        runpod = runpod_fake.FakeRunPod()
+        transport = runpod_fake.LocalTransport()
+        self.addCleanup(transport.close)
+        scheduler = TrainingScheduler(api_transport=runpod.transport(), transport=transport)
+
+        async with automation.create_api_client(scheduler.api_transport) as api:
+            scheduler.api = api
+            await self.launch(api, "scheduler-a")
+            await self.launch(api, "scheduler-a")
+            other = await self.launch(api, "scheduler-b")
+            own_job = await TrainingJob.objects.acreate(
+                user_id=1, dataset_path="a.zip", status=TrainingJob.RUNNING, scheduler_id="scheduler-a"
+            )
+            other_job = await TrainingJob.objects.acreate(
+                user_id=2, dataset_path="b.zip", status=TrainingJob.RUNNING, scheduler_id="scheduler-b"
+            )
+
+            await scheduler.recover()
+
+        self.assertEqual(runpod.running, {other})
+        self.assertEqual(
+            [row async for row in TrainingInstance.objects.values_list("instance_id", flat=True)], [other]
+        )
+        await own_job.arefresh_from_db()
+        await other_job.arefresh_from_db()
+        self.assertEqual((own_job.status, own_job.scheduler_id), (TrainingJob.QUEUED, ""))
+        self.assertEqual(other_job.status, TrainingJob.RUNNING)
+
+    async def test_instance_is_recorded_until_shutdown(self):
+        runpod = runpod_fake.FakeRunPod()
+        transport = runpod_fake.LocalTransport()
+        self.addCleanup(transport.close)
+        scheduler = TrainingScheduler(api_transport=runpod.transport(), transport=transport)
+
+        async with automation.create_api_client(scheduler.api_transport) as api:
+            scheduler.api = api
+            instance = await scheduler._launch()
+            self.assertTrue(await TrainingInstance.objects.filter(instance_id=instance.id).aexists())
+            await scheduler._shutdown(instance)
+
+        self.assertFalse(await TrainingInstance.objects.aexists())
+        self.assertEqual(runpod.running, set())
@@ -0,0 +1,373 @@
+# photo_processing/training.py
+"""
+Планировщик обучения LoRA с пулом тёплых GPU-инстансов.
+
+Вместо «инстанс на пользователя» (runpod_lora_training_automation.train_job)
+один процесс (manage.py run_training_scheduler) держит пул инстансов RunPod:
+
+- задачи TrainingJob забираются из БД (select_for_update skip_locked) не
+  больше, чем есть свободных мест в пуле (TRAINING_POOL_MAX_SIZE);
+- задача идёт на свободный тёплый инстанс, а если его нет — запускается
+  новый; после задачи инстанс возвращается в пул и берёт следующую, без
+  повторной загрузки и минимальной оплаты;
+- инстансы, простаивающие дольше TRAINING_POOL_IDLE_TIMEOUT, выключаются,
+  но не меньше TRAINING_POOL_MIN_SIZE остаются тёплыми;
+- новый инстанс берётся в работу, как только API RunPod и порт SSH
+  отвечают (runpod_lora_training_automation.wait_until_ready); SSH-соединение
+  с инстансом (ControlMaster) остаётся открытым между задачами и закрывается
+  вместе с инстансом;
+- прогресс обучения читается из вывода скрипта построчно и не чаще
+  TRAINING_PROGRESS_INTERVAL отправляется пользователю в Telegram;
+- время ожидания в очереди, запуска инстанса, загрузки, обучения и
+  скачивания модели записывается в TrainingJob;
+- у задачи считается SHA-256 датасета и ключ модели (датасет + скрипт); если
+  модель с таким ключом уже обучена, задача сразу завершается с ней, без
+  инстанса, а задачи с одинаковым ключом выполняются по очереди;
+- задача помечается планировщиком, который её взял (TRAINING_SCHEDULER_ID);
+  после перезапуска он возвращает в очередь только свои прерванные задачи;
+- запущенные инстансы записываются в TrainingInstance; на SIGTERM (docker
+  stop) планировщик прерывает задачи и выключает инстансы, а если его убили
+  раньше, при следующем запуске сначала выключает оставшиеся по записям
+  инстансы и только потом возвращает задачи в очередь.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import signal
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+import runpod_lora_training_automation as automation
+from .models import TrainingInstance, TrainingJob
+from .tasks import send_telegram_message
+
+logger = logging.getLogger(__name__)
+
+
+def model_path(job):
+    return f"models/{job.user_id}/{job.pk}.lora"
+
+
+@sync_to_async
+def claim_jobs(limit, scheduler_id):
+    """Переводит до limit задач из очереди в running (старые первыми)."""
+    with transaction.atomic():
+        jobs = list(
+            TrainingJob.objects.select_for_update(skip_locked=True)
+            .filter(status=TrainingJob.QUEUED)
+            .order_by("created_at")[:limit]
+        )
+        now = timezone.now()
+        for job in jobs:
+            job.status = TrainingJob.RUNNING
+            job.scheduler_id = scheduler_id
+            job.started_at = now
+            job.queue_seconds = (now - job.created_at).total_seconds()
+        TrainingJob.objects.bulk_update(jobs, ["status", "scheduler_id", "started_at", "queue_seconds"])
+    return jobs
+
+
+@sync_to_async
+def requeue_interrupted(scheduler_id):
+    """Задачи планировщика, оставшиеся в running после его остановки, возвращаются в очередь.
+
+    Задачи других планировщиков не трогаем — они их ещё выполняют.
+    """
+    return TrainingJob.objects.filter(status=TrainingJob.RUNNING, scheduler_id=scheduler_id) \
+        .update(status=TrainingJob.QUEUED, scheduler_id="", started_at=None)
+
+
+@sync_to_async
+def record_instance(instance, scheduler_id):
+    TrainingInstance.objects.create(instance_id=instance.id, ip=instance.ip, scheduler_id=scheduler_id)
+
+
+@sync_to_async
+def forget_instance(instance):
+    TrainingInstance.objects.filter(instance_id=instance.id).delete()
+
+
+@sync_to_async
+def recorded_instances(scheduler_id):
+    """Инстансы, которые планировщик запустил и не выключил (по записям в БД)."""
+    return [
+        Instance(instance_id, ip)
+        for instance_id, ip in TrainingInstance.objects.filter(scheduler_id=scheduler_id)
+        .values_list("instance_id", "ip")
+    ]
+
+
+@sync_to_async
+def find_trained_model(model_key):
+    """Имя уже обученной модели с тем же ключом или None."""
+    names = TrainingJob.objects.filter(model_key=model_key, status=TrainingJob.DONE).exclude(model_path="") \
+        .order_by("-finished_at").values_list("model_path", flat=True)
+    for name in names:
+        if default_storage.exists(name):
+            return name
+    return None
+
+
+@sync_to_async
+def save_hashes(job, spec):
+    job.dataset_sha256 = spec.dataset_sha256
+    job.model_key = spec.model_key
+    job.save(update_fields=["dataset_sha256", "model_key"])
+
+
+@sync_to_async
+def finish_job(job, fields):
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.finished_at = timezone.now()
+    job.save(update_fields=[*fields, "finished_at"])
+
+
+async def notify_user(user_id, text):
+    # delay() — синхронная запись в брокер, выносим из event loop
+    try:
+        await asyncio.to_thread(send_telegram_message.delay, user_id, text)
+    except Exception as e:
+        logger.warning("❌ Can't notify %s about training: %s", user_id, e)
+
+
+def progress_text(step, total, eta):
+    text = f"⏳ Обучаем ваш аватар: {step * 100 // total}%"
+    if eta:
+        text += f", осталось примерно {max(1, round(eta / 60))} мин."
+    return text
+
+
+class Instance:
+    def __init__(self, instance_id, ip):
+        self.id = instance_id
+        self.ip = ip
+        self.idle_since = time.monotonic()
+
+
+class TrainingScheduler:
+    def __init__(self, api_transport=None, transport=None, train_script=None, remote_root=None):
+        self.api_transport = api_transport
+        self.transport = transport or automation.SSHTransport()
+        self.train_script = train_script or settings.TRAINING_SCRIPT_PATH
+        self.remote_root = remote_root or automation.REMOTE_WORK_DIR
+        self.min_size = settings.TRAINING_POOL_MIN_SIZE
+        self.max_size = settings.TRAINING_POOL_MAX_SIZE
+        self.scheduler_id = settings.TRAINING_SCHEDULER_ID
+
+        self.api = None
+        self.idle = []       # тёплые инстансы без задачи
+        self.busy = 0        # задач в работе (каждая держит или ждёт инстанс)
+        self.booting = 0     # запасных инстансов в процессе запуска
+        self._tasks = set()
+        self._same_inputs = {}  # model_key -> [lock, сколько задач его держат или ждут]
+
+    # --- инстансы ---
+
+    async def _launch(self):
+        data = await automation.launch_instance(self.api)
+        instance = Instance(data["instance_id"], data["instance_ip"])
+        try:
+            # Запись сразу после запуска: без неё инстанс после падения планировщика не найти
+            await record_instance(instance, self.scheduler_id)
+            await automation.wait_until_ready(self.api, self.transport, data)
+        except BaseException:
+            await self._shutdown(instance)
+            raise
+        return instance
+
+    async def _shutdown(self, instance):
+        await self.transport.disconnect(instance.ip)
+        # Если RunPod не ответил, запись остаётся — выключим при следующем запуске
+        if await automation.shutdown_instance(self.api, instance.id):
+            await forget_instance(instance)
+
+    async def _acquire(self):
+        if self.idle:
+            return self.idle.pop()
+        return await self._launch()
+
+    def _release(self, instance):
+        instance.idle_since = time.monotonic()
+        self.idle.append(instance)
+
+    async def _boot_spare(self):
+        try:
+            self._release(await self._launch())
+        except Exception as e:
+            logger.error("❌ Spare instance failed to launch: %s", e)
+        finally:
+            self.booting -= 1
+
+    async def _scale(self):
+        # Держим минимум тёплых инстансов
+        while self.busy + len(self.idle) + self.booting < min(self.min_size, self.max_size):
+            self.booting += 1
+            self._spawn(self._boot_spare())
+
+        # Выключаем лишние простаивающие
+        now = time.monotonic()
+        for instance in list(self.idle):
+            if self.busy + len(self.idle) <= self.min_size:
+                break
+            if now - instance.idle_since >= settings.TRAINING_POOL_IDLE_TIMEOUT:
+                self.idle.remove(instance)
+                await self._shutdown(instance)
+
+    # --- задачи ---
+
+    def _spec(self, job):
+        name = model_path(job)
+        os.makedirs(os.path.dirname(default_storage.path(name)), exist_ok=True)
+        return automation.LoraJob(
+            job_id=f"job{job.pk}",
+            dataset_path=default_storage.path(job.dataset_path),
+            model_save_path=default_storage.path(name),
+            train_script=self.train_script,
+            remote_root=self.remote_root,
+        )
+
+    def _progress(self, job):
+        last_sent = None
+
+        async def on_progress(step, total, eta):
+            nonlocal last_sent
+            now = time.monotonic()
+            if last_sent is not None and now - last_sent < settings.TRAINING_PROGRESS_INTERVAL:
+                return
+            last_sent = now
+            await notify_user(job.user_id, progress_text(step, total, eta))
+
+        return on_progress
+
+    @contextlib.asynccontextmanager
+    async def _inputs_lock(self, model_key):
+        # Задачи с тем же датасетом ждут первую и получают её модель;
+        # запись удаляется, когда лок никто не держит и не ждёт
+        entry = self._same_inputs.setdefault(model_key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._same_inputs[model_key]
+
+    async def _run_job(self, job):
+        try:
+            spec = self._spec(job)
+            await automation.hash_inputs(spec)
+            await save_hashes(job, spec)
+
+            async with self._inputs_lock(spec.model_key):
+                trained = await find_trained_model(spec.model_key)
+                if not trained:
+                    await self._train(job, spec)
+                    return
+            logger.info("♻️ Training job %s: model %s already trained, reusing it", job.pk, trained)
+            await finish_job(job, {"status": TrainingJob.DONE, "model_path": trained})
+            await notify_user(job.user_id, "✅ Ваш аватар готов!")
+        except Exception as e:
+            # Входы не прочитались, хранилище без локальных путей, ошибка БД и т.п.
+            logger.error("❌ Training job %s failed: %s", job.pk, e)
+            await finish_job(job, {"status": TrainingJob.FAILED, "error": str(e)})
+        finally:
+            self.busy -= 1
+
+    async def _train(self, job, spec):
+        timings, fields, instance = {}, {}, None
+        try:
+            clock = time.monotonic()
+            instance = await self._acquire()
+            fields["boot_seconds"] = time.monotonic() - clock
+            fields["instance_id"] = instance.id
+
+            await automation.train_on_instance(
+                self.transport, instance.ip, spec, timings, self._progress(job)
+            )
+            fields.update(status=TrainingJob.DONE, model_path=model_path(job))
+            self._release(instance)
+            instance = None
+            logger.info("✅ Training job %s done on %s", job.pk, fields["instance_id"])
+            await notify_user(job.user_id, "✅ Ваш аватар готов!")
+        except Exception as e:
+            logger.error("❌ Training job %s failed: %s", job.pk, e)
+            fields.update(status=TrainingJob.FAILED, error=str(e))
+            await notify_user(job.user_id, "❌ Не удалось обучить аватар. Мы уже разбираемся и напишем вам.")
+        finally:
+            if instance:
+                # После ошибки или остановки состояние инстанса неизвестно — в пул не возвращаем
+                await self._shutdown(instance)
+
+        for step in ("upload", "train", "download"):
+            if step in timings:
+                fields[f"{step}_seconds"] = timings[step]
+        await finish_job(job, fields)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def tick(self):
+        capacity = self.max_size - self.busy - self.booting
+        if capacity > 0:
+            for job in await claim_jobs(capacity, self.scheduler_id):
+                self.busy += 1
+                self._spawn(self._run_job(job))
+        await self._scale()
+
+    async def recover(self):
+        """Убирает следы прошлого запуска: выключает его инстансы, потом возвращает задачи в очередь."""
+        orphaned = await recorded_instances(self.scheduler_id)
+        for instance in orphaned:
+            logger.info("🧹 Shutting down instance %s left by a previous run", instance.id)
+            await self._shutdown(instance)
+
+        recovered = await requeue_interrupted(self.scheduler_id)
+        if recovered:
+            logger.info("🔁 %s interrupted training jobs returned to the queue", recovered)
+
+    async def run(self):
+        # docker stop шлёт SIGTERM: отменяем главную задачу, чтобы stop() выключил инстансы
+        loop = asyncio.get_running_loop()
+        main = asyncio.current_task()
+        terminated = False
+
+        def on_sigterm():
+            nonlocal terminated
+            terminated = True
+            main.cancel()
+
+        loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+        try:
+            async with automation.create_api_client(self.api_transport) as api:
+                self.api = api
+                await self.recover()
+                try:
+                    while True:
+                        await self.tick()
+                        await asyncio.sleep(settings.TRAINING_POLL_INTERVAL)
+                finally:
+                    await self.stop()
+        except asyncio.CancelledError:
+            if not terminated:
+                raise
+            logger.info("🛑 Training scheduler stopped by SIGTERM")
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+
+    async def stop(self):
+        """Прерывает задачи (при следующем запуске они вернутся в очередь) и выключает пул."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        while self.idle:
+            await self._shutdown(self.idle.pop())
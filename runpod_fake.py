@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for RunPod and SSH
+---------------------------------
+
+Lets runpod_lora_training_automation run end-to-end on one machine:
+
+    - FakeRunPod serves the /launch, /instances/<id> and /shutdown/<id> API through
+      httpx.MockTransport and keeps track of instances that are still running; a new
+      instance reports 'starting' on its first status check.
+    - LocalTransport implements the SSHTransport interface with local processes:
+      "remote" commands run in `sh -c`, uploads and downloads are resumable file
+      copies (like rsync --partial), and connect() calls that would open a new SSH
+      connection are counted, so the run shows how many handshakes it needed.
+    - FAKE_TRAIN_SCRIPT imitates the training script: prints step progress and
+      writes a model file derived from the dataset.
+    - run() trains a batch of jobs and then retrains the same datasets, which must be
+      served from the model cache.
+
+Usage:
+    python runpod_lora_training_automation.py --fake 5
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import httpx
+
+import runpod_lora_training_automation as automation
+
+logger = logging.getLogger("runpod_training")
+
+FAKE_TRAIN_SCRIPT = '''\
+import argparse, hashlib, time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset")
+parser.add_argument("--output")
+parser.add_argument("--steps", type=int, default=5)
+args = parser.parse_args()
+
+with open(args.dataset, "rb") as f:
+    digest = hashlib.sha256(f.read()).hexdigest()
+for step in range(1, args.steps + 1):
+    time.sleep(0.1)
+    print(f"step {step}/{args.steps} loss={1 / step:.3f}", flush=True)
+with open(args.output, "w") as f:
+    f.write(f"fake lora for dataset {digest}\\n")
+'''
+
+
+class FakeRunPod:
+    """In-process RunPod API; every instance gets its own loopback address."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.running = set()
+        self.polled = set()
+        self.launched = 0
+
+    def _handle(self, request):
+        path = request.url.path
+        if request.method == "POST" and path == "/launch":
+            number = next(self._ids)
+            instance_id = f"fake-{number}"
+            self.running.add(instance_id)
+            self.launched += 1
+            return httpx.Response(200, json={"instance_id": instance_id, "instance_ip": f"127.0.{number // 250}.{number % 250 + 1}"})
+        if request.method == "GET" and path.startswith("/instances/"):
+            instance_id = path.rsplit("/", 1)[1]
+            if instance_id not in self.running:
+                return httpx.Response(404, json={"error": "unknown instance"})
+            status = "running" if instance_id in self.polled else "starting"
+            self.polled.add(instance_id)
+            return httpx.Response(200, json={"instance_id": instance_id, "status": status})
+        if request.method == "POST" and path.startswith("/shutdown/"):
+            instance_id = path.rsplit("/", 1)[1]
+            if instance_id not in self.running:
+                return httpx.Response(404, json={"error": "unknown instance"})
+            self.running.discard(instance_id)
+            return httpx.Response(200, json={"status": "terminated"})
+        return httpx.Response(404, json={"error": "not found"})
+
+    def transport(self):
+        return httpx.MockTransport(self._handle)
+
+
+def copy_resumable(source, destination, chunk_size=1024 * 1024):
+    """Copy via destination.partial, continuing from whatever an interrupted copy left there."""
+    partial = destination + ".partial"
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    with open(source, "rb") as src, open(partial, "ab") as dst:
+        src.seek(offset)
+        shutil.copyfileobj(src, dst, chunk_size)
+    os.replace(partial, destination)
+
+
+class LocalTransport:
+    """SSHTransport replacement that runs "remote" commands on this machine."""
+
+    def __init__(self):
+        self.connections = 0  # connect() calls that would have opened a new SSH connection
+        self._connected = set()
+        # Training commands call `python`; point it at the current interpreter
+        self._bin = tempfile.mkdtemp(prefix="runpod_fake_bin_")
+        os.symlink(sys.executable, os.path.join(self._bin, "python"))
+        self._env = {**os.environ, "PATH": f"{self._bin}{os.pathsep}{os.environ.get('PATH', '')}"}
+
+    async def is_reachable(self, instance_ip, timeout=2):
+        return True
+
+    async def connect(self, instance_ip):
+        if instance_ip not in self._connected:
+            self._connected.add(instance_ip)
+            self.connections += 1
+
+    async def disconnect(self, instance_ip):
+        self._connected.discard(instance_ip)
+
+    async def run(self, instance_ip, command):
+        return await automation.run_command("sh", "-c", command)
+
+    async def start(self, instance_ip, command):
+        return await asyncio.create_subprocess_exec(
+            "sh", "-c", command,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=self._env,
+        )
+
+    async def upload(self, instance_ip, local_path, remote_path):
+        await asyncio.to_thread(copy_resumable, local_path, remote_path)
+
+    async def download(self, instance_ip, remote_path, local_path):
+        await asyncio.to_thread(copy_resumable, remote_path, local_path)
+
+    def close(self):
+        shutil.rmtree(self._bin, ignore_errors=True)
+
+
+def make_jobs(workdir, count):
+    """Create `count` jobs with random datasets under workdir; "remote" files go to workdir/remote."""
+    script = os.path.join(workdir, "train_lora.py")
+    with open(script, "w") as f:
+        f.write(FAKE_TRAIN_SCRIPT)
+
+    jobs = []
+    for i in range(1, count + 1):
+        dataset = os.path.join(workdir, f"dataset{i}.zip")
+        with open(dataset, "wb") as f:
+            f.write(os.urandom(64 * 1024))
+        jobs.append(automation.LoraJob(
+            job_id=f"job{i}",
+            dataset_path=dataset,
+            model_save_path=os.path.join(workdir, f"model{i}.lora"),
+            train_script=script,
+            remote_root=os.path.join(workdir, "remote"),
+        ))
+    return jobs
+
+
+async def run(count=1):
+    """
+    Train `count` fake jobs concurrently, then retrain the same datasets: the second pass
+    must be served from the model cache without launching any instance. Also checks that
+    every instance was shut down.
+    """
+    runpod = FakeRunPod()
+    transport = LocalTransport()
+    with tempfile.TemporaryDirectory(prefix="runpod_fake_") as workdir:
+        cache = automation.ArtifactCache(os.path.join(workdir, "cache"))
+        jobs = make_jobs(workdir, count)
+        results, retrain, launched = [], [], 0
+        try:
+            results = await automation.main(
+                jobs, api_transport=runpod.transport(), transport=transport, cache=cache
+            )
+            launched = runpod.launched
+
+            retrain = [
+                automation.LoraJob(
+                    job_id=f"{job.job_id}-retrain",
+                    dataset_path=job.dataset_path,
+                    model_save_path=f"{job.model_save_path}.retrain",
+                    train_script=job.train_script,
+                    remote_root=job.remote_root,
+                )
+                for job in jobs
+            ]
+            results += await automation.main(
+                retrain, api_transport=runpod.transport(), transport=transport, cache=cache
+            )
+        finally:
+            transport.close()
+        missing = [job.job_id for job in jobs + retrain if not os.path.exists(job.model_save_path)]
+
+    logger.info(
+        f"Fake run: {sum(results)}/{2 * count} jobs succeeded, {launched} instances launched "
+        f"(+{runpod.launched - launched} on retrain), {transport.connections} SSH connections, "
+        f"{len(runpod.running)} left running, missing models: {missing or 'none'}"
+    )
+    if runpod.running or runpod.launched != launched:
+        results.append(False)
+    return results
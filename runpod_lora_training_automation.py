@@ -1,356 +1,868 @@
-#!/usr/bin/env python3
-"""
-RunPod LoRA Training Automation Script
----------------------------------------
-
-This script automates the process of training a LoRA model on a RunPod GPU instance.
-It performs the following steps:
-
-    1. Launch a GPU instance on RunPod via the API.
-    2. Upload necessary files (dataset and training script) to the instance.
-    3. Start the LoRA training process remotely.
-    4. Asynchronously wait for the training process to complete.
-    5. Download the trained model back to the local machine.
-    6. Clean up remote files (dataset, training script, and model) from the instance.
-    7. Shutdown the GPU instance on RunPod.
-
-This script is designed to be stable, well-logged, and modular, so it can be easily
-modified, scaled, or integrated into your main project.
-
-Before running, ensure that:
-    - You have a valid RunPod API key.
-    - The RunPod API URL is correct.
-    - All file paths (local and remote) are updated to reflect your environment.
-    - SSH credentials (username and SSH key) are correctly configured.
-"""
-
-import asyncio
-import logging
-import subprocess
-import sys
-import requests
-
-# -------------------------------------------------------------------------
-# Configuration Section - Update these parameters for your environment.
-# -------------------------------------------------------------------------
-
-# RunPod API endpoint (update if needed)
-RUNPOD_API_URL = "https://api.runpod.io"  # Replace with your actual RunPod API endpoint
-
-# API key for authenticating with RunPod.
-API_KEY = "YOUR_API_KEY"  # Replace with your RunPod API key
-
-# Instance configuration payload for launching a GPU instance.
-# Modify parameters such as 'instance_type' and 'image' as per your requirements.
-INSTANCE_PAYLOAD = {
-    "instance_type": "GPU",           # e.g., 'GPU'
-    "image": "your_docker_image",     # Replace with your Docker image that includes the LoRA training environment
-    # Additional parameters can be added here for further customization.
-}
-
-# Local file paths (update these paths to point to your actual files)
-LOCAL_DATASET_PATH = "/local/path/to/dataset.zip"       # Path to your dataset on the local machine
-LOCAL_TRAIN_SCRIPT = "/local/path/to/train_lora.py"       # Path to your LoRA training script
-
-# Remote working directory configuration on the RunPod instance.
-REMOTE_WORK_DIR = "/home/ubuntu/lora_training"           # Remote directory where files will be stored
-REMOTE_DATASET_PATH = f"{REMOTE_WORK_DIR}/dataset.zip"    # Remote path for the uploaded dataset
-REMOTE_TRAIN_SCRIPT = f"{REMOTE_WORK_DIR}/train_lora.py"  # Remote path for the training script
-REMOTE_MODEL_PATH = f"{REMOTE_WORK_DIR}/trained_model.lora"  # Remote path where the trained model will be saved
-
-# Local path where the trained model will be saved after downloading.
-LOCAL_MODEL_SAVE_PATH = "/local/path/to/trained_model.lora"  # Update with your desired local save path
-
-# SSH configuration for connecting to the RunPod instance (update accordingly)
-SSH_USERNAME = "ubuntu"                                 # SSH username on the remote instance
-SSH_KEY_PATH = "/path/to/your/ssh_key.pem"              # Path to your SSH private key
-
-# Timing configurations
-INSTANCE_READY_WAIT = 30         # Seconds to wait for the instance to become ready
-TRAINING_CHECK_INTERVAL = 10     # Seconds between each check of the training process status
-
-# -------------------------------------------------------------------------
-# Logging Configuration
-# -------------------------------------------------------------------------
-# Configure logging to include time, log level, and message details.
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s: %(message)s",
-    datefmt="%H:%M:%S",
-)
-
-# -------------------------------------------------------------------------
-# RunPod API and Remote Instance Interaction Functions
-# -------------------------------------------------------------------------
-
-async def launch_instance():
-    """
-    Launch a GPU instance on RunPod using the RunPod API.
-
-    Sends a POST request with the INSTANCE_PAYLOAD and expects a response
-    containing 'instance_id' and 'instance_ip'. These values are required to
-    further interact with the instance.
-
-    Raises:
-        Exception: If the API call fails or required data is missing.
-
-    Returns:
-        dict: A dictionary containing 'instance_id' and 'instance_ip'.
-    """
-    logging.info("Launching RunPod instance with GPU...")
-    headers = {"Authorization": f"Bearer {API_KEY}"}
-    try:
-        response = requests.post(f"{RUNPOD_API_URL}/launch", json=INSTANCE_PAYLOAD, headers=headers)
-        response.raise_for_status()  # Raise an error if the response status is not OK.
-        data = response.json()
-
-        instance_id = data.get("instance_id")
-        instance_ip = data.get("instance_ip")
-        if not instance_id or not instance_ip:
-            raise ValueError("API response missing 'instance_id' or 'instance_ip'. Please check the API response and payload.")
-
-        logging.info(f"Instance launched successfully. ID: {instance_id}, IP: {instance_ip}")
-        return {"instance_id": instance_id, "instance_ip": instance_ip}
-    except Exception as e:
-        logging.error(f"Error launching instance: {e}")
-        raise
-
-def upload_files(instance_ip):
-    """
-    Upload local dataset and training script to the remote RunPod instance using SCP.
-
-    This function:
-      1. Creates the remote working directory.
-      2. Uploads the dataset file.
-      3. Uploads the training script.
-
-    Args:
-        instance_ip (str): The IP address of the RunPod instance.
-
-    Raises:
-        subprocess.CalledProcessError: If any command (SSH/SCP) fails.
-    """
-    try:
-        logging.info("Creating remote working directory...")
-        # Create the remote directory using SSH
-        cmd_mkdir = [
-            "ssh", "-i", SSH_KEY_PATH,
-            f"{SSH_USERNAME}@{instance_ip}",
-            f"mkdir -p {REMOTE_WORK_DIR}"
-        ]
-        subprocess.run(cmd_mkdir, check=True)
-
-        logging.info("Uploading dataset to remote instance...")
-        # Upload the dataset using SCP
-        cmd_scp_dataset = [
-            "scp", "-i", SSH_KEY_PATH,
-            LOCAL_DATASET_PATH,
-            f"{SSH_USERNAME}@{instance_ip}:{REMOTE_DATASET_PATH}"
-        ]
-        subprocess.run(cmd_scp_dataset, check=True)
-
-        logging.info("Uploading training script to remote instance...")
-        # Upload the training script using SCP
-        cmd_scp_script = [
-            "scp", "-i", SSH_KEY_PATH,
-            LOCAL_TRAIN_SCRIPT,
-            f"{SSH_USERNAME}@{instance_ip}:{REMOTE_TRAIN_SCRIPT}"
-        ]
-        subprocess.run(cmd_scp_script, check=True)
-
-        logging.info("Files uploaded successfully.")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error uploading files: {e}")
-        raise
-
-def run_training(instance_ip):
-    """
-    Start the LoRA training process on the remote RunPod instance via SSH.
-
-    Constructs the command to execute the training script remotely with the necessary
-    arguments (dataset path and output model path). The process is initiated asynchronously.
-
-    Args:
-        instance_ip (str): The IP address of the remote instance.
-
-    Returns:
-        subprocess.Popen: Handle to the training process.
-    """
-    # Construct the command string. Modify parameters if your training script requires different arguments.
-    training_command = f"python {REMOTE_TRAIN_SCRIPT} --dataset {REMOTE_DATASET_PATH} --output {REMOTE_MODEL_PATH}"
-    logging.info(f"Starting training process with command: {training_command}")
-
-    # Build the SSH command to execute the training process remotely.
-    ssh_cmd = [
-        "ssh", "-i", SSH_KEY_PATH,
-        f"{SSH_USERNAME}@{instance_ip}",
-        training_command
-    ]
-    
-    # Launch the command asynchronously (non-blocking)
-    process = subprocess.Popen(ssh_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return process
-
-async def wait_for_training(process):
-    """
-    Asynchronously monitor the remote training process until it completes.
-
-    Periodically checks the status of the training process. If the process ends with
-    a non-zero exit code, logs the error details.
-
-    Args:
-        process (subprocess.Popen): The subprocess running the training command.
-
-    Raises:
-        Exception: If the training process fails (non-zero exit code).
-    """
-    logging.info("Waiting for the training process to complete...")
-    while True:
-        ret = process.poll()  # Check if the process has terminated
-        if ret is not None:
-            if ret == 0:
-                logging.info("Training process completed successfully.")
-            else:
-                # Retrieve stdout and stderr for detailed error logging
-                stdout, stderr = process.communicate()
-                logging.error(f"Training process exited with code {ret}.")
-                logging.error(f"STDOUT: {stdout.decode('utf-8')}")
-                logging.error(f"STDERR: {stderr.decode('utf-8')}")
-                raise Exception("Training process failed. Check the logs for details.")
-            break
-        # Wait for a specified interval before re-checking
-        await asyncio.sleep(TRAINING_CHECK_INTERVAL)
-
-def download_model(instance_ip):
-    """
-    Download the trained LoRA model from the remote instance using SCP.
-
-    Transfers the trained model file from the remote instance (REMOTE_MODEL_PATH)
-    to the local machine (LOCAL_MODEL_SAVE_PATH).
-
-    Args:
-        instance_ip (str): The IP address of the remote instance.
-
-    Raises:
-        subprocess.CalledProcessError: If the SCP command fails.
-    """
-    try:
-        logging.info("Downloading the trained model from remote instance...")
-        # Construct the SCP command to download the model
-        cmd_scp_model = [
-            "scp", "-i", SSH_KEY_PATH,
-            f"{SSH_USERNAME}@{instance_ip}:{REMOTE_MODEL_PATH}",
-            LOCAL_MODEL_SAVE_PATH
-        ]
-        subprocess.run(cmd_scp_model, check=True)
-        logging.info(f"Model downloaded successfully to: {LOCAL_MODEL_SAVE_PATH}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error downloading model: {e}")
-        raise
-
-def cleanup_instance(instance_ip):
-    """
-    Clean up the remote instance by removing the dataset, training script, and model files.
-
-    Executes an SSH command to delete the specified files from the remote working directory.
-    This is important to free up space and maintain security after the training is complete.
-
-    Args:
-        instance_ip (str): The IP address of the remote instance.
-    """
-    cleanup_command = f"rm -f {REMOTE_DATASET_PATH} {REMOTE_TRAIN_SCRIPT} {REMOTE_MODEL_PATH}"
-    logging.info("Cleaning up remote instance files...")
-    ssh_cmd = [
-        "ssh", "-i", SSH_KEY_PATH,
-        f"{SSH_USERNAME}@{instance_ip}",
-        cleanup_command
-    ]
-    try:
-        subprocess.run(ssh_cmd, check=True)
-        logging.info("Remote cleanup completed successfully.")
-    except subprocess.CalledProcessError as e:
-        logging.warning(f"Cleanup encountered issues: {e}")
-
-def shutdown_instance(instance_id):
-    """
-    Shutdown the RunPod instance using the RunPod API.
-
-    Sends a POST request to the shutdown endpoint with the instance_id.
-    This function should be called regardless of previous errors to avoid unnecessary costs.
-
-    Args:
-        instance_id (str): The unique identifier of the instance to be shutdown.
-    """
-    logging.info(f"Shutting down instance with ID: {instance_id}")
-    headers = {"Authorization": f"Bearer {API_KEY}"}
-    try:
-        response = requests.post(f"{RUNPOD_API_URL}/shutdown/{instance_id}", headers=headers)
-        response.raise_for_status()
-        logging.info("Instance shutdown successfully.")
-    except Exception as e:
-        logging.error(f"Error shutting down instance: {e}")
-
-# -------------------------------------------------------------------------
-# Main Execution Workflow
-# -------------------------------------------------------------------------
-
-async def main():
-    """
-    Main asynchronous workflow that orchestrates the full process:
-    
-        1. Launch the RunPod instance.
-        2. Wait for the instance to be ready.
-        3. Upload necessary files (dataset and training script).
-        4. Start the training process.
-        5. Monitor the training process until completion.
-        6. Download the trained model.
-        7. Clean up remote files.
-        8. Shutdown the instance.
-
-    This function includes robust error handling to ensure that the instance is shutdown
-    even if any part of the process fails.
-    """
-    instance_data = None
-    try:
-        # Step 1: Launch RunPod GPU instance.
-        instance_data = await launch_instance()
-        instance_id = instance_data["instance_id"]
-        instance_ip = instance_data["instance_ip"]
-
-        # Step 2: Wait for the instance to be fully ready.
-        logging.info(f"Waiting {INSTANCE_READY_WAIT} seconds for instance readiness...")
-        await asyncio.sleep(INSTANCE_READY_WAIT)
-
-        # Step 3: Upload local files to the remote instance.
-        upload_files(instance_ip)
-
-        # Step 4: Start the remote training process.
-        training_process = run_training(instance_ip)
-
-        # Step 5: Asynchronously wait for training to finish.
-        await wait_for_training(training_process)
-
-        # Step 6: Download the trained model back to the local machine.
-        download_model(instance_ip)
-
-        # Step 7: Clean up files on the remote instance.
-        cleanup_instance(instance_ip)
-
-    except Exception as e:
-        logging.error(f"An error occurred during the workflow: {e}")
-    finally:
-        # Step 8: Shutdown the instance to avoid unnecessary charges.
-        if instance_data:
-            shutdown_instance(instance_data["instance_id"])
-        else:
-            logging.warning("Instance was not launched; skipping shutdown.")
-
-# -------------------------------------------------------------------------
-# Entry Point of the Script
-# -------------------------------------------------------------------------
-if __name__ == "__main__":
-    try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        logging.warning("Script interrupted by user. Exiting gracefully...")
-        sys.exit(0)
+#!/usr/bin/env python3
+"""
+RunPod LoRA Training Automation Script
+---------------------------------------
+
+This script automates the process of training a LoRA model on a RunPod GPU instance.
+For every training job it performs the following steps:
+
+    1. Launch a GPU instance on RunPod via the API.
+    2. Upload necessary files (dataset and training script) to the instance.
+    3. Start the LoRA training process remotely.
+    4. Asynchronously wait for the training process to complete.
+    5. Download the trained model back to the local machine.
+    6. Clean up remote files (dataset, training script, and model) from the instance.
+    7. Shutdown the GPU instance on RunPod.
+
+All I/O is non-blocking: RunPod API calls go through a shared httpx.AsyncClient
+and ssh/scp run via asyncio.create_subprocess_exec, so a single process can drive
+many users' training jobs concurrently (see MAX_CONCURRENT_JOBS).
+
+This script is designed to be stable, well-logged, and modular, so it can be easily
+modified, scaled, or integrated into your main project.
+
+Before running, ensure that:
+    - You have a valid RunPod API key.
+    - The RunPod API URL is correct.
+    - All file paths (local and remote) are updated to reflect your environment.
+    - SSH credentials (username and SSH key) are correctly configured.
+
+To try the workflow without RunPod or SSH, run it with --fake: the API is served by
+an in-process mock and "remote" commands run locally (see runpod_fake.py).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import httpx
+
+# -------------------------------------------------------------------------
+# Configuration Section - Update these parameters for your environment.
+# -------------------------------------------------------------------------
+
+# RunPod API endpoint (update if needed)
+RUNPOD_API_URL = "https://api.runpod.io"  # Replace with your actual RunPod API endpoint
+
+# API key for authenticating with RunPod.
+API_KEY = "YOUR_API_KEY"  # Replace with your RunPod API key
+
+# Instance configuration payload for launching a GPU instance.
+# Modify parameters such as 'instance_type' and 'image' as per your requirements.
+INSTANCE_PAYLOAD = {
+    "instance_type": "GPU",           # e.g., 'GPU'
+    "image": "your_docker_image",     # Replace with your Docker image that includes the LoRA training environment
+    # Additional parameters can be added here for further customization.
+}
+
+# Local file paths (update these paths to point to your actual files)
+LOCAL_DATASET_PATH = "/local/path/to/dataset.zip"       # Path to your dataset on the local machine
+LOCAL_TRAIN_SCRIPT = "/local/path/to/train_lora.py"       # Path to your LoRA training script
+
+# Remote working directory configuration on the RunPod instance.
+# Every job gets its own subdirectory, so jobs never overwrite each other's files.
+REMOTE_WORK_DIR = "/home/ubuntu/lora_training"           # Remote directory where files will be stored
+
+# Local path where the trained model will be saved after downloading.
+LOCAL_MODEL_SAVE_PATH = "/local/path/to/trained_model.lora"  # Update with your desired local save path
+
+# SSH configuration for connecting to the RunPod instance (update accordingly)
+SSH_USERNAME = "ubuntu"                                 # SSH username on the remote instance
+SSH_KEY_PATH = "/path/to/your/ssh_key.pem"              # Path to your SSH private key
+
+SSH_PORT = 22                                           # Port polled to detect that sshd is up
+
+# Transfer configuration. One multiplexed SSH connection (ControlMaster) is opened per
+# instance and shared by every command and file transfer, so each job pays for a single
+# handshake instead of one per mkdir/scp/training/rm.
+SSH_CONTROL_DIR = os.path.join(tempfile.gettempdir(), "runpod_ssh")  # Directory for ControlMaster sockets
+TRANSFER_COMPRESS = True         # Compress transfers (-z for rsync, -C for scp)
+TRANSFER_RETRIES = 3             # Attempts per transfer; rsync resumes partial files between attempts
+
+# Timing configurations
+INSTANCE_READY_TIMEOUT = 600     # Seconds an instance may take to become reachable before giving up
+READY_POLL_INITIAL = 0.5         # First delay between readiness checks, doubled after each miss...
+READY_POLL_MAX = 10              # ...up to this many seconds
+API_TIMEOUT = 30                 # Seconds before a RunPod API request is abandoned
+
+# Progress lines printed by the training script, e.g. "step 120/1000 loss=0.08".
+PROGRESS_PATTERN = re.compile(r"step\s+(\d+)\s*/\s*(\d+)")
+
+# Upper bound on training jobs (and therefore GPU instances) running at the same time.
+MAX_CONCURRENT_JOBS = 4
+
+# Content-addressed caches. Datasets, training scripts and trained models are stored under
+# their SHA-256, so unchanged inputs are not uploaded again and a dataset that was already
+# trained with the same script is served from cache instead of being retrained.
+LOCAL_CACHE_DIR = os.path.expanduser("~/.cache/runpod_lora")  # Trained models on the local machine
+REMOTE_CACHE_TTL_MINUTES = 120   # Unused files in an instance's cache are deleted after this long
+
+logger = logging.getLogger("runpod_training")
+
+# -------------------------------------------------------------------------
+# Job Description
+# -------------------------------------------------------------------------
+
+@dataclass
+class LoraJob:
+    """
+    Everything needed to train one model.
+
+    Attributes:
+        job_id (str): Unique job name; used in logs and as the remote subdirectory.
+        dataset_path (str): Local path of the dataset archive.
+        model_save_path (str): Local path where the trained model is saved.
+        train_script (str): Local path of the training script.
+        remote_root (str): Remote directory under which the job directory is created.
+        dataset_sha256 (str): SHA-256 of the dataset; filled in by hash_inputs().
+        script_sha256 (str): SHA-256 of the training script; filled in by hash_inputs().
+    """
+    job_id: str
+    dataset_path: str = LOCAL_DATASET_PATH
+    model_save_path: str = LOCAL_MODEL_SAVE_PATH
+    train_script: str = LOCAL_TRAIN_SCRIPT
+    remote_root: str = REMOTE_WORK_DIR
+    dataset_sha256: str = None
+    script_sha256: str = None
+
+    @property
+    def model_key(self):
+        """Cache key of the trained model: the same dataset and script give the same model."""
+        return hashlib.sha256(f"{self.dataset_sha256}:{self.script_sha256}".encode()).hexdigest()
+
+    @property
+    def remote_cache_dir(self):
+        return f"{self.remote_root}/cache"
+
+    @property
+    def remote_cached_model(self):
+        return f"{self.remote_cache_dir}/{self.model_key}.lora"
+
+    @property
+    def remote_work_dir(self):
+        return f"{self.remote_root}/{self.job_id}"
+
+    @property
+    def remote_dataset_path(self):
+        return f"{self.remote_work_dir}/dataset.zip"
+
+    @property
+    def remote_train_script(self):
+        return f"{self.remote_work_dir}/train_lora.py"
+
+    @property
+    def remote_model_path(self):
+        return f"{self.remote_work_dir}/trained_model.lora"
+
+# -------------------------------------------------------------------------
+# Content-Addressed Cache
+# -------------------------------------------------------------------------
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def hash_inputs(job):
+    """Compute the SHA-256 of the job's dataset and training script, unless already known."""
+    if job.dataset_sha256 is None:
+        job.dataset_sha256 = await asyncio.to_thread(file_sha256, job.dataset_path)
+    if job.script_sha256 is None:
+        job.script_sha256 = await asyncio.to_thread(file_sha256, job.train_script)
+
+
+class ArtifactCache:
+    """
+    Local store of trained models keyed by LoraJob.model_key.
+
+    Files are written to a temporary name and renamed into place, so a partially
+    written model is never served.
+    """
+
+    def __init__(self, root=LOCAL_CACHE_DIR):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.lora")
+
+    def get(self, key, destination):
+        """Copy the cached model to destination; return False if it is not cached."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return False
+        shutil.copyfile(path, destination)
+        return True
+
+    def put(self, key, source):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, path)
+
+# -------------------------------------------------------------------------
+# RunPod API and Remote Instance Interaction Functions
+# -------------------------------------------------------------------------
+
+def create_api_client(transport=None):
+    """
+    Create the shared asynchronous HTTP client for the RunPod API.
+
+    One client is reused by all jobs, so connections to the API are pooled.
+
+    Args:
+        transport (httpx.AsyncBaseTransport, optional): Custom transport, e.g. the
+            mock from runpod_fake.py.
+
+    Returns:
+        httpx.AsyncClient: Client with base URL, auth header and timeout configured.
+    """
+    return httpx.AsyncClient(
+        base_url=RUNPOD_API_URL,
+        headers={"Authorization": f"Bearer {API_KEY}"},
+        timeout=API_TIMEOUT,
+        transport=transport,
+    )
+
+async def launch_instance(api):
+    """
+    Launch a GPU instance on RunPod using the RunPod API.
+
+    Sends a POST request with the INSTANCE_PAYLOAD and expects a response
+    containing 'instance_id' and 'instance_ip'. These values are required to
+    further interact with the instance.
+
+    Args:
+        api (httpx.AsyncClient): Client created by create_api_client().
+
+    Raises:
+        Exception: If the API call fails or required data is missing.
+
+    Returns:
+        dict: A dictionary containing 'instance_id' and 'instance_ip'.
+    """
+    logger.info("Launching RunPod instance with GPU...")
+    try:
+        response = await api.post("/launch", json=INSTANCE_PAYLOAD)
+        response.raise_for_status()  # Raise an error if the response status is not OK.
+        data = response.json()
+
+        instance_id = data.get("instance_id")
+        instance_ip = data.get("instance_ip")
+        if not instance_id or not instance_ip:
+            raise ValueError("API response missing 'instance_id' or 'instance_ip'. Please check the API response and payload.")
+
+        logger.info(f"Instance launched successfully. ID: {instance_id}, IP: {instance_ip}")
+        return {"instance_id": instance_id, "instance_ip": instance_ip}
+    except Exception as e:
+        logger.error(f"Error launching instance: {e}")
+        raise
+
+async def shutdown_instance(api, instance_id):
+    """
+    Shutdown the RunPod instance using the RunPod API.
+
+    Sends a POST request to the shutdown endpoint with the instance_id.
+    This function should be called regardless of previous errors to avoid unnecessary costs.
+
+    Args:
+        api (httpx.AsyncClient): Client created by create_api_client().
+        instance_id (str): The unique identifier of the instance to be shutdown.
+
+    Returns:
+        bool: True if the instance is shut down or RunPod no longer knows it, False on error.
+    """
+    logger.info(f"Shutting down instance with ID: {instance_id}")
+    try:
+        response = await api.post(f"/shutdown/{instance_id}")
+        if response.status_code == 404:
+            logger.info("Instance is already gone.")
+            return True
+        response.raise_for_status()
+        logger.info("Instance shutdown successfully.")
+        return True
+    except Exception as e:
+        logger.error(f"Error shutting down instance: {e}")
+        return False
+
+async def wait_until_ready(api, transport, instance, timeout=INSTANCE_READY_TIMEOUT):
+    """
+    Wait until a freshly launched instance can accept SSH connections.
+
+    Polls the RunPod API until the instance reports 'running', then the SSH port,
+    with exponential backoff (READY_POLL_INITIAL doubling up to READY_POLL_MAX), so a
+    fast-booting instance is used within a fraction of a second of becoming ready.
+
+    Args:
+        api (httpx.AsyncClient): Client created by create_api_client().
+        transport (SSHTransport): Transport used to probe the SSH port.
+        instance (dict): Result of launch_instance().
+        timeout (float): Seconds to wait before giving up.
+
+    Raises:
+        TimeoutError: If the instance is not ready within the timeout.
+    """
+    instance_id, instance_ip = instance["instance_id"], instance["instance_ip"]
+    started = time.monotonic()
+    deadline = started + timeout
+    delay = READY_POLL_INITIAL
+    api_ready = False
+    while True:
+        try:
+            if not api_ready:
+                response = await api.get(f"/instances/{instance_id}")
+                response.raise_for_status()
+                api_ready = response.json().get("status") == "running"
+            if api_ready and await transport.is_reachable(instance_ip):
+                logger.info(f"Instance {instance_id} ready after {time.monotonic() - started:.1f}s.")
+                return
+        except httpx.HTTPError as e:
+            logger.warning(f"Readiness check for instance {instance_id} failed: {e}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Instance {instance_id} not ready after {timeout} seconds.")
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, READY_POLL_MAX)
+
+async def run_command(*cmd):
+    """
+    Run a local command (ssh, scp, ...) without blocking the event loop.
+
+    Args:
+        *cmd (str): Program and its arguments.
+
+    Raises:
+        subprocess.CalledProcessError: If the command exits with a non-zero code.
+
+    Returns:
+        bytes: Captured stdout of the command.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return stdout
+
+
+class SSHTransport:
+    """
+    Runs commands on and copies files to/from an instance over one multiplexed SSH connection.
+
+    connect() opens a ControlMaster connection in the background; run(), start(), upload()
+    and download() are routed through its socket, so they skip the TCP and key exchange
+    handshakes. Files are copied with rsync (compressed, partial files kept and resumed on
+    retry); if rsync is not installed locally, scp over the same connection is used.
+
+    Every method is a coroutine backed by asyncio subprocesses. runpod_fake.LocalTransport
+    implements the same interface for running the workflow on the local machine.
+    """
+
+    def __init__(self, username=SSH_USERNAME, key_path=SSH_KEY_PATH, port=SSH_PORT,
+                 compress=TRANSFER_COMPRESS, control_dir=SSH_CONTROL_DIR):
+        self.username = username
+        self.key_path = key_path
+        self.port = port
+        self.compress = compress
+        self.control_dir = control_dir
+        self.use_rsync = shutil.which("rsync") is not None
+        os.makedirs(control_dir, mode=0o700, exist_ok=True)
+
+    def _target(self, instance_ip):
+        return f"{self.username}@{instance_ip}"
+
+    def _options(self, master="no"):
+        # ssh keeps the first value given for an option, so ControlMaster comes first.
+        # Every new instance has an unknown host key: with BatchMode ssh cannot ask about it,
+        # so new keys are accepted (and remembered in our own known_hosts), changed ones are not.
+        # disconnect() forgets the key once the instance is gone.
+        return [
+            "-o", f"ControlMaster={master}",
+            "-o", f"ControlPath={self.control_dir}/%C",
+            "-o", f"Port={self.port}",
+            "-o", "BatchMode=yes",
+            "-o", "StrictHostKeyChecking=accept-new",
+            "-o", f"UserKnownHostsFile={self.control_dir}/known_hosts",
+            "-o", "ServerAliveInterval=30",
+            "-i", self.key_path,
+        ]
+
+    async def is_reachable(self, instance_ip, timeout=2):
+        """Return True if the instance accepts TCP connections on the SSH port."""
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(instance_ip, self.port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+    async def _control(self, instance_ip, command):
+        process = await asyncio.create_subprocess_exec(
+            "ssh", *self._options(), "-O", command, self._target(instance_ip),
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        return await process.wait() == 0
+
+    async def connect(self, instance_ip):
+        """Open the shared connection to the instance, unless it is already open."""
+        if await self._control(instance_ip, "check"):
+            return
+        # -f -N: authenticate, then keep the master running in the background.
+        # Its output is discarded, otherwise the background process would hold our pipes open.
+        process = await asyncio.create_subprocess_exec(
+            "ssh", *self._options("yes"), "-f", "-N", self._target(instance_ip),
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        if await process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, "ssh -f -N")
+        logger.info(f"SSH connection to {instance_ip} opened.")
+
+    async def disconnect(self, instance_ip):
+        """
+        Close the shared connection and forget the host key; safe to call if it is not open.
+
+        RunPod reuses IP addresses, and the next instance on this IP has a new host key;
+        ssh would refuse it ("REMOTE HOST IDENTIFICATION HAS CHANGED") if the old one stayed.
+        """
+        if await self._control(instance_ip, "exit"):
+            logger.info(f"SSH connection to {instance_ip} closed.")
+        host = instance_ip if self.port == 22 else f"[{instance_ip}]:{self.port}"
+        process = await asyncio.create_subprocess_exec(
+            "ssh-keygen", "-R", host, "-f", f"{self.control_dir}/known_hosts",
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        await process.wait()
+
+    async def run(self, instance_ip, command):
+        """Execute a shell command on the instance and wait for it to finish."""
+        return await run_command("ssh", *self._options(), self._target(instance_ip), command)
+
+    async def start(self, instance_ip, command):
+        """Start a long-running command on the instance and return its process handle."""
+        return await asyncio.create_subprocess_exec(
+            "ssh", *self._options(), self._target(instance_ip), command,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+
+    async def _copy(self, source, destination):
+        if self.use_rsync:
+            cmd = [
+                "rsync", "--partial", "--times", "--copy-links",
+                "-e", shlex.join(["ssh", *self._options()]),
+                source, destination,
+            ]
+            if self.compress:
+                cmd.insert(1, "--compress")
+        else:
+            cmd = ["scp", *self._options(), source, destination]
+            if self.compress:
+                cmd.insert(1, "-C")
+
+        for attempt in range(1, TRANSFER_RETRIES + 1):
+            try:
+                await run_command(*cmd)
+                return
+            except subprocess.CalledProcessError as e:
+                if attempt == TRANSFER_RETRIES:
+                    raise
+                logger.warning(f"Transfer {source} -> {destination} failed (attempt {attempt}), retrying: {e}")
+                await asyncio.sleep(2 ** attempt)
+
+    async def upload(self, instance_ip, local_path, remote_path):
+        await self._copy(local_path, f"{self._target(instance_ip)}:{remote_path}")
+
+    async def download(self, instance_ip, remote_path, local_path):
+        await self._copy(f"{self._target(instance_ip)}:{remote_path}", local_path)
+
+
+async def upload_files(transport, instance_ip, job):
+    """
+    Upload the job's dataset and training script to the remote RunPod instance.
+
+    Files are kept in the instance's content-addressed cache (remote_cache_dir/<sha256>)
+    and only uploaded if the cache does not have them yet; the job directory gets
+    symlinks to the cached copies.
+
+    This function:
+      1. Creates the remote working directory and lists the files missing from the cache.
+      2. Uploads the missing files in parallel.
+      3. Links the cached dataset and training script into the job directory.
+
+    Args:
+        transport (SSHTransport): Transport used to reach the instance.
+        instance_ip (str): The IP address of the RunPod instance.
+        job (LoraJob): The job whose files are uploaded.
+
+    Raises:
+        subprocess.CalledProcessError: If any command (SSH/SCP) fails.
+    """
+    await hash_inputs(job)
+    cache = job.remote_cache_dir
+    files = {job.dataset_sha256: job.dataset_path, job.script_sha256: job.train_script}
+    try:
+        logger.info(f"[{job.job_id}] Creating remote working directory...")
+        output = await transport.run(
+            instance_ip,
+            f"mkdir -p {job.remote_work_dir} {cache} && cd {cache} && "
+            f"for f in {' '.join(files)}; do if [ -f $f ]; then touch $f; else echo $f; fi; done",
+        )
+        missing = output.decode().split()
+
+        if missing:
+            logger.info(f"[{job.job_id}] Uploading {len(missing)} of {len(files)} files to remote instance...")
+            # Uploaded under a per-job temporary name, so an interrupted upload never looks
+            # cached and concurrent jobs uploading the same file don't write into each other.
+            await asyncio.gather(*(
+                transport.upload(instance_ip, files[digest], f"{cache}/{digest}.{job.job_id}.part")
+                for digest in missing
+            ))
+        else:
+            logger.info(f"[{job.job_id}] Dataset and training script already cached on the instance.")
+
+        await transport.run(instance_ip, " && ".join([
+            *(f"mv -f {cache}/{digest}.{job.job_id}.part {cache}/{digest}" for digest in missing),
+            f"ln -sf {cache}/{job.dataset_sha256} {job.remote_dataset_path}",
+            f"ln -sf {cache}/{job.script_sha256} {job.remote_train_script}",
+        ]))
+        logger.info(f"[{job.job_id}] Files uploaded successfully.")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"[{job.job_id}] Error uploading files: {e}")
+        raise
+
+async def link_cached_model(transport, instance_ip, job):
+    """
+    Reuse a model the instance already trained for the same inputs (e.g. when a job is
+    retried after a failed download). Returns True if the model was linked into the job
+    directory and training can be skipped.
+    """
+    output = await transport.run(
+        instance_ip,
+        f"if [ -f {job.remote_cached_model} ]; then touch {job.remote_cached_model} && "
+        f"ln -sf {job.remote_cached_model} {job.remote_model_path} && echo hit; fi",
+    )
+    return output.strip() == b"hit"
+
+async def cache_remote_model(transport, instance_ip, job):
+    """Keep the trained model in the instance's cache (a hard link, no copy)."""
+    await transport.run(instance_ip, f"ln -f {job.remote_model_path} {job.remote_cached_model}")
+
+async def run_training(transport, instance_ip, job):
+    """
+    Start the LoRA training process on the remote RunPod instance via SSH.
+
+    Constructs the command to execute the training script remotely with the necessary
+    arguments (dataset path and output model path). The process is started without
+    waiting for it to finish.
+
+    Args:
+        transport (SSHTransport): Transport used to reach the instance.
+        instance_ip (str): The IP address of the remote instance.
+        job (LoraJob): The job to train.
+
+    Returns:
+        asyncio.subprocess.Process: Handle to the training process.
+    """
+    # Construct the command string. Modify parameters if your training script requires different arguments.
+    # -u: unbuffered output, so progress lines arrive as soon as they are printed.
+    training_command = f"python -u {job.remote_train_script} --dataset {job.remote_dataset_path} --output {job.remote_model_path}"
+    logger.info(f"[{job.job_id}] Starting training process with command: {training_command}")
+    return await transport.start(instance_ip, training_command)
+
+async def _read_lines(stream, limit=64 * 1024):
+    """
+    Yield decoded output lines as they arrive.
+
+    Splits on both '\\n' and '\\r' (progress bars redraw one line with carriage
+    returns) and never buffers more than `limit` bytes of an unterminated line.
+    """
+    buffer = b""
+    while chunk := await stream.read(limit):
+        *lines, buffer = re.split(rb"[\r\n]", buffer + chunk)
+        for line in lines:
+            if line:
+                yield line.decode("utf-8", "replace")
+        buffer = buffer[-limit:]
+    if buffer:
+        yield buffer.decode("utf-8", "replace")
+
+async def wait_for_training(process, job, on_progress=None):
+    """
+    Asynchronously wait for the remote training process to complete.
+
+    Reads the process output line by line as it is produced: completion is detected
+    the moment the process exits, and lines matching PROGRESS_PATTERN are reported
+    to on_progress. If the process ends with a non-zero exit code, logs the tail of
+    its output.
+
+    Args:
+        process (asyncio.subprocess.Process): The subprocess running the training command.
+        job (LoraJob): The job being trained.
+        on_progress (callable, optional): Coroutine function called as
+            on_progress(step, total, eta_seconds) for every progress line.
+
+    Raises:
+        Exception: If the training process fails (non-zero exit code).
+    """
+    logger.info(f"[{job.job_id}] Waiting for the training process to complete...")
+    started = time.monotonic()
+    stdout_tail, stderr_tail = deque(maxlen=50), deque(maxlen=50)
+
+    async def read_stdout():
+        async for line in _read_lines(process.stdout):
+            stdout_tail.append(line)
+            match = PROGRESS_PATTERN.search(line)
+            if not match:
+                continue
+            step, total = int(match.group(1)), int(match.group(2))
+            elapsed = time.monotonic() - started
+            eta = elapsed / step * (total - step) if step else None
+            logger.debug(f"[{job.job_id}] Training step {step}/{total}")
+            if on_progress:
+                try:
+                    await on_progress(step, total, eta)
+                except Exception as e:
+                    logger.warning(f"[{job.job_id}] Progress callback failed: {e}")
+
+    async def read_stderr():
+        # Drained concurrently so a chatty stderr can never block the process
+        async for line in _read_lines(process.stderr):
+            stderr_tail.append(line)
+
+    await asyncio.gather(read_stdout(), read_stderr())
+    returncode = await process.wait()
+    if returncode != 0:
+        logger.error(f"[{job.job_id}] Training process exited with code {returncode}.")
+        logger.error("STDOUT: " + "\n".join(stdout_tail))
+        logger.error("STDERR: " + "\n".join(stderr_tail))
+        raise Exception("Training process failed. Check the logs for details.")
+    logger.info(f"[{job.job_id}] Training process completed successfully in {time.monotonic() - started:.1f}s.")
+
+async def download_model(transport, instance_ip, job):
+    """
+    Download the trained LoRA model from the remote instance.
+
+    Transfers the trained model file from the job's remote directory to
+    job.model_save_path on the local machine.
+
+    Args:
+        transport (SSHTransport): Transport used to reach the instance.
+        instance_ip (str): The IP address of the remote instance.
+        job (LoraJob): The job whose model is downloaded.
+
+    Raises:
+        subprocess.CalledProcessError: If the SCP command fails.
+    """
+    try:
+        logger.info(f"[{job.job_id}] Downloading the trained model from remote instance...")
+        await transport.download(instance_ip, job.remote_model_path, job.model_save_path)
+        logger.info(f"[{job.job_id}] Model downloaded successfully to: {job.model_save_path}")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"[{job.job_id}] Error downloading model: {e}")
+        raise
+
+async def cleanup_instance(transport, instance_ip, job):
+    """
+    Clean up the remote instance by removing the job's working directory.
+
+    Deletes the job's links to the dataset and training script and its model. Cached
+    files stay on the instance for later jobs until unused for REMOTE_CACHE_TTL_MINUTES.
+    This is important to free up space and maintain security after the training is complete.
+
+    Args:
+        transport (SSHTransport): Transport used to reach the instance.
+        instance_ip (str): The IP address of the remote instance.
+        job (LoraJob): The job whose files are removed.
+    """
+    logger.info(f"[{job.job_id}] Cleaning up remote instance files...")
+    try:
+        await transport.run(
+            instance_ip,
+            f"rm -rf {job.remote_work_dir} && "
+            f"find {job.remote_cache_dir} -type f -mmin +{REMOTE_CACHE_TTL_MINUTES} -delete",
+        )
+        logger.info(f"[{job.job_id}] Remote cleanup completed successfully.")
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"[{job.job_id}] Cleanup encountered issues: {e}")
+
+# -------------------------------------------------------------------------
+# Main Execution Workflow
+# -------------------------------------------------------------------------
+
+async def train_on_instance(transport, instance_ip, job, timings=None, on_progress=None, cache=None):
+    """
+    Run one job on an instance that is already up: upload, train, download, clean up.
+
+    The instance itself is left running, so the caller may reuse it for the next job.
+    Training is skipped if the instance still has a model trained from the same inputs.
+
+    Args:
+        transport (SSHTransport): Transport used to reach the instance.
+        instance_ip (str): The IP address of the instance.
+        job (LoraJob): The job to train.
+        timings (dict, optional): Filled with seconds spent in 'upload', 'train' and 'download'.
+        on_progress (callable, optional): Passed to wait_for_training.
+        cache (ArtifactCache, optional): Local cache the downloaded model is added to.
+
+    Raises:
+        Exception: If any step fails; remote files may be left behind in that case.
+    """
+    timings = {} if timings is None else timings
+    clock = time.monotonic()
+
+    # All steps below share this connection; it stays open for the next job on the instance.
+    await transport.connect(instance_ip)
+
+    # Step 3: Upload local files to the remote instance.
+    await upload_files(transport, instance_ip, job)
+    timings["upload"], clock = time.monotonic() - clock, time.monotonic()
+
+    if await link_cached_model(transport, instance_ip, job):
+        logger.info(f"[{job.job_id}] Model for these inputs is cached on the instance; skipping training.")
+    else:
+        # Step 4: Start the remote training process.
+        training_process = await run_training(transport, instance_ip, job)
+
+        # Step 5: Asynchronously wait for training to finish.
+        await wait_for_training(training_process, job, on_progress)
+        await cache_remote_model(transport, instance_ip, job)
+    timings["train"], clock = time.monotonic() - clock, time.monotonic()
+
+    # Step 6: Download the trained model back to the local machine.
+    await download_model(transport, instance_ip, job)
+    timings["download"] = time.monotonic() - clock
+    if cache:
+        await asyncio.to_thread(cache.put, job.model_key, job.model_save_path)
+
+    # Step 7: Clean up files on the remote instance.
+    await cleanup_instance(transport, instance_ip, job)
+
+async def train_job(api, transport, job, cache=None):
+    """
+    Orchestrate the full process for one training job on a dedicated instance:
+
+        0. Serve the model from the local cache if these inputs were trained before.
+        1. Launch the RunPod instance.
+        2. Wait for the instance to be ready.
+        3-7. Upload, train, download and clean up (see train_on_instance).
+        8. Shutdown the instance.
+
+    The instance is shutdown even if any part of the process fails.
+
+    Returns:
+        bool: True if the model was trained and downloaded.
+    """
+    instance_data = None
+    try:
+        # Step 0: Skip the instance entirely for a dataset that was already trained.
+        await hash_inputs(job)
+        if cache and await asyncio.to_thread(cache.get, job.model_key, job.model_save_path):
+            logger.info(f"[{job.job_id}] Model served from cache: {job.model_save_path}")
+            return True
+
+        # Step 1: Launch RunPod GPU instance.
+        instance_data = await launch_instance(api)
+
+        # Step 2: Wait for the instance to be fully ready.
+        logger.info(f"[{job.job_id}] Waiting for instance readiness...")
+        await wait_until_ready(api, transport, instance_data)
+
+        await train_on_instance(transport, instance_data["instance_ip"], job, cache=cache)
+        return True
+
+    except Exception as e:
+        logger.error(f"[{job.job_id}] An error occurred during the workflow: {e}")
+        return False
+    finally:
+        # Step 8: Shutdown the instance to avoid unnecessary charges.
+        if instance_data:
+            await transport.disconnect(instance_data["instance_ip"])
+            await shutdown_instance(api, instance_data["instance_id"])
+        else:
+            logger.warning(f"[{job.job_id}] Instance was not launched; skipping shutdown.")
+
+async def main(jobs, api_transport=None, transport=None, cache=None):
+    """
+    Run all jobs concurrently, at most MAX_CONCURRENT_JOBS at a time.
+
+    Jobs with identical inputs are run one after another, so only the first one trains
+    and the rest are served from the cache.
+
+    Args:
+        jobs (list[LoraJob]): Jobs to train.
+        api_transport (httpx.AsyncBaseTransport, optional): Custom transport for the RunPod API.
+        transport (SSHTransport, optional): Transport for reaching instances; SSH by default.
+        cache (ArtifactCache, optional): Local model cache; LOCAL_CACHE_DIR by default.
+
+    Returns:
+        list[bool]: Success flag for every job, in the order given.
+    """
+    transport = transport or SSHTransport()
+    cache = cache or ArtifactCache()
+    limit = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+    same_inputs = {}
+
+    async def limited(api, job):
+        try:
+            await hash_inputs(job)
+        except OSError as e:
+            logger.error(f"[{job.job_id}] Can't read job inputs: {e}")
+            return False
+        async with same_inputs.setdefault(job.model_key, asyncio.Lock()), limit:
+            return await train_job(api, transport, job, cache)
+
+    async with create_api_client(api_transport) as api:
+        return await asyncio.gather(*(limited(api, job) for job in jobs))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train LoRA models on RunPod GPU instances.")
+    parser.add_argument(
+        "--job", action="append", default=[], metavar="DATASET:OUTPUT",
+        help="Dataset archive and model output path; repeat for several jobs.",
+    )
+    parser.add_argument("--train-script", default=LOCAL_TRAIN_SCRIPT, help="Local training script.")
+    parser.add_argument(
+        "--fake", type=int, nargs="?", const=1, default=0, metavar="JOBS",
+        help="Run against the local RunPod/SSH stand-in (runpod_fake.py) with JOBS generated jobs.",
+    )
+    return parser.parse_args(argv)
+
+# -------------------------------------------------------------------------
+# Entry Point of the Script
+# -------------------------------------------------------------------------
+if __name__ == "__main__":
+    # Configure logging to include time, log level, and message details.
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%H:%M:%S",
+    )
+    args = parse_args()
+    try:
+        if args.fake:
+            import runpod_fake
+            results = asyncio.run(runpod_fake.run(args.fake))
+        else:
+            jobs = [
+                LoraJob(f"job{i}", *spec.split(":", 1), train_script=args.train_script)
+                for i, spec in enumerate(args.job, 1)
+            ] or [LoraJob("job1")]
+            results = asyncio.run(main(jobs))
+        sys.exit(0 if all(results) else 1)
+    except KeyboardInterrupt:
+        logger.warning("Script interrupted by user. Exiting gracefully...")
+        sys.exit(0)
@@ -0,0 +1,26 @@
+# users/queries.py
+"""Доступ к данным users через async API QuerySet."""
+import logging
+
+from .models import Referral
+
+logger = logging.getLogger(__name__)
+
+
+async def get_or_create_referral(telegram_user_id):
+    return await Referral.objects.aget_or_create(user_id=telegram_user_id)
+
+
+async def register_referral(telegram_user_id, referral_code):
+    """Привязывает нового пользователя к реферальному коду. True, если получилось."""
+    referral = await Referral.objects.filter(referral_code=referral_code, referred_user_id__isnull=True).afirst()
+    if referral and referral.user_id != telegram_user_id:  # Исключаем самоприглашение
+        # Условный UPDATE: если код успели занять параллельно, ничего не изменится
+        updated = await Referral.objects.filter(pk=referral.pk, referred_user_id__isnull=True).aupdate(
+            referred_user_id=telegram_user_id
+        )
+        if updated:
+            logger.info("✅ Record referal: %s from %s", telegram_user_id, referral.user_id)
+            return True
+    logger.warning("❌ Can't write referal %s using code: %s", telegram_user_id, referral_code)
+    return False
@@ -1,148 +1,320 @@
 # users/views.py
+"""
+Экраны бота (текст + клавиатура).
+
+Статические экраны собираются один раз при импорте для каждого языка из
+LANGUAGES и дальше отдаются из реестра SCREENS — объекты InlineKeyboardMarkup
+в python-telegram-bot неизменяемые, поэтому один экземпляр безопасно
+отправлять всем пользователям. Экран приглашения зависит от пользователя и
+кэшируется отдельно с вытеснением (TTL + LRU), а баланс из payments.Balance
+дописывается к нему при каждом показе.
+"""
+from types import MappingProxyType
+
+from django.conf import settings
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from uuid import uuid4
-from asgiref.sync import sync_to_async
-from .models import Referral
 
-def get_first_screen():
+from ai_photo_bot.cache import TTLCache
+from payments.queries import get_balance
+from .queries import get_or_create_referral
+
+LANGUAGES = ("en", "ru")
+DEFAULT_LANGUAGE = "en"
+
+BUTTONS = {
+    "start": {"en": "Start", "ru": "Начать"},
+    "how_it_works": {"en": "How it works?", "ru": "Как это работает?"},
+    "upload_photos": {"en": "Upload photos", "ru": "Загрузить фото"},
+    "invite_friends": {"en": "Invite friends", "ru": "Пригласить друзей"},
+    "support": {"en": "Support", "ru": "Поддержка"},
+    "pay": {"en": "Pay", "ru": "Оплатить"},
+    "got_it": {"en": "Got it, next", "ru": "Понятно, дальше"},
+    "back": {"en": "Back", "ru": "Назад"},
+    "stripe": {"en": "Stripe", "ru": "Stripe"},
+    "copy_link": {"en": "Copy link", "ru": "Скопировать ссылку"},
+}
+
+
+def language_of(update):
+    """Язык интерфейса по language_code пользователя Telegram."""
+    user = update.effective_user
+    code = (user.language_code or "") if user else ""
+    return "ru" if code.startswith("ru") else DEFAULT_LANGUAGE
+
+
+def button(key, lang, **kwargs):
+    return InlineKeyboardButton(BUTTONS[key][lang], **kwargs)
+
+
+def build_first_screen(lang):
     """
     Первый экран (при /start): одна кнопка Start -> go_to_second_screen
     """
-    text = (
-        "Any photo in 30 sec\n\n"
-        "What can this bot do?\n\n"
-        "Just send your selfie to the bot and it will create your portraits in any style you like!\n"
-    )
+    text = {
+        "en": (
+            "Any photo in 30 sec\n\n"
+            "What can this bot do?\n\n"
+            "Just send your selfie to the bot and it will create your portraits in any style you like!\n"
+        ),
+        "ru": (
+            "Любое фото за 30 секунд\n\n"
+            "Что умеет этот бот?\n\n"
+            "Просто отправьте боту своё селфи, и он создаст ваши портреты в любом стиле!\n"
+        ),
+    }[lang]
     keyboard = [
-        [InlineKeyboardButton("Start", callback_data="go_to_second_screen")]
+        [button("start", lang, callback_data="go_to_second_screen")]
     ]
     return text, InlineKeyboardMarkup(keyboard)
 
 
-def get_second_screen():
+def build_second_screen(lang):
     """
     Второй экран (главное меню).
     Содержит 5 кнопок, каждая в своей строке: How it works?, Upload photos, Invite friends, Support, Pay
     """
-    text = (
-        "Photo studio in your pocket!\n\n"
-        "40 seconds\n\n"
-        "Hello! I'm Cheese Bot 🤘\n"
-        "I'm an AI for creating any photo or video with your face.\n\n"
-        "How does it work?\n"
-        "You can learn more by clicking the button below.\n"
-        "Or, if you're ready, you can pay and then upload your photos!"
-    )
+    text = {
+        "en": (
+            "Photo studio in your pocket!\n\n"
+            "40 seconds\n\n"
+            "Hello! I'm Cheese Bot 🤘\n"
+            "I'm an AI for creating any photo or video with your face.\n\n"
+            "How does it work?\n"
+            "You can learn more by clicking the button below.\n"
+            "Or, if you're ready, you can pay and then upload your photos!"
+        ),
+        "ru": (
+            "Фотостудия в вашем кармане!\n\n"
+            "40 секунд\n\n"
+            "Привет! Я Cheese Bot 🤘\n"
+            "Я нейросеть, которая создаёт любые фото и видео с вашим лицом.\n\n"
+            "Как это работает?\n"
+            "Узнайте подробнее, нажав на кнопку ниже.\n"
+            "Или, если вы готовы, оплатите и загрузите свои фото!"
+        ),
+    }[lang]
     keyboard = [
-        [InlineKeyboardButton("How it works?", callback_data="how_it_works")],
-        [InlineKeyboardButton("Upload photos", callback_data="upload_photos")],
-        [InlineKeyboardButton("Invite friends", callback_data="invite_friends")],
-        [InlineKeyboardButton("Support", callback_data="support")],
-        [InlineKeyboardButton("Pay", callback_data="pay")]  # ВАЖНО: кнопка оплаты
+        [button("how_it_works", lang, callback_data="how_it_works")],
+        [button("upload_photos", lang, callback_data="upload_photos")],
+        [button("invite_friends", lang, callback_data="invite_friends")],
+        [button("support", lang, callback_data="support")],
+        [button("pay", lang, callback_data="pay")]  # ВАЖНО: кнопка оплаты
     ]
     return text, InlineKeyboardMarkup(keyboard)
 
 
-def get_how_it_works_screen():
+def build_how_it_works_screen(lang):
     """
     Экран "How it works?" с двумя кнопками (каждая в своей строке):
     1) Got it, next
     2) Back -> возвращает на второй экран
     """
-    text = (
-        "Upload a photo and the result will amaze you!\n\n"
-        "I am NeuroPix AI \U0001F916\n"
-        "First, I learn from 10 of your photos to create your personal avatar.\n"
-        "After that, I can generate any photo with your facial features.\n"
-        "Impressive, right?\n"
-    )
+    text = {
+        "en": (
+            "Upload a photo and the result will amaze you!\n\n"
+            "I am NeuroPix AI \U0001F916\n"
+            "First, I learn from 10 of your photos to create your personal avatar.\n"
+            "After that, I can generate any photo with your facial features.\n"
+            "Impressive, right?\n"
+        ),
+        "ru": (
+            "Загрузите фото, и результат вас удивит!\n\n"
+            "Я NeuroPix AI \U0001F916\n"
+            "Сначала я учусь на 10 ваших фото, чтобы создать ваш личный аватар.\n"
+            "После этого я могу сгенерировать любое фото с чертами вашего лица.\n"
+            "Впечатляет, правда?\n"
+        ),
+    }[lang]
     keyboard = [
-        [InlineKeyboardButton("Got it, next", callback_data="how_it_works_next")],
-        [InlineKeyboardButton("Back", callback_data="go_back")]
+        [button("got_it", lang, callback_data="how_it_works_next")],
+        [button("back", lang, callback_data="go_back")]
     ]
     return text, InlineKeyboardMarkup(keyboard)
 
 
-
-def get_upload_instructions_screen():
+def build_upload_instructions_screen(lang):
     """
     Сообщение, которое показывается пользователю, когда он оплатил
     и нажимает "Upload photos".
     """
-    text = (
-        "Congratulations, your payment was successful!\n"
-        "Now you can upload 10 photos. After that, you'll get 10 AI-generated images with your avatar.\n\n"
-        "Important points:\n"
-        "• The photos must only include you.\n"
-        "• Avoid photos with extreme facial expressions.\n"
-        "• Use different angles and outfits.\n"
-        "• Good lighting = better results.\n"
-        "• If iPhone asks \"Convert to JPEG\", please accept.\n"
-        "• You can only upload photos once.\n\n"
-        "Please choose your photos carefully and follow the instructions!"
-    )
-    
+    text = {
+        "en": (
+            "Congratulations, your payment was successful!\n"
+            "Now you can upload 10 photos. After that, you'll get 10 AI-generated images with your avatar.\n\n"
+            "Important points:\n"
+            "• The photos must only include you.\n"
+            "• Avoid photos with extreme facial expressions.\n"
+            "• Use different angles and outfits.\n"
+            "• Good lighting = better results.\n"
+            "• If iPhone asks \"Convert to JPEG\", please accept.\n"
+            "• You can only upload photos once.\n\n"
+            "Please choose your photos carefully and follow the instructions!"
+        ),
+        "ru": (
+            "Поздравляем, оплата прошла успешно!\n"
+            "Теперь загрузите 10 фото. После этого вы получите 10 сгенерированных изображений с вашим аватаром.\n\n"
+            "Важно:\n"
+            "• На фото должны быть только вы.\n"
+            "• Избегайте фото с сильными гримасами.\n"
+            "• Используйте разные ракурсы и одежду.\n"
+            "• Хорошее освещение = лучший результат.\n"
+            "• Если iPhone предлагает «Преобразовать в JPEG», соглашайтесь.\n"
+            "• Загрузить фото можно только один раз.\n\n"
+            "Выбирайте фото внимательно и следуйте инструкции!"
+        ),
+    }[lang]
+
     keyboard = [
-        [InlineKeyboardButton("Back", callback_data="go_back")]
+        [button("back", lang, callback_data="go_back")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     return text, reply_markup
 
-    
-
-@sync_to_async
-def get_or_create_referral(telegram_user_id):
-    return Referral.objects.get_or_create(user_id=telegram_user_id)
 
-async def get_invite_friends_screen(telegram_user_id):
-    referral, created = await get_or_create_referral(telegram_user_id)
-    referral_link = f"https://t.me/AIMelnykBot?start=ref_{referral.referral_code}"
+def build_support_screen(lang):
+    """
+    Экран "Support": текст и кнопка "Back" (экран рисуется поверх меню).
+    """
+    text = {
+        "en": "For support, contact @YourSupportUsername or email: support@example.com",
+        "ru": "По вопросам поддержки пишите @YourSupportUsername или на почту: support@example.com",
+    }[lang]
+    keyboard = [
+        [button("back", lang, callback_data="go_back")]
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
 
-    text = (
-        "Invite your friends and get bonuses!\n\n"
-        "Share this link with your friends:\n"
-        f"{referral_link}\n\n"
-        "If they pay for the service, you will get 5 extra generations!"
-    )
 
+def build_payment_screen(lang):
+    """
+    Экран оплаты с одной кнопкой "Stripe" и кнопкой "Back".
+    """
+    text = {
+        "en": (
+            "It's time to proceed with payment!\n"
+            "We've lowered the price!\n\n"
+            "5$ \n\n"
+            "You will get:\n"
+            "• 100 photos\n"
+            "• 40 photos to choose from\n"
+            "• 1 avatar\n"
+            "• Access to 'God mode'\n"
+            "• Excitement from the generated photos!\n\n"
+            "Choose a payment method:"
+        ),
+        "ru": (
+            "Пора перейти к оплате!\n"
+            "Мы снизили цену!\n\n"
+            "5$ \n\n"
+            "Вы получите:\n"
+            "• 100 фото\n"
+            "• 40 фото на выбор\n"
+            "• 1 аватар\n"
+            "• Доступ к «God mode»\n"
+            "• Восторг от сгенерированных фото!\n\n"
+            "Выберите способ оплаты:"
+        ),
+    }[lang]
     keyboard = [
-        [InlineKeyboardButton("Copy link", url=referral_link)],
-        [InlineKeyboardButton("Back", callback_data="go_back")]
+        [button("stripe", lang, callback_data="bank_cards")],
+        [button("back", lang, callback_data="go_back")]
     ]
-
     return text, InlineKeyboardMarkup(keyboard)
 
 
+_BUILDERS = {
+    "first": build_first_screen,
+    "second": build_second_screen,
+    "how_it_works": build_how_it_works_screen,
+    "upload_instructions": build_upload_instructions_screen,
+    "support": build_support_screen,
+    "payment": build_payment_screen,
+}
 
+# (имя экрана, язык) -> (текст, клавиатура); собирается один раз при старте
+SCREENS = MappingProxyType({
+    (name, lang): builder(lang)
+    for name, builder in _BUILDERS.items()
+    for lang in LANGUAGES
+})
 
-def get_support_screen():
-    """
-    Экран "Support" — тоже только текст.
-    """
-    text = (
-        "For support, contact @YourSupportUsername or email: support@example.com"
-    )
-    return text
 
+def get_screen(name, lang=DEFAULT_LANGUAGE):
+    return SCREENS.get((name, lang)) or SCREENS[(name, DEFAULT_LANGUAGE)]
+
+
+def get_first_screen(lang=DEFAULT_LANGUAGE):
+    return get_screen("first", lang)
+
+
+def get_second_screen(lang=DEFAULT_LANGUAGE):
+    return get_screen("second", lang)
+
+
+def get_how_it_works_screen(lang=DEFAULT_LANGUAGE):
+    return get_screen("how_it_works", lang)
+
+
+def get_upload_instructions_screen(lang=DEFAULT_LANGUAGE):
+    return get_screen("upload_instructions", lang)
+
+
+def get_support_screen(lang=DEFAULT_LANGUAGE):
+    return get_screen("support", lang)
+
+
+def get_payment_screen(lang=DEFAULT_LANGUAGE):
+    return get_screen("payment", lang)
+
+
+# (telegram_user_id, язык) -> (текст, клавиатура)
+_invite_screens = TTLCache(maxsize=settings.INVITE_SCREEN_CACHE_SIZE, ttl=settings.INVITE_SCREEN_CACHE_TTL)
+
+
+BALANCE_TEXT = {
+    "en": "Your balance: {generations} generations, {bonuses} bonuses for invited friends.",
+    "ru": "Ваш баланс: генераций — {generations}, бонусов за друзей — {bonuses}.",
+}
+
+
+async def get_invite_friends_screen(telegram_user_id, lang=DEFAULT_LANGUAGE):
+    if lang not in LANGUAGES:
+        lang = DEFAULT_LANGUAGE
+    screen = _invite_screens.get((telegram_user_id, lang))
+    if screen is None:
+        screen = await _build_invite_friends_screen(telegram_user_id, lang)
+        _invite_screens.set((telegram_user_id, lang), screen)
+
+    # Баланс меняется с каждой оплатой приглашённого, поэтому не кэшируется
+    text, keyboard = screen
+    balance = await get_balance(telegram_user_id)
+    if balance is not None:
+        text += "\n\n" + BALANCE_TEXT[lang].format(generations=balance.generations, bonuses=balance.bonuses)
+    return text, keyboard
+
+
+async def _build_invite_friends_screen(telegram_user_id, lang):
+    referral, created = await get_or_create_referral(telegram_user_id)
+    referral_link = referral.get_referral_link()
+
+    text = {
+        "en": (
+            "Invite your friends and get bonuses!\n\n"
+            "Share this link with your friends:\n"
+            f"{referral_link}\n\n"
+            "If they pay for the service, you will get 5 extra generations!"
+        ),
+        "ru": (
+            "Приглашайте друзей и получайте бонусы!\n\n"
+            "Поделитесь этой ссылкой с друзьями:\n"
+            f"{referral_link}\n\n"
+            "Если они оплатят сервис, вы получите 5 дополнительных генераций!"
+        ),
+    }[lang]
 
-def get_payment_screen():
-    """
-    Экран оплаты с одной кнопкой "Stripe" и кнопкой "Back".
-    """
-    text = (
-        "It's time to proceed with payment!\n"
-        "We've lowered the price!\n\n"
-        "5$ \n\n"
-        "You will get:\n"
-        "• 100 photos\n"
-        "• 40 photos to choose from\n"
-        "• 1 avatar\n"
-        "• Access to 'God mode'\n"
-        "• Excitement from the generated photos!\n\n"
-        "Choose a payment method:"
-    )
     keyboard = [
-        [InlineKeyboardButton("Stripe", callback_data="bank_cards")],
-        [InlineKeyboardButton("Back", callback_data="go_back")]
+        [button("copy_link", lang, url=referral_link)],
+        [button("back", lang, callback_data="go_back")]
     ]
+
     return text, InlineKeyboardMarkup(keyboard)